@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .utils import log
+
+
+class AnnounceAdmissionQueue:
+    """
+    Admission control for announce bursts (fleet reboot, broker restart).
+
+    Full announces are expensive (registry rebuild, pydantic models, claim publish),
+    so transports hand them to this queue instead of processing them inline.
+    - Concurrency: number of worker threads.
+    - Rate budget: token bucket shared by all workers (rate_per_sec=0 disables it).
+    - Coalescing: a device queued twice is processed once, with its latest payload.
+    - Priority: devices with pending commands are admitted first.
+    The ingest threads stay free for port data and command responses.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, Dict[str, Any], str], Any],
+        workers: int = 2,
+        rate_per_sec: float = 20.0,
+        burst: int = 20,
+        queue_size: int = 10000,
+        priority_fn: Optional[Callable[[str], bool]] = None,
+    ):
+        """
+        Args:
+            handler: (device_id, payload, protocol) -> result, runs on a worker thread
+            priority_fn: device_id -> bool, True admits the device ahead of the normal queue
+        """
+        self._handler = handler
+        self._priority_fn = priority_fn
+        self._queue_size = max(1, queue_size)
+        self._rate = max(0.0, float(rate_per_sec))
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._last_refill = time.monotonic()
+        self._token_lock = threading.Lock()
+
+        # device_id -> (payload, protocol, on_done); deques only hold ids (lazy removal)
+        self._pending: Dict[str, Tuple[Dict[str, Any], str, Optional[Callable]]] = {}
+        self._high: deque = deque()
+        self._normal: deque = deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._stats = {
+            "queued": 0,
+            "coalesced": 0,
+            "prioritized": 0,
+            "processed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "in_flight": 0,
+            "queue_size": 0
+        }
+
+        self._workers: List[threading.Thread] = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker_loop, name=f"announce-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def submit(self, device_id: str, payload: Dict[str, Any], protocol: str,
+               on_done: Optional[Callable[[Any], None]] = None) -> bool:
+        """
+        Queue an announce. on_done(result) runs after the handler on the worker thread.
+        Returns False if the queue is full (device will re-announce).
+        """
+        urgent = False
+        if self._priority_fn:
+            try:
+                urgent = bool(self._priority_fn(device_id))
+            except Exception:
+                urgent = False
+
+        with self._cond:
+            if device_id in self._pending:
+                self._pending[device_id] = (payload, protocol, on_done)
+                self._stats["coalesced"] += 1
+                if urgent:
+                    # Promote; the stale entry in the normal deque is skipped later
+                    self._high.append(device_id)
+                self._stats["queue_size"] = len(self._pending)
+                return True
+
+            if len(self._pending) >= self._queue_size:
+                self._stats["dropped"] += 1
+                return False
+
+            self._pending[device_id] = (payload, protocol, on_done)
+            if urgent:
+                self._high.append(device_id)
+                self._stats["prioritized"] += 1
+            else:
+                self._normal.append(device_id)
+            self._stats["queued"] += 1
+            self._stats["queue_size"] = len(self._pending)
+            self._cond.notify()
+            return True
+
+    def _next(self) -> Optional[Tuple[str, Tuple[Dict[str, Any], str, Optional[Callable]]]]:
+        """Pop the next admitted device. Caller holds self._cond."""
+        for dq in (self._high, self._normal):
+            while dq:
+                device_id = dq.popleft()
+                item = self._pending.pop(device_id, None)
+                if item is not None:
+                    return device_id, item
+        return None
+
+    def _acquire_token(self):
+        if self._rate <= 0:
+            return
+        while self._running:
+            with self._token_lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def _worker_loop(self):
+        while self._running:
+            with self._cond:
+                entry = self._next()
+                while entry is None and self._running:
+                    self._cond.wait(timeout=1.0)
+                    entry = self._next()
+                if entry is None:
+                    continue
+                self._stats["in_flight"] += 1
+                self._stats["queue_size"] = len(self._pending)
+
+            # Only a worker holding an announce takes a token, so idle workers do not bank them
+            self._acquire_token()
+            device_id, (payload, protocol, on_done) = entry
+            ok = True
+            try:
+                result = self._handler(device_id, payload, protocol)
+                if on_done:
+                    on_done(result)
+            except Exception as e:
+                ok = False
+                log(f"[ANNOUNCE] Failed to process announce from {device_id}: {e}")
+            finally:
+                with self._cond:
+                    self._stats["in_flight"] -= 1
+                    self._stats["processed"] += 1
+                    if not ok:
+                        self._stats["failed"] += 1
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return json.loads(json.dumps(self._stats))
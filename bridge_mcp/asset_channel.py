@@ -0,0 +1,147 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from .config import ASSET_CHANNEL_MAX_BYTES, ASSET_CHANNEL_TTL_MS
+from .utils import log
+
+# (device_id, request_id, asset_id)
+AssetKey = Tuple[str, str, str]
+
+
+class _Blob:
+    """One asset being received: preallocated to its full size, filled in place"""
+
+    __slots__ = ("buffer", "ranges", "expires_at")
+
+    def __init__(self, size: int, expires_at: float):
+        self.buffer = bytearray(size)
+        # Byte ranges written so far as sorted, disjoint [start, end) pairs
+        self.ranges: List[Tuple[int, int]] = []
+        self.expires_at = expires_at
+
+    @property
+    def complete(self) -> bool:
+        return self.ranges == [(0, len(self.buffer))]
+
+    def add(self, offset: int, length: int) -> int:
+        """Mark [offset, offset + length) as written; returns how many of its bytes were not before"""
+        start, end = offset, offset + length
+        new = length
+        merged = []
+        for s, e in self.ranges:
+            if e < offset or s > offset + length:
+                merged.append((s, e))
+                continue
+            new -= max(0, min(e, offset + length) - max(s, offset))
+            start, end = min(s, start), max(e, end)
+        merged.append((start, end))
+        merged.sort()
+        self.ranges = merged
+        return new
+
+
+class AssetChannel:
+    """
+    Binary assets pushed by devices over MQTT / IPC, for devices without an
+    HTTP server to pull from.
+
+    A device sends an asset as chunks tagged with the request id, an asset id,
+    the chunk's byte offset and the asset's total size. The first chunk
+    allocates a bytearray of the full size and every chunk is written into it
+    at its offset (over IPC the socket reads straight into it), so chunks may
+    arrive in any order and are never concatenated. The result references the
+    asset as {"asset_id", "size"} instead of a url; get() waits until every
+    byte has been written, whichever chunks (retransmitted, or split at other
+    boundaries) cover it. Assets are dropped ttl_ms after their first chunk,
+    and at most max_bytes are held at once.
+    """
+
+    def __init__(self, max_bytes: int = ASSET_CHANNEL_MAX_BYTES, ttl_ms: int = ASSET_CHANNEL_TTL_MS):
+        self.max_bytes = max(0, max_bytes)
+        self.ttl_ms = ttl_ms
+        self._blobs: Dict[AssetKey, _Blob] = {}
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._completed = threading.Condition(self._lock)
+        self._stats = {"chunks": 0, "bytes": 0, "completed": 0, "read": 0, "missing": 0, "rejected": 0, "expired": 0}
+
+    @staticmethod
+    def parse_topic(topic: str) -> Optional[Tuple[str, str, str, int, int]]:
+        """mcp/dev/{device_id}/assets/{request_id}/{asset_id}/{offset}/{size} -> its fields"""
+        parts = topic.split("/")
+        if len(parts) != 8 or parts[:2] != ["mcp", "dev"] or parts[3] != "assets":
+            return None
+        try:
+            return parts[2], parts[4], parts[5], int(parts[6]), int(parts[7])
+        except ValueError:
+            return None
+
+    def chunk_view(self, device_id: str, rid: str, asset_id: str, offset: int, size: int,
+                   length: int) -> Optional[memoryview]:
+        """Writable slice of the asset's buffer for one chunk; None if the chunk is rejected"""
+        key = (device_id, rid, asset_id)
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None:
+                self._drop_expired()
+                if size < 0 or self._reserved + size > self.max_bytes:
+                    return self._reject(key, f"{size} bytes would exceed {self.max_bytes} held")
+                blob = self._blobs[key] = _Blob(size, time.monotonic() + self.ttl_ms / 1000.0)
+                self._reserved += size
+            if len(blob.buffer) != size or offset < 0 or length < 0 or offset + length > size:
+                return self._reject(key, f"chunk {offset}+{length} does not fit size {len(blob.buffer)}")
+            return memoryview(blob.buffer)[offset:offset + length]
+
+    def commit(self, device_id: str, rid: str, asset_id: str, offset: int, length: int):
+        """A chunk returned by chunk_view() has been written"""
+        with self._lock:
+            blob = self._blobs.get((device_id, rid, asset_id))
+            if blob is None or blob.complete:
+                return
+            self._stats["chunks"] += 1
+            self._stats["bytes"] += blob.add(offset, length)
+            if blob.complete:
+                self._stats["completed"] += 1
+                self._completed.notify_all()
+
+    def put(self, device_id: str, rid: str, asset_id: str, offset: int, size: int, data: bytes) -> bool:
+        """Store one chunk that arrived as a whole message (MQTT)"""
+        view = self.chunk_view(device_id, rid, asset_id, offset, size, len(data))
+        if view is None:
+            return False
+        view[:] = data
+        self.commit(device_id, rid, asset_id, offset, len(data))
+        return True
+
+    def get(self, device_id: str, rid: str, asset_id: str, timeout_s: float) -> Optional[bytearray]:
+        """The complete asset, waiting up to timeout_s for missing chunks; None if it does not arrive"""
+        key = (device_id, rid, asset_id)
+        with self._lock:
+            done = self._completed.wait_for(
+                lambda: key in self._blobs and self._blobs[key].complete, timeout=timeout_s
+            )
+            if not done:
+                self._stats["missing"] += 1
+                log(f"[ASSET] {asset_id} of {rid} from {device_id} did not arrive within {timeout_s:.1f}s")
+                return None
+            self._stats["read"] += 1
+            # Kept until it expires: a cached result may read it again
+            return self._blobs[key].buffer
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "assets": len(self._blobs), "bytes_held": self._reserved,
+                    "max_bytes": self.max_bytes}
+
+    # ---- caller holds self._lock ----
+
+    def _reject(self, key: AssetKey, reason: str) -> None:
+        self._stats["rejected"] += 1
+        log(f"[ASSET] Rejected chunk of {key[2]} ({key[1]}) from {key[0]}: {reason}")
+        return None
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        for key in [k for k, blob in self._blobs.items() if blob.expires_at <= now]:
+            self._reserved -= len(self._blobs.pop(key).buffer)
+            self._stats["expired"] += 1
@@ -0,0 +1,174 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from .config import ASSET_CACHE_MAX_BYTES, ASSET_FETCH_TIMEOUT_S, ASSET_FETCH_WORKERS
+from .utils import log
+
+# url -> (sha256 of the body, ETag, Last-Modified, fresh until as monotonic time)
+UrlEntry = Tuple[str, Optional[str], Optional[str], float]
+
+
+class AssetFetcher:
+    """
+    Concurrent HTTP fetcher for tool result assets (camera snapshots etc.).
+
+    Each origin (a device's http_base) gets one requests.Session, so connections
+    are kept alive across calls. Bodies are cached by sha256 in an LRU bounded
+    to max_bytes; URLs serving the same content share one entry. A cached URL is
+    revalidated with If-None-Match / If-Modified-Since, so an unchanged snapshot
+    costs a 304 instead of a transfer, and a Cache-Control max-age skips the
+    request until it runs out.
+    """
+
+    # URL validators remembered (their bodies are bounded by max_bytes)
+    MAX_URLS = 4096
+    # Prefetches nobody collected are dropped beyond this many
+    MAX_PREFETCHED = 256
+
+    def __init__(self, workers: int = ASSET_FETCH_WORKERS, max_bytes: int = ASSET_CACHE_MAX_BYTES,
+                 timeout_s: float = ASSET_FETCH_TIMEOUT_S):
+        self.workers = max(1, workers)
+        self.max_bytes = max(0, max_bytes)
+        self.timeout_s = timeout_s
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="asset-fetch")
+        self._sessions: Dict[str, requests.Session] = {}
+        self._blobs: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._urls: "OrderedDict[str, UrlEntry]" = OrderedDict()
+        self._prefetched: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"fetched": 0, "hits": 0, "revalidated": 0, "prefetched": 0, "failed": 0, "evicted": 0,
+                       "bytes_fetched": 0}
+
+    def fetch(self, url: str) -> Optional[bytes]:
+        """Body of url (None if it could not be fetched)"""
+        return self.fetch_many([url])[0]
+
+    def fetch_many(self, urls: List[str]) -> List[Optional[bytes]]:
+        """Bodies of all urls, fetched concurrently; duplicates are fetched once"""
+        futures: Dict[str, Future] = {}
+        with self._lock:
+            for url in urls:
+                if url not in futures:
+                    futures[url] = self._prefetched.pop(url, None)
+        missing = [url for url, future in futures.items() if future is None]
+        if len(missing) == 1 and len(futures) == 1:
+            # Nothing to overlap with: fetch on the caller's thread
+            return [self._fetch(missing[0])] * len(urls)
+        for url in missing:
+            futures[url] = self._pool.submit(self._fetch, url)
+        return [futures[url].result() for url in urls]
+
+    def prefetch(self, urls: Iterable[str]):
+        """Start fetching urls in the background; the next fetch of each one collects the result"""
+        with self._lock:
+            for url in urls:
+                if url in self._prefetched:
+                    continue
+                self._prefetched[url] = self._pool.submit(self._fetch, url)
+                self._stats["prefetched"] += 1
+                while len(self._prefetched) > self.MAX_PREFETCHED:
+                    del self._prefetched[next(iter(self._prefetched))]
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._blobs),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "urls": len(self._urls),
+                "origins": len(self._sessions),
+            }
+
+    def _session(self, url: str) -> requests.Session:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(origin)
+            if session is None:
+                session = self._sessions[origin] = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+            return session
+
+    def _fetch(self, url: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._urls.get(url)
+            cached = self._blobs.get(entry[0]) if entry else None
+            if cached is not None and entry[3] > time.monotonic():
+                self._touch(url, entry[0])
+                self._stats["hits"] += 1
+                return cached
+
+        # no-cache keeps proxies from serving a stale snapshot (replaces the old ?t= cache buster)
+        headers = {"Cache-Control": "no-cache"}
+        if cached is not None:
+            if entry[1]:
+                headers["If-None-Match"] = entry[1]
+            if entry[2]:
+                headers["If-Modified-Since"] = entry[2]
+        try:
+            response = self._session(url).get(url, headers=headers, timeout=self.timeout_s)
+            if response.status_code == 304 and cached is not None:
+                with self._lock:
+                    # The blob may have been evicted while the request was in flight: put it back
+                    self._keep(url, entry[0], cached, (entry[0], entry[1], entry[2], self._fresh_until(response)))
+                    self._stats["revalidated"] += 1
+                return cached
+            response.raise_for_status()
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            log(f"[ASSET] Failed to fetch {url}: {e}")
+            return None
+
+        body = response.content
+        with self._lock:
+            self._stats["fetched"] += 1
+            self._stats["bytes_fetched"] += len(body)
+            if "no-store" not in response.headers.get("Cache-Control", "") and len(body) <= self.max_bytes:
+                self._store(url, body, response)
+        return body
+
+    @staticmethod
+    def _fresh_until(response: requests.Response) -> float:
+        cache_control = response.headers.get("Cache-Control", "")
+        if "no-cache" in cache_control or "no-store" in cache_control:
+            return 0.0
+        for directive in cache_control.split(","):
+            name, _, value = directive.strip().partition("=")
+            if name.lower() == "max-age" and value.isdigit():
+                return time.monotonic() + int(value)
+        return 0.0
+
+    # ---- caller holds self._lock ----
+
+    def _store(self, url: str, body: bytes, response: requests.Response):
+        digest = hashlib.sha256(body).hexdigest()
+        self._keep(url, digest, body, (digest, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                       self._fresh_until(response)))
+
+    def _keep(self, url: str, digest: str, body: bytes, entry: UrlEntry):
+        if digest not in self._blobs:
+            self._blobs[digest] = body
+            self._size += len(body)
+        self._urls[url] = entry
+        self._touch(url, digest)
+        while self._size > self.max_bytes:
+            _, evicted = self._blobs.popitem(last=False)
+            self._size -= len(evicted)
+            self._stats["evicted"] += 1
+        while len(self._urls) > self.MAX_URLS:
+            self._urls.popitem(last=False)
+
+    def _touch(self, url: str, digest: str):
+        self._urls.move_to_end(url)
+        self._blobs.move_to_end(digest)
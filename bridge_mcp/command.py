@@ -1,132 +1,1155 @@
 import queue
+import heapq
+from collections import OrderedDict, deque
 import threading
 import json
+import random
 import uuid
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, List, Callable
 from .utils import log
-from .config import CMD_TIMEOUT_MS, MQTT_HOST, MQTT_PORT
+from .config import (
+    MQTT_HOST,
+    MQTT_PORT,
+    TOPIC_GROUP_CMD,
+    CMD_BATCH_MAX,
+    CMD_RETRY_MAX,
+    CMD_RETRY_BACKOFF_MS,
+    CMD_HEDGE,
+    CMD_HEDGE_MIN_MS,
+)
 from .device_store import DeviceStore
-import hmac
-import hashlib
+from .device_health import DeviceHealth, BREAKER_CLOSED
+from .device_scheduler import DeviceScheduler, PRIORITY_INTERACTIVE, PRIORITY_FANOUT
+from .command_signer import CommandSigner
+from .device_outbox import DeviceOutbox
 import time
 
+class _TaggedSink:
+    """Per-request slot that forwards (rid, payload) into a queue shared by a command batch"""
+
+    def __init__(self, rid: str, sink: queue.Queue):
+        self._rid = rid
+        self._sink = sink
+
+    def put_nowait(self, payload: Dict[str, Any]):
+        self._sink.put_nowait((self._rid, payload))
+
+
+class _ResultStream:
+    """
+    Partial results of one request ({"partial": true, "seq": n, "result": {...}}),
+    released in seq order and merged into the final response: texts are
+    concatenated and assets appended, ahead of the final message's own.
+    """
+
+    __slots__ = ("next_seq", "held", "final", "final_seq", "texts", "assets", "last_at")
+
+    def __init__(self):
+        self.last_at = time.monotonic()  # when the latest message arrived
+        self.next_seq = 0
+        self.held: Dict[int, Dict[str, Any]] = {}  # out-of-order chunks waiting for a gap to fill
+        self.final: Optional[Dict[str, Any]] = None
+        self.final_seq = 0
+        self.texts: List[str] = []
+        self.assets: List[Any] = []
+
+    def add(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Take one message; returns the partial chunks that are now in order"""
+        seq = payload.get("seq")
+        if not isinstance(seq, int):
+            seq = self.next_seq + len(self.held)  # unsequenced: arrival order
+        if not payload.get("partial"):
+            self.final, self.final_seq = payload, seq
+        elif seq >= self.next_seq and seq not in self.held:
+            self.held[seq] = payload
+        ready = []
+        while self.next_seq in self.held:
+            chunk = self.held.pop(self.next_seq)
+            self._append(chunk.get("result") or {})
+            ready.append(chunk)
+            self.next_seq += 1
+        return ready
+
+    def complete(self) -> Optional[Dict[str, Any]]:
+        """The merged response once the final message and every chunk before it arrived"""
+        if self.final is None or self.next_seq < self.final_seq:
+            return None
+        result = self.final.get("result") or {}
+        self._append(result)
+        return {**self.final, "result": {**result, "text": "".join(self.texts), "assets": self.assets},
+                "chunks": self.next_seq}
+
+    def _append(self, result: Dict[str, Any]):
+        if result.get("text"):
+            self.texts.append(str(result["text"]))
+        self.assets.extend(result.get("assets") or ())
+
+
+# Delivered in place of a response when a request's timer expires
+_TIMED_OUT = object()
+
+# Upper bounds (ms past the deadline) of the late-response histogram buckets
+LATE_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000)
+
+
 class CommandWaiter:
-    def __init__(self):
+    """
+    Pending device requests by request id.
+
+    A tool may stream its result as sequenced partial messages before the final
+    one (see _ResultStream); each in-order chunk goes to the request's on_chunk
+    callback and restarts its timeout, so a long-running tool only has to keep
+    making progress.
+
+    Timeouts armed with arm_timeout() sit in one heap served by a single timer
+    thread: when a deadline passes, the request is expired and _TIMED_OUT is put
+    on its queue. Responses for expired requests are counted as late, with a
+    histogram of how far past the deadline they arrived.
+    """
+    # Timed-out requests remembered so a late response still counts as a latency sample
+    EXPIRED_MEMORY = 1024
+
+    def __init__(self, health: Optional[DeviceHealth] = None, scheduler: Optional[DeviceScheduler] = None,
+                 signer: Optional[CommandSigner] = None, outbox: Optional[DeviceOutbox] = None):
         self._qmap: Dict[str, queue.Queue] = {}
         self._rid_to_device: Dict[str, str] = {}
+        self._pending_by_device: Dict[str, int] = {}
+        self._sent: Dict[str, Tuple[Optional[str], Optional[float]]] = {}  # rid -> (tool, sent at; None once re-sent)
+        # rid -> (device_id, tool, sent at, expired at)
+        self._expired: "OrderedDict[str, Tuple[str, Optional[str], Optional[float], float]]" = OrderedDict()
         self._lock = threading.Lock()
+        self._timers: List[Tuple[float, str]] = []  # heap of (expires_at, rid); stale entries are skipped
+        self._deadlines: Dict[str, float] = {}  # rid -> armed expires_at
+        self._windows: Dict[str, float] = {}  # rid -> armed timeout in seconds, restarted by each chunk
+        self._streams: Dict[str, _ResultStream] = {}
+        self._chunk_callbacks: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._timer_cv = threading.Condition(self._lock)
+        self._timer_thread: Optional[threading.Thread] = None
+        self._stats = {"expired": 0, "late": 0, "unmatched": 0, "chunks": 0, "streamed": 0}
+        self._late_hist = [0] * (len(LATE_BUCKETS_MS) + 1)
+        self.health = health or DeviceHealth()
+        # Slots granted by the scheduler are freed whenever a request is forgotten
+        self.scheduler = scheduler or DeviceScheduler()
+        self.signer = signer or CommandSigner()
+        self.outbox = outbox or DeviceOutbox()
 
-    def register(self, rid: str, device_id: Optional[str] = None) -> queue.Queue:
+    def register(self, rid: str, device_id: Optional[str] = None, sink: Optional[queue.Queue] = None,
+                 tool: Optional[str] = None, on_chunk: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        """
+        Returns the queue the response will be put on.
+        With sink, the response is delivered as (rid, payload) to that shared queue instead.
+        on_chunk(partial payload) is called for each streamed chunk, in order.
+        """
         with self._lock:
-            q = queue.Queue(maxsize=1)
+            q = _TaggedSink(rid, sink) if sink is not None else queue.Queue(maxsize=1)
             self._qmap[rid] = q
+            if on_chunk is not None:
+                self._chunk_callbacks[rid] = on_chunk
             if device_id:
                 self._rid_to_device[rid] = device_id
+                self._pending_by_device[device_id] = self._pending_by_device.get(device_id, 0) + 1
+                self._sent[rid] = (tool, time.monotonic())
             return q
 
+    def arm_timeout(self, rid: str, expires_at: float, window_s: Optional[float] = None):
+        """
+        Expire rid at expires_at (time.monotonic()) unless it is resolved or cancelled first.
+        Each streamed chunk restarts the timeout with window_s (default: the time left now).
+        """
+        with self._lock:
+            if rid not in self._qmap:
+                return
+            self._deadlines[rid] = expires_at
+            self._windows[rid] = window_s if window_s is not None else max(0.0, expires_at - time.monotonic())
+            heapq.heappush(self._timers, (expires_at, rid))
+            if len(self._timers) > 2 * len(self._deadlines) + 64:
+                # Mostly answered requests: rebuild instead of waiting for their deadlines to pass
+                self._timers = [(t, r) for t, r in self._timers if self._deadlines.get(r) == t]
+                heapq.heapify(self._timers)
+            if self._timer_thread is None:
+                self._timer_thread = threading.Thread(target=self._timer_loop, name="cmd-timeouts", daemon=True)
+                self._timer_thread.start()
+            elif self._timers[0][1] == rid:
+                self._timer_cv.notify()
+
+    def mark_resent(self, rid: str):
+        """rid was sent again: its answer can't be matched to one send, so it yields no latency sample (Karn)"""
+        with self._lock:
+            sent = self._sent.get(rid)
+            if sent is not None:
+                self._sent[rid] = (sent[0], None)
+
+    def _timer_loop(self):
+        while True:
+            due = []
+            with self._lock:
+                while not due:
+                    now = time.monotonic()
+                    while self._timers and self._timers[0][0] <= now:
+                        expires_at, rid = heapq.heappop(self._timers)
+                        if self._deadlines.get(rid) == expires_at:
+                            due.append(self._expire_locked(rid))
+                    if not due:
+                        self._timer_cv.wait(self._timers[0][0] - now if self._timers else None)
+            for q, device_id in due:
+                try:
+                    if device_id:
+                        self.health.record_timeout(device_id)
+                    if q is not None:
+                        q.put_nowait(_TIMED_OUT)
+                except Exception as e:
+                    log(f"[CMD] Timeout delivery failed: {e}")
+
+    def _forget_device(self, rid: str):
+        """Drop rid -> device mapping, its timer and its scheduler slot. Caller holds self._lock."""
+        self.scheduler.release(rid)
+        self._deadlines.pop(rid, None)
+        self._windows.pop(rid, None)
+        self._streams.pop(rid, None)
+        self._chunk_callbacks.pop(rid, None)
+        self._sent.pop(rid, None)
+        device_id = self._rid_to_device.pop(rid, None)
+        if device_id:
+            n = self._pending_by_device.get(device_id, 0) - 1
+            if n > 0:
+                self._pending_by_device[device_id] = n
+            else:
+                self._pending_by_device.pop(device_id, None)
+
     def unregister(self, rid: str):
         with self._lock:
             self._qmap.pop(rid, None)
-            self._rid_to_device.pop(rid, None)
+            self._forget_device(rid)
+
+    def expire(self, rid: str):
+        """Stop waiting for a request that timed out; counts against the device's health."""
+        with self._lock:
+            _, device_id = self._expire_locked(rid)
+        if device_id:
+            self.health.record_timeout(device_id)
+
+    def _expire_locked(self, rid: str) -> Tuple[Any, Optional[str]]:
+        """Returns (the request's queue, its device). Caller holds self._lock."""
+        q = self._qmap.pop(rid, None)
+        device_id = self._rid_to_device.get(rid)
+        sent = self._sent.get(rid)
+        self._forget_device(rid)
+        self._stats["expired"] += 1
+        if device_id and sent:
+            self._expired[rid] = (device_id, sent[0], sent[1], time.monotonic())
+            if len(self._expired) > self.EXPIRED_MEMORY:
+                self._expired.popitem(last=False)
+        return q, device_id
+
+    def cancel(self, rids) -> int:
+        """Stop waiting for the given requests; late responses are dropped. Returns how many were pending."""
+        cancelled = 0
+        with self._lock:
+            for rid in rids:
+                if self._qmap.pop(rid, None) is not None:
+                    cancelled += 1
+                self._forget_device(rid)
+        return cancelled
+
+    def has_pending(self, device_id: str) -> bool:
+        """True if any command to device_id is awaiting a response or waiting in the outbox."""
+        with self._lock:
+            if device_id in self._pending_by_device:
+                return True
+        return self.outbox.has_queued(device_id)
 
     def resolve(self, rid: str, payload: Dict[str, Any], device_id: Optional[str] = None):
+        # A final message without "seq" still closes a stream its unsequenced chunks started
+        if payload.get("partial") or "seq" in payload or rid in self._streams:
+            payload = self._stream(rid, payload, device_id)
+            if payload is None:
+                return
         with self._lock:
             expected_device = self._rid_to_device.get(rid)
             if expected_device and device_id and expected_device != device_id:
                 return
             q = self._qmap.pop(rid, None)
-            self._rid_to_device.pop(rid, None)
+            sent = self._sent.get(rid)
+            self._forget_device(rid)
+            if sent is None and rid in self._expired:
+                # Late response: the device is alive, just slower than our estimate
+                expected_device, tool, sent_at, expired_at = self._expired[rid]
+                if device_id and expected_device != device_id:
+                    return
+                del self._expired[rid]
+                sent = (tool, sent_at)
+                late_ms = (time.monotonic() - expired_at) * 1000.0
+                self._stats["late"] += 1
+                self._late_hist[next((i for i, b in enumerate(LATE_BUCKETS_MS) if late_ms <= b),
+                                     len(LATE_BUCKETS_MS))] += 1
+            elif q is None:
+                self._stats["unmatched"] += 1
+        if sent is not None and expected_device:
+            latency_ms = (time.monotonic() - sent[1]) * 1000.0 if sent[1] is not None else None
+            self.health.record_response(expected_device, sent[0], latency_ms)
         if q:
             try:
                 q.put_nowait(payload)
             except Exception:
                 pass
+
+    def _stream(self, rid: str, payload: Dict[str, Any], device_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Feed a streamed message; returns the merged response once complete, else None"""
+        with self._lock:
+            expected_device = self._rid_to_device.get(rid)
+            if rid not in self._qmap or (expected_device and device_id and expected_device != device_id):
+                # Not waiting for it (anymore): a lone final message still goes through resolve()
+                return None if payload.get("partial") else payload
+            stream = self._streams.get(rid)
+            if stream is None:
+                stream = self._streams[rid] = _ResultStream()
+            stream.last_at = time.monotonic()
+            ready = stream.add(payload)
+            merged = stream.complete()
+            self._stats["chunks"] += len(ready)
+            if merged is not None:
+                self._stats["streamed"] += 1
+            elif rid in self._deadlines:
+                # Still streaming (even if out of order): restart the request's timeout
+                expires_at = time.monotonic() + self._windows.get(rid, 0.0)
+                self._deadlines[rid] = expires_at
+                heapq.heappush(self._timers, (expires_at, rid))
+            on_chunk = self._chunk_callbacks.get(rid)
+        if on_chunk is not None:
+            for chunk in ready:
+                try:
+                    on_chunk(chunk)
+                except Exception as e:
+                    log(f"[CMD] Chunk callback failed for {rid}: {e}")
+        return merged
+
+    def streaming_since(self, rid: str) -> Optional[float]:
+        """time.monotonic() of the latest streamed message for rid; None if it has not started streaming"""
+        with self._lock:
+            stream = self._streams.get(rid)
+            return stream.last_at if stream is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Pending requests, armed timers, expiries and late / unmatched responses"""
+        with self._lock:
+            histogram = {f"<={b}ms": n for b, n in zip(LATE_BUCKETS_MS, self._late_hist)}
+            histogram[f">{LATE_BUCKETS_MS[-1]}ms"] = self._late_hist[-1]
+            return {
+                "pending": len(self._qmap),
+                "timers": len(self._deadlines),
+                **self._stats,
+                "late_ms_histogram": histogram,
+            }
 
-def publish_cmd(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client, 
-                device_id: str, tool: str, args: Any,
-                request_id: Optional[str]=None, timeout_ms: int=CMD_TIMEOUT_MS,
-                ipc_agent: Any = None) -> Tuple[bool, Dict[str, Any]]:
-    rid = request_id or uuid.uuid4().hex
-    topic = f"mcp/dev/{device_id}/cmd"
-    
-    if isinstance(args, str):
-        parsed_args = {}
-        separator = ',' if ',' in args else '&'
-        for pair in args.split(separator):
-            if '=' in pair:
-                key, value = pair.split('=', 1)
-                parsed_args[key.strip()] = value.strip()
-            elif ':' in pair:
-                key, value = pair.split(':', 1)
-                parsed_args[key.strip()] = value.strip()
-        args = parsed_args
-    elif isinstance(args, dict) and "kwargs" in args and len(args) == 1:
-        args = args["kwargs"]
+def _send_cmd(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+              device_id: str, tool: str, args: Any, rid: str,
+              ipc_agent: Any = None, sink: Optional[queue.Queue] = None,
+              on_chunk: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """Register and publish one command. Returns (response queue, None) or (None, error response)."""
+    args = _normalize_args(args)
     
-    device_info = device_store.get(device_id)
-    if not device_info:
+    info = device_store.get_dispatch_info([device_id]).get(device_id)
+    if info is None:
         log(f"[DEBUG] Device {device_id} not found in store")
-        return False, {"ok": False, "error": {"code": "unknown_device",
-                                              "message": f"device_id '{device_id}' not found in announce cache"},
-                       "request_id": rid}
+        return None, {"ok": False, "error": {"code": "unknown_device",
+                                             "message": f"device_id '{device_id}' not found in announce cache"},
+                      "request_id": rid}
+
+    retry_in_ms = cmd_waiter.health.admit(device_id)
+    if retry_in_ms is not None:
+        return None, {**_circuit_open_response(device_id, retry_in_ms), "request_id": rid}
 
-    protocol = device_info.get("protocol", "mqtt")
+    q = cmd_waiter.register(rid, device_id=device_id, sink=sink, tool=tool, on_chunk=on_chunk)
+    error = _deliver_cmd(cmd_waiter, mqtt_client, device_id, info["protocol"], info["token"], tool, args, rid,
+                         ipc_agent=ipc_agent)
+    if error is not None:
+        cmd_waiter.unregister(rid)
+        return None, {**error, "request_id": rid}
+    return q, None
+
+
+def _deliver_cmd(cmd_waiter: CommandWaiter, mqtt_client, device_id: str, protocol: str, token: Optional[str],
+                 tool: str, args: Any, rid: str, ipc_agent: Any = None) -> Optional[Dict[str, Any]]:
+    """Serialize, sign and send one command. Returns None on success or an error response."""
+    topic = f"mcp/dev/{device_id}/cmd"
     payload = {"type":"device.command","tool":tool,"args":args,"request_id":rid}
+    frame = None
 
     if protocol != "ipc":
-        # HMAC Signing (MQTT path only)
-        token = device_store.get_token(device_id)
+        # HMAC Signing (MQTT path only): serialize once, sign with the device's pre-keyed HMAC
         if token:
-            ts = int(time.time())
-            inner_payload = {"type":"device.command","tool":tool,"args":args,"request_id":rid, "timestamp": ts}
-            inner_payload_str = json.dumps(inner_payload, separators=(',', ':'))
-            signature = hmac.new(
-                token.encode('utf-8'),
-                inner_payload_str.encode('utf-8'),
-                hashlib.sha256
-            ).hexdigest()
-            payload = {
-                "data": inner_payload_str,
-                "signature": signature
-            }
-            log(f"[SEC] Signed command for {device_id} with ts={ts}")
+            payload["timestamp"] = int(time.time())
+            frame = cmd_waiter.signer.envelope(device_id, token, json.dumps(payload, separators=(',', ':')))
         else:
             log(f"[SEC] Warning: No token for {device_id}, sending unsigned command")
-
-    log(f"[DEBUG] Publishing to {topic}: {json.dumps(payload, indent=2)}")
-    q = cmd_waiter.register(rid, device_id=device_id)
+            frame = json.dumps(payload)
 
     if protocol == "ipc":
         if not ipc_agent:
             log(f"[DEBUG] Protocol is IPC but ipc_agent not provided")
-            cmd_waiter.unregister(rid)
-            return False, {"ok": False, "error": {"code": "config_error", "message": "ipc_agent missing"}, "request_id": rid}
+            return {"ok": False, "error": {"code": "config_error", "message": "ipc_agent missing"}}
         
         success = ipc_agent.send_cmd(device_id, payload)
         if success:
             log(f"[DEBUG] IPC send success to {device_id}")
         else:
             log(f"[DEBUG] IPC send failed to {device_id}")
-            cmd_waiter.unregister(rid)
-            return False, {"ok": False, "error": {"code": "ipc_send_failed", "message": "socket error"}, "request_id": rid}
+            return {"ok": False, "error": {"code": "ipc_send_failed", "message": "socket error"}}
 
     else:
         # MQTT Default
         try:
-            mqtt_client.publish(topic, json.dumps(payload), qos=1, retain=False)
-            log(f"[DEBUG] MQTT publish success to {topic}")
+            mqtt_client.publish(topic, frame, qos=1, retain=False)
         except Exception as e:
             log(f"[DEBUG] MQTT publish failed: {e}")
-            cmd_waiter.unregister(rid)
-            return False, {"ok": False, "error": {"code": "mqtt_connect_failed",
-                                                  "message": f"cannot connect to broker {MQTT_HOST}:{MQTT_PORT} ({e})"},
-                           "request_id": rid}
+            return {"ok": False, "error": {"code": "mqtt_connect_failed",
+                                           "message": f"cannot connect to broker {MQTT_HOST}:{MQTT_PORT} ({e})"}}
+
+    return None
+
+
+def _normalize_args(args: Any) -> Any:
+    """Accept "k=v,k2=v2" / "k:v&..." strings and a lone {"kwargs": {...}} wrapper"""
+    if isinstance(args, str):
+        parsed_args = {}
+        separator = ',' if ',' in args else '&'
+        for pair in args.split(separator):
+            if '=' in pair:
+                key, value = pair.split('=', 1)
+                parsed_args[key.strip()] = value.strip()
+            elif ':' in pair:
+                key, value = pair.split(':', 1)
+                parsed_args[key.strip()] = value.strip()
+        return parsed_args
+    if isinstance(args, dict) and "kwargs" in args and len(args) == 1:
+        return args["kwargs"]
+    return args
+
+
+def _circuit_open_response(device_id: str, retry_in_ms: int) -> Dict[str, Any]:
+    return {"ok": False, "error": {"code": "circuit_open",
+                                   "message": f"device '{device_id}' is not responding; "
+                                              f"next attempt allowed in {retry_in_ms}ms"}}
+
+
+def _send_batch_cmd(cmd_waiter: CommandWaiter, mqtt_client, device_id: str,
+                    entries: List[Tuple[str, str, Any]], protocol: str, token: Optional[str],
+                    ipc_agent: Any = None, sink: Optional[queue.Queue] = None) -> Optional[Dict[str, Any]]:
+    """
+    Several commands for one device in a single frame. entries: [(request_id, tool, args)].
+    The device runs them and answers each request_id separately, as for single commands.
+    The frame is serialized and signed once. Returns None on success or an error
+    response that applies to every entry.
+    """
+    retry_in_ms = cmd_waiter.health.admit(device_id)
+    if retry_in_ms is not None:
+        return _circuit_open_response(device_id, retry_in_ms)
+
+    inner_payload = {
+        "type": "device.command_batch",
+        "commands": [{"tool": tool, "args": _normalize_args(args), "request_id": rid} for rid, tool, args in entries],
+    }
+    frame = None
+    if protocol != "ipc":
+        if token:
+            inner_payload["timestamp"] = int(time.time())
+            frame = cmd_waiter.signer.envelope(device_id, token, json.dumps(inner_payload, separators=(',', ':')))
+        else:
+            log(f"[SEC] Warning: No token for {device_id}, sending unsigned command batch")
+            frame = json.dumps(inner_payload)
+
+    for rid, tool, _ in entries:
+        cmd_waiter.register(rid, device_id=device_id, sink=sink, tool=tool)
+    rids = [rid for rid, _, _ in entries]
+
+    if protocol == "ipc":
+        if not ipc_agent:
+            cmd_waiter.cancel(rids)
+            return {"ok": False, "error": {"code": "config_error", "message": "ipc_agent missing"}}
+        if not ipc_agent.send_cmd(device_id, inner_payload):
+            cmd_waiter.cancel(rids)
+            return {"ok": False, "error": {"code": "ipc_send_failed", "message": "socket error"}}
+    else:
+        try:
+            mqtt_client.publish(f"mcp/dev/{device_id}/cmd", frame, qos=1, retain=False)
+        except Exception as e:
+            log(f"[DEBUG] MQTT batch publish failed: {e}")
+            cmd_waiter.cancel(rids)
+            return {"ok": False, "error": {"code": "mqtt_connect_failed",
+                                           "message": f"cannot connect to broker {MQTT_HOST}:{MQTT_PORT} ({e})"}}
+    log(f"[CMD] Sent {len(entries)} commands to {device_id} in one frame")
+    return None
+
+
+def _send_group_cmd(cmd_waiter: CommandWaiter, mqtt_client, group_request_id: str, tool: str, args: Any,
+                    members: List[Tuple[str, str, Optional[str]]], sink: queue.Queue) -> Optional[Dict[str, Any]]:
+    """
+    One MQTT publish for many devices. members: [(device_id, request_id, token)].
+    Devices subscribed to TOPIC_GROUP_CMD act only if listed in "targets" and reply
+    on their own events topic with their request_id (group_request_id:device_id).
+    The payload is serialized once; each member's token signs that same string.
+    Returns None on success or an error response.
+    """
+    args = _normalize_args(args)
+    inner_payload = {
+        "type": "device.group_command",
+        "group_request_id": group_request_id,
+        "targets": [device_id for device_id, _, _ in members],
+        "tool": tool,
+        "args": args,
+        "timestamp": int(time.time())
+    }
+    frame = cmd_waiter.signer.group_envelope(
+        json.dumps(inner_payload, separators=(',', ':')),
+        ((device_id, token) for device_id, _, token in members),
+    )
 
+    for device_id, rid, _ in members:
+        cmd_waiter.register(rid, device_id=device_id, sink=sink, tool=tool)
     try:
-        resp = q.get(timeout=timeout_ms/1000.0)
-        return True, resp
-    except queue.Empty:
-        cmd_waiter.unregister(rid)
-        return False, {"ok": False, "error": {"code":"timeout",
-                                              "message": f"no event for request_id={rid} within {timeout_ms}ms"},
+        mqtt_client.publish(TOPIC_GROUP_CMD, frame, qos=1, retain=False)
+        log(f"[CMD] Group command {group_request_id} published to {len(members)} devices")
+        return None
+    except Exception as e:
+        log(f"[DEBUG] MQTT group publish failed: {e}")
+        cmd_waiter.cancel([rid for _, rid, _ in members])
+        return {"ok": False, "error": {"code": "mqtt_connect_failed",
+                                       "message": f"cannot connect to broker {MQTT_HOST}:{MQTT_PORT} ({e})"}}
+
+
+# Sink marker: a queued command of the batch was granted a device slot
+_GRANTED = object()
+
+
+def _timeout_response(rid: str, timeout_ms: int) -> Dict[str, Any]:
+    return {"ok": False, "error": {"code":"timeout",
+                                   "message": f"no event for request_id={rid} within {timeout_ms}ms"},
+            "request_id": rid}
+
+
+def _queue_timeout_response(rid: str, timeout_ms: int) -> Dict[str, Any]:
+    """Timed out before the device had a free slot; the command was never sent"""
+    return {"ok": False, "error": {"code": "timeout", "stage": "queue",
+                                   "message": f"device busy: request_id={rid} got no slot within {timeout_ms}ms"},
+            "request_id": rid}
+
+
+def _outbox_timeout_response(rid: str, ttl_ms: int) -> Dict[str, Any]:
+    return {"ok": False, "error": {"code": "timeout",
+                                   "message": f"device stayed offline; command not delivered within {ttl_ms}ms",
+                                   "stage": "outbox"},
+            "request_id": rid}
+
+
+def _cancelled_response(rid: str) -> Dict[str, Any]:
+    return {"ok": False, "error": {"code": "cancelled",
+                                   "message": "completion policy met before a response arrived"},
+            "request_id": rid}
+
+
+def _is_success(ok: bool, resp: Dict[str, Any]) -> bool:
+    return ok and not (isinstance(resp, dict) and resp.get("ok") is False)
+
+
+def publish_cmd(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client, 
+                device_id: str, tool: str, args: Any,
+                request_id: Optional[str]=None, timeout_ms: Optional[int]=None,
+                ipc_agent: Any = None, priority: str = PRIORITY_INTERACTIVE,
+                on_chunk: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Tuple[bool, Dict[str, Any]]:
+    """
+    timeout_ms defaults to the device's adaptive timeout (at most CMD_TIMEOUT_MS).
+    If the tool streams its result, on_chunk gets each partial message as it
+    arrives and every chunk restarts timeout_ms; the return value is the merged response.
+    If the device has no free slot the command first waits in the scheduler,
+    up to timeout_ms; the device then gets its own timeout_ms to respond.
+
+    With the outbox enabled, a command to an offline device (or one whose IPC
+    socket is down) waits in cmd_waiter.outbox until the device comes back,
+    then gets its timeout_ms as usual.
+
+    Idempotent tools are re-sent under the same request id: once as a hedge
+    when no answer came within the tool's p95 latency, and after a timeout up
+    to CMD_RETRY_MAX times with exponential backoff (each attempt gets timeout_ms).
+    Once the tool starts streaming it is no longer re-sent.
+    """
+    rid = request_id or uuid.uuid4().hex
+    timeout_ms = timeout_ms or cmd_waiter.health.timeout_ms(device_id, tool)
+    if cmd_waiter.outbox.enabled and device_store.get_online([device_id]).get(device_id) is False:
+        return _publish_via_outbox(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, timeout_ms,
+                                   ipc_agent=ipc_agent, on_chunk=on_chunk)
+    granted = threading.Event()
+    if not cmd_waiter.scheduler.submit(rid, device_id, priority, on_grant=granted.set):
+        if not granted.wait(timeout_ms / 1000.0):
+            cmd_waiter.scheduler.abandon(rid)
+            return False, _queue_timeout_response(rid, timeout_ms)
+    q, error = _send_cmd(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, ipc_agent=ipc_agent,
+                         on_chunk=on_chunk)
+    return _await_sent(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, q, error, timeout_ms,
+                       ipc_agent=ipc_agent, on_chunk=on_chunk)
+
+
+def _await_sent(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+                device_id: str, tool: str, args: Any, rid: str, q: Any, error: Optional[Dict[str, Any]],
+                timeout_ms: int, ipc_agent: Any = None,
+                on_chunk: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Tuple[bool, Dict[str, Any]]:
+    """Wait for the response to a granted command _send_cmd() just sent (re-sending idempotent tools)"""
+    if error is not None:
+        cmd_waiter.scheduler.release(rid)
+        if error["error"]["code"] == "ipc_send_failed" and cmd_waiter.outbox.enabled:
+            # Socket dropped; the device is probably reconnecting
+            return _publish_via_outbox(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, timeout_ms,
+                                       ipc_agent=ipc_agent, on_chunk=on_chunk)
+        return False, error
+
+    retries, hedge_ms = _retry_policy(device_store, cmd_waiter, device_id, tool)
+    if retries or hedge_ms is not None:
+        return _await_with_retries(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, q,
+                                   timeout_ms, retries, hedge_ms, ipc_agent=ipc_agent)
+    return _await_armed(cmd_waiter, rid, q, timeout_ms, time.monotonic())
+
+
+def _await_armed(cmd_waiter: CommandWaiter, rid: str, q: queue.Queue, timeout_ms: int,
+                 started: float) -> Tuple[bool, Dict[str, Any]]:
+    """Wait for rid on the timer heap: expires timeout_ms after started, pushed back by every streamed chunk"""
+    cmd_waiter.arm_timeout(rid, started + timeout_ms / 1000.0, timeout_ms / 1000.0)
+    resp = q.get()
+    if resp is _TIMED_OUT:
+        return False, _timeout_response(rid, timeout_ms)
+    return True, resp
+
+
+def _retry_policy(device_store: DeviceStore, cmd_waiter: CommandWaiter,
+                  device_id: str, tool: str) -> Tuple[int, Optional[float]]:
+    """(retries, hedge delay in ms or None) for an idempotent tool; (0, None) for any other"""
+    if not device_store.is_idempotent(device_id, tool):
+        return 0, None
+    hedge_ms = None
+    if CMD_HEDGE:
+        p95 = cmd_waiter.health.p95_ms(device_id, tool)
+        if p95 is not None:
+            hedge_ms = max(float(CMD_HEDGE_MIN_MS), p95)
+    return max(0, CMD_RETRY_MAX), hedge_ms
+
+
+def _resend_cmd(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+                device_id: str, tool: str, args: Any, rid: str, ipc_agent: Any = None) -> Optional[Dict[str, Any]]:
+    """Send a registered command again under its request id"""
+    info = device_store.get_dispatch_info([device_id]).get(device_id)
+    if info is None:
+        return {"ok": False, "error": {"code": "unknown_device",
+                                       "message": f"device_id '{device_id}' not found in announce cache"}}
+    cmd_waiter.mark_resent(rid)
+    return _deliver_cmd(cmd_waiter, mqtt_client, device_id, info["protocol"], info["token"], tool,
+                        _normalize_args(args), rid, ipc_agent=ipc_agent)
+
+
+def _await_with_retries(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+                        device_id: str, tool: str, args: Any, rid: str, q: queue.Queue,
+                        timeout_ms: int, retries: int, hedge_ms: Optional[float],
+                        ipc_agent: Any = None) -> Tuple[bool, Dict[str, Any]]:
+    """
+    Wait for an idempotent command that was just sent, re-sending it as needed.
+    Devices ignore a request_id they have already run (or re-send its result),
+    so whichever copy is answered first completes the call. Once a chunk of a
+    streamed result arrives, the device is evidently working on it: no more
+    copies are sent and the wait moves to the timer heap, where each chunk
+    restarts timeout_ms. Only the final give-up counts as a timeout for the
+    device's health, so one call never trips the circuit breaker on its own.
+    """
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        deadline = started + timeout_ms / 1000.0
+        hedge_at = started + hedge_ms / 1000.0 if hedge_ms is not None and hedge_ms < timeout_ms else None
+        while True:
+            try:
+                return True, q.get(timeout=max(0.0, (hedge_at or deadline) - time.monotonic()))
+            except queue.Empty:
+                pass
+            streaming_since = cmd_waiter.streaming_since(rid)
+            if streaming_since is not None:
+                return _await_armed(cmd_waiter, rid, q, timeout_ms, streaming_since)
+            if hedge_at is None:
+                break
+            hedge_at = None
+            cmd_waiter.health.record_retry(device_id, hedge=True)
+            if _resend_cmd(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, ipc_agent) is None:
+                log(f"[CMD] Hedged {tool} on {device_id} ({rid}) after {hedge_ms:.0f}ms")
+
+        if attempt >= retries:
+            cmd_waiter.expire(rid)
+            return False, _timeout_response(rid, timeout_ms)
+        backoff_s = CMD_RETRY_BACKOFF_MS * (2 ** attempt) * random.uniform(0.5, 1.5) / 1000.0
+        attempt += 1
+        try:
+            # A late answer to an earlier copy still wins
+            return True, q.get(timeout=backoff_s)
+        except queue.Empty:
+            pass
+        streaming_since = cmd_waiter.streaming_since(rid)
+        if streaming_since is not None:
+            return _await_armed(cmd_waiter, rid, q, timeout_ms, streaming_since)
+        retry_in_ms = cmd_waiter.health.admit(device_id)
+        if retry_in_ms is not None:
+            cmd_waiter.cancel([rid])
+            return False, {**_circuit_open_response(device_id, retry_in_ms), "request_id": rid}
+        cmd_waiter.health.record_retry(device_id)
+        error = _resend_cmd(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, ipc_agent)
+        if error is not None:
+            cmd_waiter.cancel([rid])
+            return False, {**error, "request_id": rid}
+        log(f"[CMD] Retry {attempt}/{retries} of {tool} on {device_id} ({rid})")
+
+
+def _publish_via_outbox(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+                        device_id: str, tool: str, args: Any, rid: str, timeout_ms: int,
+                        ipc_agent: Any = None,
+                        on_chunk: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Tuple[bool, Dict[str, Any]]:
+    """Queue a command for an unreachable device and wait for flush_outbox() to send it"""
+    outbox = cmd_waiter.outbox
+    waiter = _OutboxWaiter(lambda: _send_cmd(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid,
+                                             ipc_agent=ipc_agent, on_chunk=on_chunk))
+    if not outbox.put(device_id, rid, tool, _normalize_args(args), timeout_ms, waiter=waiter):
+        return False, {"ok": False, "error": {"code": "offline",
+                                              "message": f"Device {device_id} is offline and its outbox is full"},
                        "request_id": rid}
+    log(f"[OUTBOX] Queued {tool} for {device_id} ({rid})")
+    if device_store.get_online([device_id]).get(device_id):
+        # Came back between the check and the put
+        flush_outbox(device_store, cmd_waiter, mqtt_client, device_id, ipc_agent=ipc_agent)
+    if not waiter.wait(outbox.ttl_ms / 1000.0):
+        if outbox.withdraw(device_id, rid):
+            return False, _outbox_timeout_response(rid, outbox.ttl_ms)
+        # Taken for delivery just now: it is sent, or fails, once its turn for a slot comes
+        waiter.wait()
+    q, error = waiter.sent
+    return _await_sent(device_store, cmd_waiter, mqtt_client, device_id, tool, args, rid, q, error, timeout_ms,
+                       ipc_agent=ipc_agent, on_chunk=on_chunk)
+
+
+class _OutboxWaiter:
+    """A caller waiting for its command in the outbox; flush_outbox() sends it, or fails it, in queue order"""
+
+    def __init__(self, send: Callable[[], Tuple[Any, Optional[Dict[str, Any]]]]):
+        self._send = send
+        self._done = threading.Event()
+        self.sent: Optional[Tuple[Any, Optional[Dict[str, Any]]]] = None  # (response queue, error) of _send_cmd()
+
+    def send(self):
+        self.sent = self._send()
+        self._done.set()
+
+    def fail(self, error: Dict[str, Any]):
+        self.sent = (None, error)
+        self._done.set()
+
+    def wait(self, timeout_s: Optional[float] = None) -> bool:
+        return self._done.wait(timeout_s)
+
+
+def flush_outbox(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+                 device_id: str, ipc_agent: Any = None) -> int:
+    """
+    Send a device's queued commands in order, with their original request ids.
+    Called when the device announces or its IPC socket reconnects. A background
+    thread takes each command in turn through the scheduler, so the device's
+    slot limit holds; the caller still waiting for a command then awaits the
+    response as usual (with retries for idempotent tools). Returns how many
+    commands were taken from the outbox.
+    """
+    entries = cmd_waiter.outbox.take(device_id)
+    if not entries:
+        return 0
+    if device_store.get_dispatch_info([device_id]).get(device_id) is None:
+        cmd_waiter.outbox.requeue(device_id, entries)
+        return 0
+    queued = [(entry, cmd_waiter.outbox.claim(entry[0])) for entry in entries]
+    threading.Thread(target=_send_flushed, args=(device_store, cmd_waiter, mqtt_client, device_id, queued, ipc_agent),
+                     name=f"outbox-{device_id}", daemon=True).start()
+    log(f"[OUTBOX] Flushing {len(entries)} queued commands to {device_id}")
+    return len(entries)
+
+
+def _send_flushed(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client, device_id: str,
+                  queued: List[Tuple[Tuple[str, str, Any, float, int], Optional[_OutboxWaiter]]],
+                  ipc_agent: Any = None):
+    """Send flushed commands one after another, each once it is granted a device slot"""
+    for entry, waiter in queued:
+        rid, tool, args, _, timeout_ms = entry
+        try:
+            granted = threading.Event()
+            if not cmd_waiter.scheduler.submit(rid, device_id, PRIORITY_INTERACTIVE, on_grant=granted.set):
+                if not granted.wait(timeout_ms / 1000.0):
+                    cmd_waiter.scheduler.abandon(rid)
+                    if waiter is not None:
+                        waiter.fail(_queue_timeout_response(rid, timeout_ms))
+                    else:
+                        log(f"[OUTBOX] Dropped {rid} for {device_id}: no free slot within {timeout_ms}ms")
+                    continue
+            if waiter is not None:
+                waiter.send()
+                continue
+            # Restored from disk, nobody waits for it: its response or timeout frees the slot
+            info = device_store.get_dispatch_info([device_id]).get(device_id)
+            cmd_waiter.register(rid, device_id=device_id, tool=tool)
+            if info is None or _deliver_cmd(cmd_waiter, mqtt_client, device_id, info["protocol"], info["token"],
+                                            tool, args, rid, ipc_agent=ipc_agent) is not None:
+                cmd_waiter.unregister(rid)
+                cmd_waiter.outbox.requeue(device_id, [entry])
+            else:
+                cmd_waiter.arm_timeout(rid, time.monotonic() + timeout_ms / 1000.0)
+        except Exception as e:
+            log(f"[OUTBOX] Failed to send {rid} to {device_id}: {e}")
+            cmd_waiter.scheduler.release(rid)
+            if waiter is not None and waiter.sent is None:
+                waiter.fail({"ok": False, "error": {"code": "send_failed", "message": str(e)}, "request_id": rid})
+
+
+def publish_cmds(device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+                 commands: List[Dict[str, Any]], deadline_ms: Optional[int] = None,
+                 ipc_agent: Any = None,
+                 on_result: Optional[Callable[[int, bool, Dict[str, Any]], Optional[List[Dict[str, Any]]]]] = None,
+                 max_in_flight_per_device: Optional[int] = None,
+                 complete_after: Optional[int] = None,
+                 priority: str = PRIORITY_FANOUT) -> List[Tuple[bool, Dict[str, Any]]]:
+    """
+    Send a batch of commands at once and wait for all of them together.
+
+    commands: [{"device_id", "tool", "args", "timeout_ms"(optional)}]
+    Each command stops waiting at its own timeout_ms (default: the device's
+    adaptive timeout, at most CMD_TIMEOUT_MS) or
+    the batch deadline_ms, whichever comes first. on_result(index, ok, resp) is
+    called in completion order. Returns (ok, resp) per command, in input order.
+    Total latency is that of the slowest device, not the sum.
+
+    Commands sharing a "group_request_id" (same tool and args) whose devices
+    announced "group_cmd" over MQTT are sent as a single group envelope
+    publish; the rest of the group goes out individually.
+
+    on_result may return follow-up commands (e.g. a pipeline stage whose inputs
+    just became available); they are dispatched at once, get the next indexes
+    and appear at the end of the returned list. Their timeout_ms counts from
+    their own dispatch.
+
+    Commands that become sendable together for a device that announced
+    "batch_cmd" (true, or its max frame size) go out as one
+    device.command_batch frame of up to CMD_BATCH_MAX commands.
+
+    Every command also needs a slot from cmd_waiter.scheduler (shared by all
+    callers, at `priority`); the batch is one caller there, so it takes turns
+    with other batches on the same device. max_in_flight_per_device further
+    caps this batch alone. Commands whose time runs out while held or queued
+    fail without being sent; a sent command's timeout counts from its dispatch.
+
+    complete_after stops the batch once that many commands succeeded (transport
+    ok and response "ok" not false), or once that can no longer happen; the
+    outstanding requests are cancelled in cmd_waiter and reported as "cancelled".
+    """
+    return _CommandBatch(device_store, cmd_waiter, mqtt_client, commands, deadline_ms, ipc_agent, on_result,
+                         max_in_flight_per_device, complete_after, priority).run()
+
+
+class _CommandBatch:
+    """
+    One publish_cmds() call, run on the calling thread.
+
+    A command is admitted (or held while the batch's own per-device cap is
+    reached), waits for a scheduler slot, is sent by the next flush() (alone,
+    in a batch frame, or up front in a group envelope) and is pending until
+    its response or timeout arrives on the sink. Scheduler grants arrive on
+    the same sink, so every state change happens on this thread.
+    """
+
+    def __init__(self, device_store: DeviceStore, cmd_waiter: CommandWaiter, mqtt_client,
+                 commands: List[Dict[str, Any]], deadline_ms: Optional[int], ipc_agent: Any,
+                 on_result: Optional[Callable[[int, bool, Dict[str, Any]], Optional[List[Dict[str, Any]]]]],
+                 max_in_flight_per_device: Optional[int], complete_after: Optional[int], priority: str):
+        self.device_store = device_store
+        self.cmd_waiter = cmd_waiter
+        self.scheduler = cmd_waiter.scheduler
+        self.mqtt_client = mqtt_client
+        self.ipc_agent = ipc_agent
+        self.on_result = on_result
+        self.complete_after = complete_after
+        self.priority = priority
+        self.caller = uuid.uuid4().hex  # the batch takes turns with other callers as one
+        self.deadline_ms = deadline_ms
+        self.deadline = time.monotonic() + deadline_ms / 1000.0 if deadline_ms is not None else None
+        self.limit = max_in_flight_per_device if max_in_flight_per_device and max_in_flight_per_device > 0 else None
+        self.sink: queue.Queue = queue.Queue()
+        self.commands = list(commands)
+        self.results: List[Optional[Tuple[bool, Dict[str, Any]]]] = [None] * len(self.commands)
+        self.plan: Dict[int, Tuple[str, float, int]] = {}  # index -> (rid, expires_at, timeout_ms) from admission
+        self.pending: Dict[str, Tuple[int, float, int, str]] = {}  # rid -> (index, expires_at, timeout_ms, device_id)
+        self.queued: Dict[str, int] = {}  # rid -> index, waiting for a scheduler slot
+        self.outbox: Dict[str, List[int]] = {}  # device_id -> indexes holding a slot, sent together by flush()
+        self.in_flight: Dict[str, int] = {}  # this batch's sent or queued commands per device
+        self.held: Dict[str, deque] = {}  # device_id -> command indexes waiting for a batch slot
+        self.success = 0
+        self.done = 0
+
+    def run(self) -> List[Tuple[bool, Dict[str, Any]]]:
+        count = len(self.commands)  # follow-ups of failed group members are admitted by finish()
+        grouped = self.send_groups()
+        for index in range(count):
+            if index not in grouped:
+                self.admit(index)
+        self.flush()
+
+        while self.pending or self.queued:
+            if self.policy_settled():
+                self.cancel_outstanding()
+                break
+            self.wait_next()
+            if self.queued:
+                self.abandon_queued()
+            self.flush()
+        return self.results
+
+    # ---- admission and scheduler slots ----
+
+    def window(self, cmd: Dict[str, Any]) -> Tuple[float, int]:
+        """(expires_at, timeout_ms) of a command starting now, capped by the batch deadline"""
+        timeout_ms = int(cmd.get("timeout_ms")
+                         or self.cmd_waiter.health.timeout_ms(cmd.get("device_id", ""), cmd.get("tool", "")))
+        expires_at = time.monotonic() + timeout_ms / 1000.0
+        if self.deadline is not None and self.deadline < expires_at:
+            expires_at = self.deadline
+            timeout_ms = self.deadline_ms
+        return expires_at, timeout_ms
+
+    def schedule(self, index: int):
+        cmd = self.commands[index]
+        self.plan[index] = (cmd.get("request_id") or uuid.uuid4().hex, *self.window(cmd))
+
+    def admit(self, index: int):
+        self.schedule(index)
+        device_id = self.commands[index].get("device_id", "")
+        if self.limit is not None and self.in_flight.get(device_id, 0) >= self.limit:
+            self.held.setdefault(device_id, deque()).append(index)
+        else:
+            self.submit(index)
+
+    def submit(self, index: int):
+        """Ask the scheduler for a slot; granted now, or later through the sink"""
+        rid = self.plan[index][0]
+        device_id = self.commands[index].get("device_id", "")
+        self.in_flight[device_id] = self.in_flight.get(device_id, 0) + 1
+        sink = self.sink
+        if self.scheduler.submit(rid, device_id, self.priority, self.caller,
+                                 on_grant=lambda: sink.put_nowait((rid, _GRANTED))):
+            self.dispatch(index)
+        else:
+            self.queued[rid] = index
+
+    def dispatch(self, index: int):
+        """Queue a command that holds a scheduler slot for the next flush()"""
+        self.outbox.setdefault(self.commands[index].get("device_id", ""), []).append(index)
+
+    def release(self, device_id: str):
+        """One of this batch's commands on device_id is done: admit a held one"""
+        n = self.in_flight.get(device_id, 0) - 1
+        if n > 0:
+            self.in_flight[device_id] = n
+        else:
+            self.in_flight.pop(device_id, None)
+        self.drain(device_id)
+
+    def drain(self, device_id: str):
+        waiting = self.held.get(device_id)
+        while waiting and self.in_flight.get(device_id, 0) < self.limit:
+            index = waiting.popleft()
+            rid, expires_at, timeout_ms = self.plan[index]
+            if expires_at <= time.monotonic():
+                self.finish(index, False, _queue_timeout_response(rid, timeout_ms))
+            else:
+                self.submit(index)
+        if not waiting:
+            self.held.pop(device_id, None)
+
+    def wait_next(self):
+        """Handle the next grant or response, or time out at the first queued command's expiry"""
+        # Sent commands are expired by cmd_waiter's timer; only queued ones are timed here
+        wait_s = min(self.plan[i][1] for i in self.queued.values()) - time.monotonic() if self.queued else None
+        try:
+            rid, resp = self.sink.get(timeout=max(0.0, wait_s) if wait_s is not None else None)
+        except queue.Empty:
+            return
+        if resp is _GRANTED:
+            index = self.queued.pop(rid, None)
+            if index is None:
+                # Gave up on it meanwhile
+                self.scheduler.release(rid)
+            else:
+                self.dispatch(index)
+            return
+        entry = self.pending.pop(rid, None)
+        if entry is not None:
+            if resp is _TIMED_OUT:
+                self.finish(entry[0], False, _timeout_response(rid, entry[2]))
+            else:
+                self.finish(entry[0], True, resp)
+            self.release(entry[3])
+
+    # ---- sending: group envelopes, batch frames, single commands ----
+
+    def send_groups(self) -> set:
+        """Send each group's capable MQTT members as one envelope; returns the indexes sent this way"""
+        grouped = set()
+        groups: Dict[str, List[int]] = {}
+        for index, cmd in enumerate(self.commands):
+            if cmd.get("group_request_id"):
+                groups.setdefault(cmd["group_request_id"], []).append(index)
+        if not groups:
+            return grouped
+        commands = self.commands
+        info = self.device_store.get_dispatch_info(
+            commands[i].get("device_id", "") for idxs in groups.values() for i in idxs
+        )
+        for group_request_id, idxs in groups.items():
+            first = commands[idxs[0]]
+            members = [
+                i for i in idxs
+                if (info.get(commands[i].get("device_id", "")) or {}).get("group_cmd")
+                and info[commands[i]["device_id"]]["protocol"] != "ipc"
+                and self.cmd_waiter.health.state(commands[i]["device_id"]) == BREAKER_CLOSED
+                and commands[i].get("tool") == first.get("tool") and commands[i].get("args") == first.get("args")
+            ]
+            if len(members) < 2:
+                continue
+            for i in members:
+                self.schedule(i)
+            # Only devices with a free slot right now join the envelope; the rest queue individually
+            members = [i for i in members
+                       if self.scheduler.submit(self.plan[i][0], commands[i]["device_id"], self.priority, self.caller)]
+            if len(members) < 2:
+                for i in members:
+                    self.scheduler.release(self.plan[i][0])
+                continue
+            error = _send_group_cmd(
+                self.cmd_waiter, self.mqtt_client, group_request_id, first.get("tool", ""), first.get("args") or {},
+                [(commands[i]["device_id"], self.plan[i][0], info[commands[i]["device_id"]]["token"]) for i in members],
+                self.sink,
+            )
+            for i in members:
+                grouped.add(i)
+                rid = self.plan[i][0]
+                if error is not None:
+                    self.scheduler.release(rid)
+                    self.finish(i, False, {**error, "request_id": rid})
+                    continue
+                device_id = commands[i]["device_id"]
+                self.sent(i, self.plan[i][1:], device_id)
+                self.in_flight[device_id] = self.in_flight.get(device_id, 0) + 1
+        return grouped
+
+    def flush(self):
+        """Send everything dispatched since the last flush: one frame per batch-capable device"""
+        info: Dict[str, Dict[str, Any]] = {}
+        while self.outbox:
+            device_id, idxs = self.outbox.popitem()
+            if device_id not in info:
+                info.update(self.device_store.get_dispatch_info([device_id, *self.outbox]))
+            self.send_frames(device_id, idxs, info.get(device_id) or {})
+
+    def send_frames(self, device_id: str, idxs: List[int], d: Dict[str, Any]):
+        """Send a device's dispatched commands, in device.command_batch frames if it announced batch_cmd"""
+        batch_cmd = d.get("batch_cmd")
+        frame_max = CMD_BATCH_MAX if batch_cmd is True else int(batch_cmd or 0)
+        if len(idxs) < 2 or frame_max < 2:
+            for i in idxs:
+                self.send_one(i)
+            return
+        for start in range(0, len(idxs), frame_max):
+            chunk = idxs[start:start + frame_max]
+            if len(chunk) == 1:
+                self.send_one(chunk[0])
+                continue
+            entries = [(self.plan[i][0], self.commands[i].get("tool", ""), self.commands[i].get("args") or {})
+                       for i in chunk]
+            error = _send_batch_cmd(self.cmd_waiter, self.mqtt_client, device_id, entries,
+                                    d.get("protocol", "mqtt"), d.get("token"), ipc_agent=self.ipc_agent, sink=self.sink)
+            for i in chunk:
+                if error is not None:
+                    self.failed(i, error)
+                else:
+                    self.sent(i, self.window(self.commands[i]), device_id)
+
+    def send_one(self, index: int):
+        cmd = self.commands[index]
+        rid = self.plan[index][0]
+        device_id = cmd.get("device_id", "")
+        _, error = _send_cmd(self.device_store, self.cmd_waiter, self.mqtt_client,
+                             device_id, cmd.get("tool", ""), cmd.get("args") or {},
+                             rid, ipc_agent=self.ipc_agent, sink=self.sink)
+        if error is not None:
+            self.failed(index, error)
+        else:
+            self.sent(index, self.window(cmd), device_id)
+
+    def sent(self, index: int, expiry: Tuple[float, int], device_id: str):
+        rid = self.plan[index][0]
+        self.pending[rid] = (index, *expiry, device_id)
+        self.cmd_waiter.arm_timeout(rid, expiry[0])
+
+    def failed(self, index: int, error: Dict[str, Any]):
+        """A send failed: free the command's slot and report the error"""
+        rid = self.plan[index][0]
+        device_id = self.commands[index].get("device_id", "")
+        self.scheduler.release(rid)
+        self.in_flight[device_id] -= 1
+        self.finish(index, False, {**error, "request_id": rid})
+        self.drain(device_id)
+
+    # ---- completion and cancellation ----
+
+    def finish(self, index: int, ok: bool, resp: Dict[str, Any]):
+        self.results[index] = (ok, resp)
+        self.done += 1
+        if _is_success(ok, resp):
+            self.success += 1
+        if not self.on_result:
+            return
+        try:
+            follow_ups = self.on_result(index, ok, resp)
+        except Exception as e:
+            log(f"[CMD] on_result callback failed: {e}")
+            return
+        for cmd in follow_ups or ():
+            self.commands.append(cmd)
+            self.results.append(None)
+            self.admit(len(self.commands) - 1)
+
+    def policy_settled(self) -> bool:
+        """complete_after is reached, or can no longer be"""
+        if self.complete_after is None:
+            return False
+        outstanding = len(self.commands) - self.done
+        return self.success >= self.complete_after or self.success + outstanding < self.complete_after
+
+    def cancel_outstanding(self):
+        """Cancel everything sent, queued for a slot or held, reporting each as cancelled"""
+        self.cmd_waiter.cancel(list(self.pending))
+        for rid, entry in list(self.pending.items()):
+            self.finish(entry[0], False, _cancelled_response(rid))
+        self.pending.clear()
+        self.abandon_queued(cancel=True)
+        for waiting in self.held.values():
+            for index in waiting:
+                self.finish(index, False, _cancelled_response(self.plan[index][0]))
+        self.held.clear()
+
+    def abandon_queued(self, cancel: bool = False):
+        """Give up on commands still waiting for a scheduler slot: all of them, or those whose time is up"""
+        now = time.monotonic()
+        for rid, index in list(self.queued.items()):
+            _, expires_at, timeout_ms = self.plan[index]
+            if not cancel and expires_at > now:
+                continue
+            del self.queued[rid]
+            self.scheduler.abandon(rid)
+            if cancel:
+                self.finish(index, False, _cancelled_response(rid))
+            else:
+                self.finish(index, False, _queue_timeout_response(rid, timeout_ms))
+                self.release(self.commands[index].get("device_id", ""))
@@ -0,0 +1,55 @@
+import hashlib
+import hmac
+import json
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class CommandSigner:
+    """
+    HMAC-SHA256 signing of device command payloads.
+
+    hmac.new() re-derives the padded inner/outer keys on every call. The signer
+    keys one HMAC object per device once and signs each message on a copy(),
+    which only clones the two hash states. An entry is rebuilt when the device's
+    token changes, and invalidate() drops it as soon as a token is rotated.
+    """
+
+    def __init__(self):
+        self._keyed: Dict[str, Tuple[str, "hmac.HMAC"]] = {}  # device_id -> (token, keyed hmac)
+        self._lock = threading.Lock()
+        self._stats = {"signed": 0, "keyed": 0, "invalidated": 0}
+
+    def _keyed_hmac(self, device_id: str, token: str) -> "hmac.HMAC":
+        with self._lock:
+            entry = self._keyed.get(device_id)
+            if entry is None or entry[0] != token:
+                entry = self._keyed[device_id] = (token, hmac.new(token.encode("utf-8"), digestmod=hashlib.sha256))
+                self._stats["keyed"] += 1
+            self._stats["signed"] += 1
+            return entry[1].copy()
+
+    def sign(self, device_id: str, token: str, data: bytes) -> str:
+        h = self._keyed_hmac(device_id, token)
+        h.update(data)
+        return h.hexdigest()
+
+    def envelope(self, device_id: str, token: str, inner_payload_str: str) -> str:
+        """Serialized {"data", "signature"} frame for an already serialized inner payload"""
+        signature = self.sign(device_id, token, inner_payload_str.encode("utf-8"))
+        return '{"data": ' + json.dumps(inner_payload_str) + ', "signature": "' + signature + '"}'
+
+    def group_envelope(self, inner_payload_str: str, tokens: Iterable[Tuple[str, Optional[str]]]) -> str:
+        """Serialized {"data", "signatures"} frame; tokens: [(device_id, token)], devices without a token are left out"""
+        data = inner_payload_str.encode("utf-8")
+        signatures = {device_id: self.sign(device_id, token, data) for device_id, token in tokens if token}
+        return json.dumps({"data": inner_payload_str, "signatures": signatures})
+
+    def invalidate(self, device_id: str):
+        with self._lock:
+            if self._keyed.pop(device_id, None) is not None:
+                self._stats["invalidated"] += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "devices": len(self._keyed)}
@@ -6,10 +6,36 @@ MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 KEEPALIVE = int(os.getenv("KEEPALIVE", "60"))
 API_PORT  = int(os.getenv("API_PORT", "8083"))       # MCP SSE 전용
 CMD_TIMEOUT_MS = int(os.getenv("CMD_TIMEOUT_MS", "30000"))
+DEVICE_MAX_IN_FLIGHT = int(os.getenv("DEVICE_MAX_IN_FLIGHT", "0"))  # 0 = unlimited unless the device announces max_in_flight
+CMD_BATCH_MAX = int(os.getenv("CMD_BATCH_MAX", "8"))
+CMD_TIMEOUT_MIN_MS = int(os.getenv("CMD_TIMEOUT_MIN_MS", "2000"))
+CMD_TIMEOUT_MIN_SAMPLES = int(os.getenv("CMD_TIMEOUT_MIN_SAMPLES", "5"))
+CMD_RETRY_MAX = int(os.getenv("CMD_RETRY_MAX", "2"))  # re-sends of an idempotent tool after a timeout
+CMD_RETRY_BACKOFF_MS = int(os.getenv("CMD_RETRY_BACKOFF_MS", "250"))
+CMD_HEDGE = os.getenv("CMD_HEDGE", "1") == "1"
+CMD_HEDGE_MIN_MS = int(os.getenv("CMD_HEDGE_MIN_MS", "200"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_COOLDOWN_MS = int(os.getenv("BREAKER_COOLDOWN_MS", "10000"))
+BREAKER_MAX_COOLDOWN_MS = int(os.getenv("BREAKER_MAX_COOLDOWN_MS", "120000"))
+VIRTUAL_TOOL_DEADLINE_MS = int(os.getenv("VIRTUAL_TOOL_DEADLINE_MS", "30000"))
+VIRTUAL_TOOL_MAX_INFLIGHT_PER_DEVICE = int(os.getenv("VIRTUAL_TOOL_MAX_INFLIGHT_PER_DEVICE", "4"))
+PARAM_MODEL_CACHE_SIZE = int(os.getenv("PARAM_MODEL_CACHE_SIZE", "4096"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+OUTBOX_TTL_MS = int(os.getenv("OUTBOX_TTL_MS", "0"))  # 0 = commands to offline devices fail at once
+OUTBOX_MAX_PER_DEVICE = int(os.getenv("OUTBOX_MAX_PER_DEVICE", "16"))
+ASSET_FETCH_WORKERS = int(os.getenv("ASSET_FETCH_WORKERS", "8"))
+ASSET_FETCH_TIMEOUT_S = float(os.getenv("ASSET_FETCH_TIMEOUT_S", "10"))
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ASSET_CHANNEL_MAX_BYTES = int(os.getenv("ASSET_CHANNEL_MAX_BYTES", str(64 * 1024 * 1024)))
+ASSET_CHANNEL_TTL_MS = int(os.getenv("ASSET_CHANNEL_TTL_MS", "30000"))
+ASSET_CHANNEL_WAIT_MS = int(os.getenv("ASSET_CHANNEL_WAIT_MS", "5000"))
 SUB_ALL        = os.getenv("DEBUG_SUB_ALL", "0") == "1"
 PROJECTION_CONFIG_PATH = os.getenv("PROJECTION_CONFIG_PATH", "./config/projection_config.json")
 ROUTING_CONFIG_PATH = os.getenv("ROUTING_CONFIG_PATH", "./config/routing_config.json")
 VIRTUAL_TOOLS_CONFIG_PATH = os.getenv("VIRTUAL_TOOLS_CONFIG_PATH", "./config/virtual_tools.json")
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "./config/outbox.json")
 
 # MQTT Topics
 TOPIC_ANN  = "mcp/dev/+/announce"
@@ -17,5 +43,7 @@ TOPIC_STAT = "mcp/dev/+/status"
 TOPIC_EV   = "mcp/dev/+/events"
 TOPIC_PORTS_ANN  = "mcp/dev/+/ports/announce"
 TOPIC_PORTS_DATA = "mcp/dev/+/ports/data"
+TOPIC_ASSETS     = "mcp/dev/+/assets/#"
+TOPIC_GROUP_CMD  = "mcp/group/cmd"
 
 IPC_PORT = int(os.getenv("IPC_PORT", "8085"))
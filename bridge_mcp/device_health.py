@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+from .config import (
+    CMD_TIMEOUT_MS,
+    CMD_TIMEOUT_MIN_MS,
+    CMD_TIMEOUT_MIN_SAMPLES,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_COOLDOWN_MS,
+    BREAKER_MAX_COOLDOWN_MS,
+)
+from .utils import log
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+# EWMA gains from TCP's retransmission timer (RFC 6298)
+_ALPHA = 0.125
+_BETA = 0.25
+
+# Recent latencies kept per tool for percentiles (hedge delay)
+LATENCY_WINDOW = 100
+
+
+class DeviceHealth:
+    """
+    Per-device command latency and circuit breaker.
+
+    Latency is smoothed per (device, tool). Once a tool has enough samples its
+    default timeout becomes srtt + 4 * rttvar, kept within
+    [CMD_TIMEOUT_MIN_MS, CMD_TIMEOUT_MS]; an explicit timeout_ms is never changed.
+
+    The breaker opens after BREAKER_FAILURE_THRESHOLD consecutive timeouts and
+    then fails commands immediately. After the cooldown one probe command is let
+    through (half-open): a response closes the breaker, a timeout re-opens it with
+    a doubled cooldown. Any response or announce from the device closes it.
+    """
+
+    def __init__(self,
+                 default_timeout_ms: int = CMD_TIMEOUT_MS,
+                 min_timeout_ms: int = CMD_TIMEOUT_MIN_MS,
+                 min_samples: int = CMD_TIMEOUT_MIN_SAMPLES,
+                 failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 cooldown_ms: int = BREAKER_COOLDOWN_MS,
+                 max_cooldown_ms: int = BREAKER_MAX_COOLDOWN_MS):
+        self.default_timeout_ms = default_timeout_ms
+        self.min_timeout_ms = min(min_timeout_ms, default_timeout_ms)
+        self.min_samples = min_samples
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_ms = cooldown_ms
+        self.max_cooldown_ms = max(cooldown_ms, max_cooldown_ms)
+        self._devices: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _device(self, device_id: str) -> Dict[str, Any]:
+        """Caller holds self._lock."""
+        d = self._devices.get(device_id)
+        if d is None:
+            d = self._devices[device_id] = {
+                "state": BREAKER_CLOSED,
+                "consecutive_timeouts": 0,
+                "cooldown_ms": self.cooldown_ms,
+                "opened_at": 0.0,
+                "probe_until": 0.0,
+                "responses": 0,
+                "timeouts": 0,
+                "fast_failed": 0,
+                "retries": 0,
+                "hedges": 0,
+                "srtt_ms": None,
+                "last_latency_ms": None,
+                "tools": {},  # tool -> [srtt_ms, rttvar_ms, samples, recent latencies]
+            }
+        return d
+
+    def timeout_ms(self, device_id: str, tool: str) -> int:
+        """Default command timeout for a device tool"""
+        with self._lock:
+            d = self._devices.get(device_id)
+            return self._timeout_for(d["tools"].get(tool) if d else None)
+
+    def _timeout_for(self, est: Optional[list]) -> int:
+        if est is None or est[2] < self.min_samples:
+            return self.default_timeout_ms
+        return int(min(self.default_timeout_ms, max(self.min_timeout_ms, est[0] + 4.0 * est[1])))
+
+    def p95_ms(self, device_id: str, tool: str) -> Optional[float]:
+        """95th percentile of the tool's recent latencies, or None before min_samples responses"""
+        with self._lock:
+            d = self._devices.get(device_id)
+            est = d["tools"].get(tool) if d else None
+            return self._p95(est)
+
+    def _p95(self, est: Optional[list], digits: Optional[int] = None) -> Optional[float]:
+        if est is None or est[2] < self.min_samples:
+            return None
+        recent = sorted(est[3])
+        p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+        return round(p95, digits) if digits is not None else p95
+
+    def state(self, device_id: str) -> str:
+        with self._lock:
+            d = self._devices.get(device_id)
+            return d["state"] if d else BREAKER_CLOSED
+
+    def admit(self, device_id: str) -> Optional[int]:
+        """None if a command may be sent now; otherwise ms until the breaker lets a probe through."""
+        with self._lock:
+            d = self._devices.get(device_id)
+            if d is None or d["state"] == BREAKER_CLOSED:
+                return None
+            now = time.monotonic()
+            retry_at = d["opened_at"] + d["cooldown_ms"] / 1000.0
+            if d["state"] == BREAKER_HALF_OPEN:
+                retry_at = d["probe_until"]
+            if now >= retry_at:
+                # Let one probe through; it holds the slot until it can time out
+                d["state"] = BREAKER_HALF_OPEN
+                d["probe_until"] = now + self.default_timeout_ms / 1000.0
+                return None
+            d["fast_failed"] += 1
+            return max(1, int((retry_at - now) * 1000))
+
+    def record_response(self, device_id: str, tool: Optional[str], latency_ms: Optional[float]):
+        """latency_ms None: the device answered, but the command was sent more than once so the latency is ambiguous"""
+        with self._lock:
+            d = self._device(device_id)
+            if latency_ms is None:
+                pass
+            elif tool:
+                est = d["tools"].get(tool)
+                if est is None:
+                    d["tools"][tool] = [latency_ms, latency_ms / 2.0, 1, deque([latency_ms], maxlen=LATENCY_WINDOW)]
+                else:
+                    est[1] = (1 - _BETA) * est[1] + _BETA * abs(est[0] - latency_ms)
+                    est[0] = (1 - _ALPHA) * est[0] + _ALPHA * latency_ms
+                    est[2] += 1
+                    est[3].append(latency_ms)
+            d["responses"] += 1
+            if latency_ms is not None:
+                d["last_latency_ms"] = round(latency_ms, 1)
+                d["srtt_ms"] = latency_ms if d["srtt_ms"] is None else (1 - _ALPHA) * d["srtt_ms"] + _ALPHA * latency_ms
+            was_open = d["state"] != BREAKER_CLOSED
+            self._close(d)
+        if was_open:
+            log(f"[HEALTH] Circuit closed for {device_id}")
+
+    def record_timeout(self, device_id: str):
+        with self._lock:
+            d = self._device(device_id)
+            d["timeouts"] += 1
+            d["consecutive_timeouts"] += 1
+            if d["state"] == BREAKER_HALF_OPEN:
+                d["cooldown_ms"] = min(self.max_cooldown_ms, d["cooldown_ms"] * 2)
+            elif d["state"] == BREAKER_OPEN or d["consecutive_timeouts"] < self.failure_threshold:
+                return
+            d["state"] = BREAKER_OPEN
+            d["opened_at"] = time.monotonic()
+            failures, cooldown_ms = d["consecutive_timeouts"], d["cooldown_ms"]
+        log(f"[HEALTH] Circuit open for {device_id} after {failures} timeouts (retry in {cooldown_ms}ms)")
+
+    def record_retry(self, device_id: str, hedge: bool = False):
+        """A command was sent again under the same request id (after a timeout, or as a hedge)"""
+        with self._lock:
+            self._device(device_id)["hedges" if hedge else "retries"] += 1
+
+    def reset(self, device_id: str):
+        """Device proved it is alive (e.g. announced): close its breaker"""
+        with self._lock:
+            d = self._devices.get(device_id)
+            if d is None or d["state"] == BREAKER_CLOSED:
+                return
+            self._close(d)
+        log(f"[HEALTH] Circuit closed for {device_id} (announce)")
+
+    def _close(self, d: Dict[str, Any]):
+        """Caller holds self._lock."""
+        d["state"] = BREAKER_CLOSED
+        d["consecutive_timeouts"] = 0
+        d["cooldown_ms"] = self.cooldown_ms
+
+    def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            d = self._devices.get(device_id)
+            return self._snapshot(d) if d else None
+
+    def get_all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {device_id: self._snapshot(d) for device_id, d in self._devices.items()}
+
+    def _snapshot(self, d: Dict[str, Any]) -> Dict[str, Any]:
+        """Caller holds self._lock."""
+        snapshot = {
+            "state": d["state"],
+            "consecutive_timeouts": d["consecutive_timeouts"],
+            "responses": d["responses"],
+            "timeouts": d["timeouts"],
+            "fast_failed": d["fast_failed"],
+            "retries": d["retries"],
+            "hedges": d["hedges"],
+            "srtt_ms": round(d["srtt_ms"], 1) if d["srtt_ms"] is not None else None,
+            "last_latency_ms": d["last_latency_ms"],
+            "tools": {
+                tool: {
+                    "srtt_ms": round(est[0], 1),
+                    "rttvar_ms": round(est[1], 1),
+                    "samples": est[2],
+                    "p95_ms": self._p95(est, digits=1),
+                    "timeout_ms": self._timeout_for(est),
+                }
+                for tool, est in d["tools"].items()
+            },
+        }
+        if d["state"] == BREAKER_OPEN:
+            retry_at = d["opened_at"] + d["cooldown_ms"] / 1000.0
+            snapshot["retry_in_ms"] = max(0, int((retry_at - time.monotonic()) * 1000))
+        return snapshot
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from .config import OUTBOX_MAX_PER_DEVICE, OUTBOX_PATH, OUTBOX_TTL_MS
+from .utils import log
+
+# (request_id, tool, args, expires_at as unix time, response timeout_ms once delivered)
+OutboxEntry = Tuple[str, str, Any, float, int]
+
+
+class DeviceOutbox:
+    """
+    Store-and-forward queue for commands to devices that are offline or reconnecting.
+
+    Disabled unless ttl_ms > 0. Each device holds at most max_per_device commands,
+    oldest first; a command not delivered within ttl_ms is dropped. The queue is
+    written to disk compactly so a bridge restart still delivers it (with nobody
+    waiting for the answer). Changes within save_delay_s share one write, made
+    on a timer thread outside the queue lock.
+    """
+
+    def __init__(self, ttl_ms: int = OUTBOX_TTL_MS, max_per_device: int = OUTBOX_MAX_PER_DEVICE,
+                 file_path: Optional[str] = OUTBOX_PATH, save_delay_s: float = 0.2):
+        self.ttl_ms = ttl_ms
+        self.max_per_device = max(1, max_per_device)
+        self.file_path = file_path if self.enabled else None
+        self.save_delay_s = save_delay_s
+        self._queues: Dict[str, deque] = {}
+        self._waiters: Dict[str, Any] = {}  # rid -> the caller waiting for the command (not saved)
+        self._lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+        self._write_lock = threading.Lock()  # keeps snapshots reaching the file in order
+        self._stats = {"queued": 0, "rejected": 0, "flushed": 0, "expired": 0, "withdrawn": 0}
+        self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_ms > 0
+
+    def put(self, device_id: str, rid: str, tool: str, args: Any, timeout_ms: int, waiter: Any = None) -> bool:
+        """
+        Queue a command; False if the outbox is disabled or the device's queue is full.
+        waiter stands for the caller awaiting the command and is handed out by claim().
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            q = self._queues.setdefault(device_id, deque())
+            self._drop_expired(device_id, q)
+            if len(q) >= self.max_per_device:
+                self._stats["rejected"] += 1
+                return False
+            q.append((rid, tool, args, time.time() + self.ttl_ms / 1000.0, timeout_ms))
+            if waiter is not None:
+                self._waiters[rid] = waiter
+            self._stats["queued"] += 1
+            self._save()
+        return True
+
+    def take(self, device_id: str) -> List[OutboxEntry]:
+        """Remove and return the device's unexpired commands, oldest first"""
+        with self._lock:
+            q = self._queues.pop(device_id, None)
+            if not q:
+                return []
+            self._drop_expired(device_id, q)
+            self._stats["flushed"] += len(q)
+            self._save()
+            return list(q)
+
+    def claim(self, rid: str) -> Any:
+        """The waiter put() with a taken command; None if nobody waits for it (restored from disk)"""
+        with self._lock:
+            return self._waiters.pop(rid, None)
+
+    def requeue(self, device_id: str, entries: List[OutboxEntry]):
+        """Put back commands that could not be delivered, ahead of anything queued since"""
+        if not entries:
+            return
+        with self._lock:
+            q = self._queues.setdefault(device_id, deque())
+            q.extendleft(reversed(entries))
+            self._stats["flushed"] -= len(entries)
+            self._save()
+
+    def withdraw(self, device_id: str, rid: str) -> bool:
+        """Drop a command that is still queued (its caller gave up); False if it was already sent"""
+        with self._lock:
+            q = self._queues.get(device_id)
+            entry = next((e for e in q if e[0] == rid), None) if q else None
+            if entry is None:
+                return False
+            q.remove(entry)
+            self._waiters.pop(rid, None)
+            if not q:
+                del self._queues[device_id]
+            self._stats["withdrawn"] += 1
+            self._save()
+            return True
+
+    def flush(self):
+        """Write pending changes to disk now"""
+        if not self.file_path:
+            return
+        with self._write_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                snapshot = {device_id: list(q) for device_id, q in self._queues.items() if q}
+            try:
+                with open(self.file_path, 'w') as f:
+                    json.dump(snapshot, f, separators=(',', ':'))
+            except Exception as e:
+                log(f"[OUTBOX] Failed to save outbox: {e}")
+
+    def has_queued(self, device_id: str) -> bool:
+        with self._lock:
+            return bool(self._queues.get(device_id))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ttl_ms": self.ttl_ms,
+                "max_per_device": self.max_per_device,
+                **self._stats,
+                "devices": {device_id: len(q) for device_id, q in self._queues.items()},
+            }
+
+    # ---- caller holds self._lock ----
+
+    def _drop_expired(self, device_id: str, q: deque):
+        now = time.time()
+        while q and q[0][3] <= now:
+            rid = q.popleft()[0]
+            self._waiters.pop(rid, None)
+            self._stats["expired"] += 1
+            log(f"[OUTBOX] Dropped {rid} for {device_id}: not delivered within {self.ttl_ms}ms")
+
+    def _save(self):
+        """Schedule a write; changes within the debounce window share one flush()"""
+        if not self.file_path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay_s, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _load(self):
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+            for device_id, entries in data.items():
+                q = deque(tuple(e) for e in entries)
+                self._drop_expired(device_id, q)
+                if q:
+                    self._queues[device_id] = q
+            log(f"[OUTBOX] Loaded {sum(len(q) for q in self._queues.values())} queued commands from disk")
+        except Exception as e:
+            log(f"[OUTBOX] Failed to load outbox: {e}")
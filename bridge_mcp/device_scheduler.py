@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional
+from .config import DEVICE_MAX_IN_FLIGHT
+from .utils import log
+
+# Priority classes, most urgent first
+PRIORITY_INTERACTIVE = "interactive"   # a single LLM tool call waiting on the answer
+PRIORITY_FANOUT = "fanout"             # virtual tools, invoke_many, group commands
+PRIORITY_BACKGROUND = "background"     # anything nobody is actively waiting for
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_FANOUT, PRIORITY_BACKGROUND)
+
+
+class _Ticket:
+    __slots__ = ("rid", "device_id", "priority", "caller", "on_grant", "queued_at", "granted_at")
+
+    def __init__(self, rid: str, device_id: str, priority: str, caller: str, on_grant: Optional[Callable[[], Any]]):
+        self.rid = rid
+        self.device_id = device_id
+        self.priority = priority
+        self.caller = caller
+        self.on_grant = on_grant
+        self.queued_at = time.monotonic()
+        self.granted_at = 0.0
+
+
+class _DeviceQueue:
+    def __init__(self):
+        self.in_flight = 0
+        # one OrderedDict per priority: caller -> deque of tickets; callers take turns
+        self.waiting: List["OrderedDict[str, deque]"] = [OrderedDict() for _ in PRIORITIES]
+        self.queued = 0
+
+
+class DeviceScheduler:
+    """
+    Caps concurrent commands per device (DEVICE_MAX_IN_FLIGHT, or the device's
+    own announced "max_in_flight" via set_limit).
+
+    A command holds a slot from the moment it is granted until its request is
+    resolved, expires, is cancelled, or fails to send (release). Waiting
+    commands are granted by priority class; within a class, callers (a batch,
+    a single call) take turns, so one large fan-out cannot starve another.
+
+    Queue wait (submit -> grant) and service time (grant -> release) are
+    tracked separately per priority class.
+    """
+
+    def __init__(self, max_in_flight: int = DEVICE_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight  # <= 0 disables the limit
+        self._devices: Dict[str, _DeviceQueue] = {}
+        self._limits: Dict[str, int] = {}  # per-device overrides of max_in_flight
+        self._tickets: Dict[str, _Ticket] = {}  # rid -> queued or granted ticket
+        self._lock = threading.Lock()
+        self._stats = {
+            p: {"granted": 0, "queued": 0, "abandoned": 0, "completed": 0,
+                "wait_ms_total": 0.0, "wait_ms_max": 0.0, "service_ms_total": 0.0}
+            for p in PRIORITIES
+        }
+
+    def submit(self, rid: str, device_id: str, priority: str = PRIORITY_INTERACTIVE,
+               caller: Optional[str] = None, on_grant: Optional[Callable[[], Any]] = None) -> bool:
+        """
+        Ask for a slot on device_id. Returns True if granted now.
+        Otherwise the request is queued and on_grant() is called (without blocking,
+        from whichever thread frees the slot) once granted; with on_grant None it is
+        not queued at all.
+        """
+        if priority not in PRIORITIES:
+            priority = PRIORITY_INTERACTIVE
+        ticket = _Ticket(rid, device_id, priority, caller or rid, on_grant)
+        with self._lock:
+            dq = self._devices.setdefault(device_id, _DeviceQueue())
+            if self._has_room(device_id, dq):
+                self._grant(dq, ticket)
+                return True
+            if on_grant is None:
+                if not dq.in_flight and not dq.queued:
+                    self._devices.pop(device_id, None)
+                return False
+            dq.waiting[PRIORITIES.index(priority)].setdefault(ticket.caller, deque()).append(ticket)
+            dq.queued += 1
+            self._tickets[rid] = ticket
+            self._stats[priority]["queued"] += 1
+            return False
+
+    def release(self, rid: str):
+        """Free the slot held by rid (no-op if it holds none) and grant the next waiter"""
+        with self._lock:
+            ticket = self._tickets.get(rid)
+            if ticket is None or not ticket.granted_at:
+                return
+            del self._tickets[rid]
+            stats = self._stats[ticket.priority]
+            stats["completed"] += 1
+            stats["service_ms_total"] += (time.monotonic() - ticket.granted_at) * 1000.0
+            dq = self._devices[ticket.device_id]
+            dq.in_flight -= 1
+            granted = self._next(ticket.device_id, dq)
+            if not dq.in_flight and not dq.queued:
+                del self._devices[ticket.device_id]
+        self._fire(granted)
+
+    def abandon(self, rid: str):
+        """Caller stopped waiting for rid: drop it from its queue, or free its slot if already granted"""
+        with self._lock:
+            ticket = self._tickets.get(rid)
+            if ticket is None:
+                return
+            if not ticket.granted_at:
+                del self._tickets[rid]
+                dq = self._devices[ticket.device_id]
+                callers = dq.waiting[PRIORITIES.index(ticket.priority)]
+                waiting = callers.get(ticket.caller)
+                if waiting is not None:
+                    waiting.remove(ticket)
+                    if not waiting:
+                        del callers[ticket.caller]
+                dq.queued -= 1
+                self._stats[ticket.priority]["abandoned"] += 1
+                if not dq.in_flight and not dq.queued:
+                    del self._devices[ticket.device_id]
+                return
+        self.release(rid)
+
+    def _grant(self, dq: _DeviceQueue, ticket: _Ticket):
+        """Caller holds self._lock."""
+        ticket.granted_at = time.monotonic()
+        dq.in_flight += 1
+        self._tickets[ticket.rid] = ticket
+        wait_ms = (ticket.granted_at - ticket.queued_at) * 1000.0
+        stats = self._stats[ticket.priority]
+        stats["granted"] += 1
+        stats["wait_ms_total"] += wait_ms
+        if wait_ms > stats["wait_ms_max"]:
+            stats["wait_ms_max"] = wait_ms
+
+    def set_limit(self, device_id: str, limit: Optional[int]):
+        """Override max_in_flight for one device (None restores the default); waiters are granted at once if it grew"""
+        with self._lock:
+            if limit is None:
+                self._limits.pop(device_id, None)
+            else:
+                self._limits[device_id] = int(limit)
+            dq = self._devices.get(device_id)
+            granted = self._next(device_id, dq) if dq else []
+        self._fire(granted)
+
+    @staticmethod
+    def _fire(granted: List[_Ticket]):
+        """Run grant callbacks outside self._lock"""
+        for t in granted:
+            try:
+                t.on_grant()
+            except Exception as e:
+                log(f"[SCHED] Grant callback failed for {t.rid}: {e}")
+
+    def _has_room(self, device_id: str, dq: _DeviceQueue) -> bool:
+        """Caller holds self._lock."""
+        limit = self._limits.get(device_id, self.max_in_flight)
+        return limit <= 0 or dq.in_flight < limit
+
+    def _next(self, device_id: str, dq: _DeviceQueue) -> List[_Ticket]:
+        """Grant waiting tickets while the device has free slots. Caller holds self._lock."""
+        granted = []
+        while dq.queued and self._has_room(device_id, dq):
+            callers = next(c for c in dq.waiting if c)
+            caller, waiting = next(iter(callers.items()))
+            ticket = waiting.popleft()
+            # Round robin: this caller goes to the back of its class
+            del callers[caller]
+            if waiting:
+                callers[caller] = waiting
+            dq.queued -= 1
+            self._grant(dq, ticket)
+            granted.append(ticket)
+        return granted
+
+    def get_device(self, device_id: str) -> Dict[str, int]:
+        with self._lock:
+            dq = self._devices.get(device_id)
+            return {"in_flight": dq.in_flight if dq else 0, "queued": dq.queued if dq else 0}
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            classes = {}
+            for priority, s in self._stats.items():
+                classes[priority] = {
+                    "granted": s["granted"],
+                    "queued": s["queued"],
+                    "abandoned": s["abandoned"],
+                    "wait_ms_avg": round(s["wait_ms_total"] / s["granted"], 1) if s["granted"] else 0.0,
+                    "wait_ms_max": round(s["wait_ms_max"], 1),
+                    "service_ms_avg": round(s["service_ms_total"] / s["completed"], 1) if s["completed"] else 0.0,
+                }
+            busy = {
+                device_id: {"in_flight": dq.in_flight, "queued": dq.queued}
+                for device_id, dq in self._devices.items()
+            }
+            return {"max_in_flight": self.max_in_flight, "classes": classes, "devices": busy}
@@ -0,0 +1,75 @@
+from fnmatch import fnmatchcase
+from typing import Any, Callable, Dict, List
+
+SELECTOR_KEYS = ("device_ids", "tag", "tags", "name", "firmware", "alias", "protocol")
+PROTOCOLS = ("mqtt", "ipc")
+
+
+def compile_selector(selector: Dict[str, Any], projection_store=None) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Build a predicate over raw device dicts (DeviceStore.select).
+
+    All given keys must match:
+    - device_ids: explicit list
+    - tag: device announced this tag; tags: device announced all of them
+    - name / firmware / alias: glob patterns (firmware = announced "version",
+      alias = projection device_alias, falling back to name / id)
+    - protocol: "mqtt" or "ipc"
+
+    Raises ValueError on an empty selector, unknown keys, or a key whose value
+    is empty or of the wrong type (it would otherwise match every device).
+    """
+    if not isinstance(selector, dict) or not selector:
+        raise ValueError("selector must be a non-empty object")
+    unknown = set(selector) - set(SELECTOR_KEYS)
+    if unknown:
+        raise ValueError(f"unknown selector keys: {', '.join(sorted(unknown))} (allowed: {', '.join(SELECTOR_KEYS)})")
+
+    checks = []
+    if "device_ids" in selector:
+        ids = set(_string_list(selector, "device_ids"))
+        checks.append(lambda d: d.get("device_id") in ids)
+    required_tags = set()
+    if "tags" in selector:
+        required_tags.update(_string_list(selector, "tags"))
+    if "tag" in selector:
+        required_tags.add(_string(selector, "tag"))
+    if required_tags:
+        checks.append(lambda d: required_tags.issubset(d.get("tags") or ()))
+    if "name" in selector:
+        name_pattern = _string(selector, "name")
+        checks.append(lambda d: fnmatchcase(d.get("name") or "", name_pattern))
+    if "firmware" in selector:
+        fw_pattern = _string(selector, "firmware")
+        checks.append(lambda d: fnmatchcase(str(d.get("version") or ""), fw_pattern))
+    if "protocol" in selector:
+        protocol = _string(selector, "protocol")
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"selector protocol must be one of: {', '.join(PROTOCOLS)}")
+        checks.append(lambda d: d.get("protocol", "mqtt") == protocol)
+    if "alias" in selector:
+        alias_pattern = _string(selector, "alias")
+        if projection_store is not None:
+            checks.append(lambda d: fnmatchcase(
+                projection_store.get_device_alias(d["device_id"], d.get("name")), alias_pattern
+            ))
+        else:
+            checks.append(lambda d: fnmatchcase(d.get("name") or d["device_id"], alias_pattern))
+
+    if not checks:
+        raise ValueError("selector matches every device")
+    return lambda d: all(check(d) for check in checks)
+
+
+def _string(selector: Dict[str, Any], key: str) -> str:
+    value = selector[key]
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"selector {key} must be a non-empty string")
+    return value
+
+
+def _string_list(selector: Dict[str, Any], key: str) -> List[str]:
+    value = selector[key]
+    if not isinstance(value, list) or not value or not all(isinstance(v, str) and v for v in value):
+        raise ValueError(f"selector {key} must be a non-empty list of strings")
+    return value
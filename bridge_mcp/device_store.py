@@ -2,29 +2,94 @@ import json
 import threading
 from datetime import datetime, timezone
 from typing import Dict, Any, List, Optional
-from .utils import log, now_iso
+from .utils import log, now_iso, canonical_hash
 from .tool_registry import DynamicToolRegistry
 
+# upsert_announce outcomes
+ANNOUNCE_UPDATED = "updated"              # tools (re)registered
+ANNOUNCE_UNCHANGED = "unchanged"          # schema hash matched, liveness refresh only
+ANNOUNCE_SCHEMA_UNKNOWN = "schema_unknown"  # hash-only announce, full payload needed
+
 class DeviceStore:
     def __init__(self, tool_registry: DynamicToolRegistry):
         self._by_id: Dict[str, Dict[str, Any]] = {}
         self._lock = threading.Lock()
         self.tool_registry = tool_registry
         self.on_announce_callbacks = []
+        # Called for every accepted announce, including liveness-only ones (device may have rebooted)
+        self.on_any_announce_callbacks = []
+        # Called after a device's secret token is replaced (claim or rotation)
+        self.on_token_callbacks = []
+        # Bumped whenever any device's announced tools change (plan cache key)
+        self.schema_version = 0
         self.file_path = "config/devices.json"
         self._load()
 
     def register_on_announce_callback(self, callback):
         self.on_announce_callbacks.append(callback)
 
-    def upsert_announce(self, device_id: str, msg: Dict[str, Any], protocol: str = "mqtt"):
+    def register_on_any_announce_callback(self, callback):
+        self.on_any_announce_callbacks.append(callback)
+
+    def register_on_token_callback(self, callback):
+        self.on_token_callbacks.append(callback)
+
+    def classify_announce(self, device_id: str, msg: Dict[str, Any]) -> str:
+        """
+        Decide how an announce must be handled without mutating the store.
+
+        Devices may send a full announce (with "tools") or a hash-only announce
+        carrying just "schema_hash". The hash is treated as an opaque token:
+        it only has to match what the same device sent with its last full announce.
+        """
+        has_tools = "tools" in msg
+        schema_hash = msg.get("schema_hash")
+        if schema_hash is None and has_tools:
+            schema_hash = canonical_hash(msg.get("tools", []))
+
+        registered = self.tool_registry.has_device(device_id)
+        with self._lock:
+            d = self._by_id.get(device_id)
+            known = (
+                registered
+                and d is not None
+                and schema_hash is not None
+                and d.get("schema_hash") == schema_hash
+                and msg.get("name", d.get("name")) == d.get("name")
+            )
+        if known:
+            return ANNOUNCE_UNCHANGED
+        if not has_tools:
+            return ANNOUNCE_SCHEMA_UNKNOWN
+        return ANNOUNCE_UPDATED
+
+    def upsert_announce(self, device_id: str, msg: Dict[str, Any], protocol: str = "mqtt") -> str:
+        outcome = self.classify_announce(device_id, msg)
+
+        if outcome != ANNOUNCE_UPDATED:
+            self.touch_announce(device_id, msg, protocol)
+            self._notify_any_announce(device_id)
+            return outcome
+
+        schema_hash = msg.get("schema_hash") or canonical_hash(msg.get("tools", []))
         with self._lock:
             d = self._by_id.setdefault(device_id, {"device_id": device_id})
             d["name"] = msg.get("name")
             d["version"] = msg.get("version")
             d["http_base"] = msg.get("http_base")
+            d["tags"] = msg.get("tags", [])
+            d["group_cmd"] = bool(msg.get("group_cmd", False))
+            d["batch_cmd"] = msg.get("batch_cmd", False)
+            d["max_in_flight"] = msg.get("max_in_flight")
             d["tools"] = msg.get("tools", [])
+            d["cache_ttls"] = {
+                t["name"]: int(t["cacheable_ttl_ms"])
+                for t in d["tools"] if t.get("name") and t.get("cacheable_ttl_ms")
+            }
+            d["idempotent_tools"] = [t["name"] for t in d["tools"] if t.get("name") and t.get("idempotent")]
+            d["schema_hash"] = schema_hash
             d["last_announce"] = msg
+            self.schema_version += 1
             d["last_seen"] = now_iso()
             d["protocol"] = protocol
         
@@ -37,6 +102,27 @@ class DeviceStore:
                 callback(device_id)
             except Exception as e:
                 log(f"[DEVICE] Error in announce callback: {e}")
+        self._notify_any_announce(device_id)
+        return outcome
+
+    def _notify_any_announce(self, device_id: str):
+        for callback in self.on_any_announce_callbacks:
+            try:
+                callback(device_id)
+            except Exception as e:
+                log(f"[DEVICE] Error in announce callback: {e}")
+
+    def touch_announce(self, device_id: str, msg: Dict[str, Any], protocol: str = "mqtt"):
+        """Liveness-only announce: refresh metadata without touching tools."""
+        with self._lock:
+            d = self._by_id.get(device_id)
+            if d is None:
+                return
+            for key in ("version", "http_base", "tags", "group_cmd", "batch_cmd", "max_in_flight"):
+                if key in msg:
+                    d[key] = msg[key]
+            d["last_seen"] = now_iso()
+            d["protocol"] = protocol
 
     def update_status(self, device_id: str, msg: Dict[str, Any]):
         with self._lock:
@@ -53,6 +139,85 @@ class DeviceStore:
                 return None
             return json.loads(json.dumps(self._by_id[device_id]))
 
+    def get_tool_schemas(self, device_ids) -> Dict[str, Dict[str, Any]]:
+        """{device_id: {tool_name: parameters schema}} for known devices (copies)"""
+        with self._lock:
+            return {
+                device_id: {
+                    t.get("name"): json.loads(json.dumps(t.get("parameters") or {}))
+                    for t in self._by_id[device_id].get("tools", [])
+                }
+                for device_id in set(device_ids) if device_id in self._by_id
+            }
+
+    def get_cache_ttl_ms(self, device_id: str, tool_name: str) -> Optional[int]:
+        """
+        Result cache TTL for a tool, or None if its results must not be cached.
+        A projection "cache_ttl_ms" overrides the announced "cacheable_ttl_ms" (0 disables).
+        """
+        configured = self.tool_registry.projection_store.get_tool_cache_ttl_ms(device_id, tool_name)
+        if configured is not None:
+            return configured or None
+        with self._lock:
+            d = self._by_id.get(device_id)
+            return d.get("cache_ttls", {}).get(tool_name) if d else None
+
+    def is_idempotent(self, device_id: str, tool_name: str) -> bool:
+        """
+        True if a tool may be sent more than once (retried / hedged).
+        A projection "idempotent" overrides the tool's announced "idempotent".
+        """
+        configured = self.tool_registry.projection_store.get_tool_idempotent(device_id, tool_name)
+        if configured is not None:
+            return configured
+        with self._lock:
+            d = self._by_id.get(device_id)
+            return bool(d) and tool_name in d.get("idempotent_tools", ())
+
+    def get_online(self, device_ids) -> Dict[str, bool]:
+        """Online flag per known device, one lock pass"""
+        with self._lock:
+            return {
+                device_id: self._by_id[device_id].get("online", False)
+                for device_id in set(device_ids) if device_id in self._by_id
+            }
+
+    def get_dispatch_info(self, device_ids) -> Dict[str, Dict[str, Any]]:
+        """{device_id: {"protocol", "group_cmd", "batch_cmd", "max_in_flight", "token"}} for known devices, without deep copies"""
+        with self._lock:
+            return {
+                device_id: {
+                    "protocol": d.get("protocol", "mqtt"),
+                    "group_cmd": d.get("group_cmd", False),
+                    "batch_cmd": d.get("batch_cmd", False),
+                    "max_in_flight": d.get("max_in_flight"),
+                    "token": d.get("secret_token"),
+                }
+                for device_id, d in ((i, self._by_id.get(i)) for i in set(device_ids)) if d is not None
+            }
+
+    def select(self, predicate) -> List[Dict[str, Any]]:
+        """
+        Devices for which predicate(raw_device) is true, as light views
+        (device_id, name, version, tags, protocol, online, tool names).
+        predicate runs under the store lock and must not mutate or call back into the store.
+        """
+        out = []
+        with self._lock:
+            for d in self._by_id.values():
+                if not predicate(d):
+                    continue
+                out.append({
+                    "device_id": d["device_id"],
+                    "name": d.get("name"),
+                    "version": d.get("version"),
+                    "tags": list(d.get("tags") or []),
+                    "protocol": d.get("protocol", "mqtt"),
+                    "online": d.get("online", False),
+                    "tools": {t.get("name") for t in d.get("tools", [])},
+                })
+        return out
+
     def list(self) -> List[Dict[str, Any]]:
         with self._lock:
             out = []
@@ -75,10 +240,16 @@ class DeviceStore:
 
     def set_token(self, device_id: str, token: str):
         with self._lock:
-            if device_id in self._by_id:
-                self._by_id[device_id]["secret_token"] = token
-                self._save()
-                log(f"[DEVICE_STORE] Token saved for {device_id}")
+            if device_id not in self._by_id:
+                return
+            self._by_id[device_id]["secret_token"] = token
+            self._save()
+            log(f"[DEVICE_STORE] Token saved for {device_id}")
+        for callback in self.on_token_callbacks:
+            try:
+                callback(device_id)
+            except Exception as e:
+                log(f"[DEVICE] Error in token callback: {e}")
 
     def _load(self):
         try:
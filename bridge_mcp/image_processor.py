@@ -0,0 +1,147 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from .config import IMAGE_CACHE_MAX_BYTES, IMAGE_WORKERS
+from .utils import log
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: without it images are passed through unchanged
+    Image = None
+
+# (max_width, max_height, output format or None to keep the source's, quality); 0 = no limit
+ImageSettings = Tuple[int, int, Optional[str], int]
+
+# "format" setting -> (Pillow format, mime type)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+DEFAULT_QUALITY = 80
+
+
+class ImageProcessor:
+    """
+    Downscales and re-encodes image assets before they are embedded in MCP
+    results, following the "images" projection settings of the tool
+    (max_width, max_height, format, quality).
+
+    Images are processed on a thread pool (Pillow releases the GIL while
+    decoding and resampling, and a JPEG is decoded at reduced scale when it is
+    shrunk a lot). Outputs are cached by sha256 of the source plus the settings,
+    bounded to max_bytes. Without Pillow, or for images Pillow cannot decode,
+    the source is passed through.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.workers = max(1, workers)
+        self.max_bytes = max(0, max_bytes)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-proc")
+        self._cache: "OrderedDict[Tuple[str, ImageSettings], Tuple[bytes, str]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"processed": 0, "hits": 0, "unchanged": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0}
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    @staticmethod
+    def settings_key(settings: Optional[Dict[str, Any]]) -> Optional[ImageSettings]:
+        """Normalized settings; None when they ask for nothing"""
+        if not settings:
+            return None
+        fmt = str(settings["format"]).lower() if settings.get("format") else None
+        if fmt is not None and fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"unsupported image format: {fmt} (allowed: {', '.join(OUTPUT_FORMATS)})")
+        key = (int(settings.get("max_width") or 0), int(settings.get("max_height") or 0), fmt,
+               int(settings.get("quality") or DEFAULT_QUALITY))
+        return key if key[0] or key[1] or key[2] else None
+
+    def process_many(self, images: List[Tuple[bytes, str]],
+                     settings: Optional[Dict[str, Any]]) -> List[Tuple[bytes, str]]:
+        """[(body, mime)] after applying settings, in input order"""
+        try:
+            key = self.settings_key(settings)
+        except ValueError as e:
+            log(f"[IMAGE] Ignoring image settings: {e}")
+            return images
+        if key is None or not self.available or not images:
+            return images
+        futures = [self._pool.submit(self._process, body, mime, key) for body, mime in images]
+        return [future.result() for future in futures]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "available": self.available,
+                **self._stats,
+                "entries": len(self._cache),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _process(self, body: bytes, mime: str, key: ImageSettings) -> Tuple[bytes, str]:
+        cache_key = (hashlib.sha256(body).hexdigest(), key)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                self._stats["hits"] += 1
+                return cached
+
+        try:
+            result = self._encode(body, mime, key)
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            log(f"[IMAGE] Could not process {mime} image ({len(body)} bytes): {e}")
+            return body, mime
+
+        with self._lock:
+            if result[0] is body:
+                self._stats["unchanged"] += 1
+            else:
+                self._stats["processed"] += 1
+                self._stats["bytes_in"] += len(body)
+                self._stats["bytes_out"] += len(result[0])
+            if len(result[0]) <= self.max_bytes and cache_key not in self._cache:
+                self._cache[cache_key] = result
+                self._size += len(result[0])
+                while self._size > self.max_bytes:
+                    _, (evicted, _) = self._cache.popitem(last=False)
+                    self._size -= len(evicted)
+        return result
+
+    @staticmethod
+    def _encode(body: bytes, mime: str, key: ImageSettings) -> Tuple[bytes, str]:
+        max_width, max_height, fmt, quality = key
+        with Image.open(io.BytesIO(body)) as img:
+            if fmt is not None:
+                out_format, out_mime = OUTPUT_FORMATS[fmt]
+            elif img.format in ("JPEG", "WEBP", "PNG"):
+                out_format, out_mime = img.format, mime
+            else:
+                return body, mime  # no encoder configured for this source format
+            too_big = (max_width and img.width > max_width) or (max_height and img.height > max_height)
+            if not too_big and out_format == img.format:
+                return body, mime
+            if too_big:
+                # thumbnail() keeps the aspect ratio and lets JPEG decode at reduced scale
+                img.thumbnail((max_width or img.width, max_height or img.height))
+            if out_format == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            buf = io.BytesIO()
+            if out_format == "PNG":
+                img.save(buf, format=out_format, optimize=True)
+            else:
+                img.save(buf, format=out_format, quality=quality)
+        out = buf.getvalue()
+        if not too_big and len(out) >= len(body):
+            return body, mime  # re-encoding alone did not pay off
+        return out, out_mime
@@ -11,20 +11,29 @@ from .command import CommandWaiter
 from .protocol import ProtocolHandler
 
 class IPCAgent:
-    def __init__(self, device_store: DeviceStore, cmd_waiter: CommandWaiter, port_store, port_router):
+    def __init__(self, device_store: DeviceStore, cmd_waiter: CommandWaiter, port_store, port_router,
+                 announce_queue=None, asset_channel=None):
         self.device_store = device_store
         self.cmd_waiter = cmd_waiter
         self.port_store = port_store
         self.port_router = port_router
+        # AssetChannel receiving pushed asset chunks; without one they are discarded
+        self.asset_channel = asset_channel
         
         # Unified Protocol Handler
-        self.protocol = ProtocolHandler(device_store, cmd_waiter, port_store, port_router)
+        self.protocol = ProtocolHandler(device_store, cmd_waiter, port_store, port_router,
+                                        announce_queue=announce_queue)
         
         self._connections: Dict[str, socket.socket] = {}
         self._lock = threading.Lock()
+        # Called with device_id once a device's socket is registered (first connect or reconnect)
+        self.on_connect_callbacks = []
         self.running = False
         self.server_socket = None
 
+    def register_on_connect_callback(self, callback):
+        self.on_connect_callbacks.append(callback)
+
     def start(self):
         self.running = True
         thread = threading.Thread(target=self._server_loop, daemon=True)
@@ -52,19 +61,22 @@ class IPCAgent:
 
     def _handle_client(self, sock: socket.socket):
         device_id = None
-        buffer = ""
+        buffer = bytearray()
         
         try:
             while True:
-                data = sock.recv(4096)
+                data = sock.recv(65536)
                 if not data:
                     break
                 
-                buffer += data.decode("utf-8")
+                buffer += data
                 
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    line = line.strip()
+                while True:
+                    newline = buffer.find(b"\n")
+                    if newline < 0:
+                        break
+                    line = bytes(buffer[:newline]).strip()
+                    del buffer[:newline + 1]
                     if not line:
                         continue
                     
@@ -75,6 +87,11 @@ class IPCAgent:
                         topic = msg.get("topic", "")
                         payload = msg.get("payload", {})
                         
+                        if topic.endswith("/assets"):
+                            # Header line of a binary asset chunk; its raw bytes follow
+                            self._receive_asset_chunk(sock, buffer, topic, payload, device_id)
+                            continue
+                        
                         # DEBUG: Log all incoming messages (sample ports/data)
                         # if "ports/data" in topic:
                         #     log(f"[IPC] RX ports/data: {topic} -> {payload}")
@@ -85,16 +102,26 @@ class IPCAgent:
                         action, result_id = self.protocol.handle_message(topic, payload, protocol="ipc", device_id_hint=device_id)
                         
                         # Update Socket Map if Announce
-                        if action == "announce" and result_id:
+                        if action.startswith("announce") and result_id:
                              new_did = result_id
                              if new_did != device_id:
                                  device_id = new_did
                                  with self._lock:
                                      self._connections[device_id] = sock
                                  log(f"[IPC] Registered socket for device {device_id}")
+                                 for callback in self.on_connect_callbacks:
+                                     try:
+                                         callback(device_id)
+                                     except Exception as e:
+                                         log(f"[IPC] Error in connect callback: {e}")
+
+                        if action == "announce_request" and result_id:
+                            self.send_cmd(result_id, {"type": "device.announce_request"})
 
                     except json.JSONDecodeError:
-                        log(f"[IPC] Invalid JSON: {line}")
+                        log(f"[IPC] Invalid JSON: {line.decode('utf-8', 'replace')}")
+                    except ConnectionError:
+                        raise
                     except Exception as e:
                         log(f"[IPC] Error processing message: {e}")
 
@@ -115,6 +142,45 @@ class IPCAgent:
 
             sock.close()
 
+    def _receive_asset_chunk(self, sock: socket.socket, buffer: bytearray, topic: str, header: Dict[str, Any],
+                             device_id: Optional[str]):
+        """
+        Read the `length` raw bytes following an asset chunk header straight into
+        the asset's buffer. Bytes already received are taken from `buffer`.
+        A header that does not say how many bytes follow leaves the stream
+        unframed, so it raises ConnectionError and the socket is dropped.
+        """
+        try:
+            length, offset, size = int(header["length"]), int(header["offset"]), int(header["size"])
+            rid, asset_id = header["request_id"], header["asset_id"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ConnectionError(f"invalid asset chunk header: {e!r}")
+        if length < 0 or offset < 0 or size < 0 or not rid or not asset_id:
+            raise ConnectionError(f"invalid asset chunk header: {header}")
+        rid, asset_id = str(rid), str(asset_id)
+        
+        dev_id, _ = self.protocol.parse_topic(topic)
+        view = None
+        if device_id is None or dev_id != device_id:
+            log(f"[IPC] Discarding asset chunk for {dev_id} on the socket of {device_id or 'an unannounced device'}")
+        elif self.asset_channel is not None:
+            view = self.asset_channel.chunk_view(dev_id, rid, asset_id, offset, size, length)
+        
+        got = min(len(buffer), length)
+        if view is not None:
+            view[:got] = buffer[:got]
+        del buffer[:got]
+        while got < length:
+            if view is not None:
+                n = sock.recv_into(view[got:], length - got)
+            else:
+                n = len(sock.recv(min(65536, length - got)))  # rejected chunk: discard its bytes
+            if not n:
+                raise ConnectionError("connection closed inside an asset chunk")
+            got += n
+        if view is not None:
+            self.asset_channel.commit(dev_id, rid, asset_id, offset, length)
+
     def send_cmd(self, device_id: str, payload: Dict[str, Any]) -> bool:
         """Send a JSON command string with newline delimiter to the device socket"""
         with self._lock:
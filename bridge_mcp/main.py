@@ -39,6 +39,21 @@ def main():
     def get_devices_api():
         """Get devices list"""
         return device_sessions.list_devices()
+
+    @app.get("/devices/health")
+    def get_devices_health_api():
+        """Command latency and circuit breaker state per device"""
+        return ctx.cmd_waiter.health.get_all()
+
+    @app.get("/devices/{device_id}/health")
+    def get_device_health_api(device_id: str):
+        """Command latency and circuit breaker state of one device"""
+        health = ctx.cmd_waiter.health.get_device(device_id)
+        if health is None:
+            if not device_sessions.get_device(device_id):
+                raise HTTPException(HTTPStatus.NOT_FOUND, "device not found")
+            health = {"state": "closed", "responses": 0, "timeouts": 0, "tools": {}}
+        return {**health, "scheduler": ctx.cmd_waiter.scheduler.get_device(device_id)}
 
     @app.get("/devices/{device_id}")
     def get_device_api(device_id: str):
@@ -122,19 +137,19 @@ def main():
         """Reload configuration and refresh tool definitions"""
         try:
             # 1. Reload raw config from disk
-            server.projection_store.reload_config()
-            ctx.virtual_tool_store.reload_config()
+            affected_devices = server.projection_store.reload_config()
+            virtual_tools_changed = ctx.virtual_tool_store.reload_config()
             
-            # 2. Reset and Re-register tools
-            server.reset_tools()
-            server.register_all_announced_devices()
-            server.register_virtual_tools()
+            # 2. Apply only what changed (clients never see an empty tool list)
+            counts = server.reproject_devices(affected_devices)
+            if virtual_tools_changed:
+                for k, v in server.register_virtual_tools().items():
+                    counts[k] += v
             
-            # 3. Notify MCP clients (optional, if supported)
-            # server.mcp.send_notification("notifications/tools/list_changed")
+            # 3. MCP clients get one coalesced tools/list_changed from the reconciler
             
             log("[API] Hot reload triggered via /management/reload")
-            return {"ok": True, "message": "Configuration reloaded and tools refreshed"}
+            return {"ok": True, "message": "Configuration reloaded and tools refreshed", "changes": counts}
         except Exception as e:
             log(f"[API] Hot reload failed: {e}")
             raise HTTPException(HTTPStatus.INTERNAL_SERVER_ERROR, f"Reload failed: {e}")
@@ -164,7 +179,13 @@ def main():
             "description": data.get("description", ""),
             "bindings": data.get("bindings", [])
         }
-        success = ctx.virtual_tool_store.create_virtual_tool(name, tool_def)
+        for key in ("completion", "deadline_ms"):
+            if data.get(key) is not None:
+                tool_def[key] = data[key]
+        try:
+            success = ctx.virtual_tool_store.create_virtual_tool(name, tool_def)
+        except ValueError as e:
+            raise HTTPException(HTTPStatus.BAD_REQUEST, str(e))
         if success:
             # Re-register virtual tools after creation
             server.register_virtual_tools()
@@ -178,7 +199,13 @@ def main():
             "description": data.get("description", ""),
             "bindings": data.get("bindings", [])
         }
-        success = ctx.virtual_tool_store.update_virtual_tool(name, tool_def)
+        for key in ("completion", "deadline_ms"):
+            if data.get(key) is not None:
+                tool_def[key] = data[key]
+        try:
+            success = ctx.virtual_tool_store.update_virtual_tool(name, tool_def)
+        except ValueError as e:
+            raise HTTPException(HTTPStatus.BAD_REQUEST, str(e))
         if success:
             server.register_virtual_tools()
             return {"ok": True, "message": f"Virtual tool '{name}' updated"}
@@ -189,8 +216,6 @@ def main():
         """Delete a virtual tool"""
         success = ctx.virtual_tool_store.delete_virtual_tool(name)
         if success:
-            server.reset_tools()
-            server.register_all_announced_devices()
             server.register_virtual_tools()
             return {"ok": True, "message": f"Virtual tool '{name}' deleted"}
         raise HTTPException(HTTPStatus.NOT_FOUND, "virtual tool not found")
@@ -199,6 +224,62 @@ def main():
     def get_routing_stats_api():
         """Get routing statistics"""
         return routing_service.get_stats()
+
+    @app.post("/groups/invoke")
+    def invoke_group_api(data: dict):
+        """Invoke a tool on every device matching a selector"""
+        tool = data.get("tool")
+        if not tool:
+            raise HTTPException(HTTPStatus.BAD_REQUEST, "tool is required")
+        try:
+            return server.execute_group(data.get("selector") or {}, tool, data.get("args") or {}, data.get("deadline_ms"))
+        except ValueError as e:
+            raise HTTPException(HTTPStatus.BAD_REQUEST, str(e))
+
+    @app.get("/tools/search")
+    def search_tools_api(q: str, limit: int = 10):
+        """Ranked search over projected device tools"""
+        return {"query": q, "results": server.search_tools(q, limit)}
+
+    @app.get("/commands/scheduler/stats")
+    def get_command_scheduler_stats_api():
+        """Per-device slot usage, queue wait and service time per priority class"""
+        return ctx.cmd_waiter.scheduler.get_stats()
+
+    @app.get("/commands/timeouts/stats")
+    def get_command_timeout_stats_api():
+        """Pending requests, expiries and late responses"""
+        return ctx.cmd_waiter.get_stats()
+
+    @app.get("/commands/outbox/stats")
+    def get_command_outbox_stats_api():
+        """Commands queued for offline devices"""
+        return ctx.cmd_waiter.outbox.get_stats()
+
+    @app.get("/assets/stats")
+    def get_asset_stats_api():
+        """Asset fetch counts and content cache usage"""
+        return ctx.asset_fetcher.get_stats()
+
+    @app.get("/assets/images/stats")
+    def get_image_stats_api():
+        """Image downscaling / re-encoding counts and output cache usage"""
+        return ctx.image_processor.get_stats()
+
+    @app.get("/assets/channel/stats")
+    def get_asset_channel_stats_api():
+        """Assets pushed by devices over MQTT / IPC"""
+        return ctx.asset_channel.get_stats()
+
+    @app.get("/commands/cache/stats")
+    def get_command_cache_stats_api():
+        """Get tool result cache statistics"""
+        return ctx.command_service.get_cache_stats()
+
+    @app.get("/announce/stats")
+    def get_announce_stats_api():
+        """Get announce admission queue statistics"""
+        return ctx.announce_queue.get_stats()
     
     # Mount MCP SSE endpoint
     try:
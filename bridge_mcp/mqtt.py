@@ -1,10 +1,11 @@
 
 import threading
+from functools import partial
 import uuid
 import json
 import paho.mqtt.client as mqtt
 from typing import Optional, Callable
-from .config import MQTT_HOST, MQTT_PORT, KEEPALIVE, SUB_ALL, TOPIC_ANN, TOPIC_STAT, TOPIC_EV, TOPIC_PORTS_ANN, TOPIC_PORTS_DATA
+from .config import MQTT_HOST, MQTT_PORT, KEEPALIVE, SUB_ALL, TOPIC_ANN, TOPIC_STAT, TOPIC_EV, TOPIC_PORTS_ANN, TOPIC_PORTS_DATA, TOPIC_ASSETS
 from .utils import log
 from .device_store import DeviceStore
 from .command import CommandWaiter
@@ -60,11 +61,47 @@ def publish_claim_token(device_id: str, token: str) -> bool:
         log(f"[CLAIM] Failed to publish claim token for {device_id}: {e}")
         return False
 
-def start_mqtt_listener(device_store: DeviceStore, cmd_waiter: CommandWaiter, port_store, port_router):
+def publish_announce_request(device_id: str) -> bool:
+    """Ask a device that sent a hash-only announce to re-send its full announce."""
+    topic = f"mcp/dev/{device_id}/announce/request"
+    try:
+        pub = get_mqtt_pub_client()
+        pub.publish(topic, json.dumps({"type": "device.announce_request"}), qos=1, retain=False)
+        return True
+    except Exception as e:
+        log(f"[ANNOUNCE] Failed to request full announce from {device_id}: {e}")
+        return False
+
+def after_announce(device_store: DeviceStore, action: str, dev_id: str, payload: dict):
+    """MQTT follow-up for an applied announce (may run on an admission worker)."""
+    if action == "announce_request":
+        if publish_announce_request(dev_id):
+            log(f"[ANNOUNCE] Unknown schema hash from {dev_id}, requested full announce")
+        return
+
+    # Extended Logic: Claiming (MQTT Specific)
+    # Devices on the hash-delta protocol set "claimed": true when they
+    # still hold a token, so unchanged announces skip the QoS1 claim push.
+    needs_claim = action == "announce" or (
+        action == "announce_unchanged" and not payload.get("claimed", False)
+    )
+    if needs_claim:
+        # Ensure every announce is paired with a claim token push.
+        # This makes reboot/reset recovery deterministic.
+        token = device_store.get_token(dev_id)
+        if not token:
+            token = generate_token()
+            device_store.set_token(dev_id, token)
+            log(f"[CLAIM] Generated new token for {dev_id}")
+        if publish_claim_token(dev_id, token):
+            log(f"[CLAIM] Sent claim token to {dev_id}")
+
+def start_mqtt_listener(device_store: DeviceStore, cmd_waiter: CommandWaiter, port_store, port_router,
+                        announce_queue=None, asset_channel=None):
     
     # Unified Protocol Handler
-    protocol = ProtocolHandler(device_store, cmd_waiter, port_store, port_router)
-    
+    protocol = ProtocolHandler(device_store, cmd_waiter, port_store, port_router, announce_queue=announce_queue)
+
     def mqtt_thread():
         client = mqtt.Client(
             callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
@@ -85,6 +122,7 @@ def start_mqtt_listener(device_store: DeviceStore, cmd_waiter: CommandWaiter, po
                 c.subscribe(TOPIC_EV)
                 c.subscribe(TOPIC_PORTS_ANN)
                 c.subscribe(TOPIC_PORTS_DATA)
+                c.subscribe(TOPIC_ASSETS)
 
         def on_message(c, userdata, msg):
             # if "ports/data" not in msg.topic:
@@ -93,6 +131,13 @@ def start_mqtt_listener(device_store: DeviceStore, cmd_waiter: CommandWaiter, po
             #         # log(f"[mqtt] RX {msg.topic}")
             #         pass
                     
+            if "/assets/" in msg.topic:
+                # Binary asset chunk: metadata in the topic, raw bytes as payload
+                fields = asset_channel.parse_topic(msg.topic) if asset_channel is not None else None
+                if fields:
+                    asset_channel.put(*fields, msg.payload)
+                return
+
             try:
                 payload = json.loads(msg.payload.decode("utf-8"))
             except Exception:
@@ -101,19 +146,8 @@ def start_mqtt_listener(device_store: DeviceStore, cmd_waiter: CommandWaiter, po
 
             try:
                 # Delegate to Unified Protocol Handler
-                action, dev_id = protocol.handle_message(msg.topic, payload, protocol="mqtt")
-                
-                # Extended Logic: Claiming (MQTT Specific)
-                if action == "announce" and dev_id:
-                    # Ensure every announce is paired with a claim token push.
-                    # This makes reboot/reset recovery deterministic.
-                    token = device_store.get_token(dev_id)
-                    if not token:
-                        token = generate_token()
-                        device_store.set_token(dev_id, token)
-                        log(f"[CLAIM] Generated new token for {dev_id}")
-                    if publish_claim_token(dev_id, token):
-                        log(f"[CLAIM] Sent claim token to {dev_id}")
+                action, dev_id = protocol.handle_message(msg.topic, payload, protocol="mqtt",
+                                                         on_announce=partial(after_announce, device_store))
 
                 # If device reports wrong token, rotate and re-claim immediately.
                 if action == "events" and dev_id:
@@ -1,19 +1,31 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable
 import json
 from .utils import log
-from .device_store import DeviceStore
+from .device_store import DeviceStore, ANNOUNCE_UPDATED, ANNOUNCE_UNCHANGED, ANNOUNCE_SCHEMA_UNKNOWN
 from .command import CommandWaiter
 
+def announce_action(outcome: str) -> str:
+    """Map a DeviceStore.upsert_announce outcome to the action reported to transports."""
+    if outcome == ANNOUNCE_SCHEMA_UNKNOWN:
+        # Hash-only announce for a schema we don't hold: transport asks for the full payload.
+        return "announce_request"
+    if outcome == ANNOUNCE_UNCHANGED:
+        return "announce_unchanged"
+    return "announce"
+
 class ProtocolHandler:
     """
     Unified Message Processor for SABA.
     Handles business logic regardless of transport (IPC vs MQTT).
     """
-    def __init__(self, device_store: DeviceStore, cmd_waiter: CommandWaiter, port_store, port_router):
+    def __init__(self, device_store: DeviceStore, cmd_waiter: CommandWaiter, port_store, port_router,
+                 announce_queue=None):
         self.device_store = device_store
         self.cmd_waiter = cmd_waiter
         self.port_store = port_store
         self.port_router = port_router
+        # Optional AnnounceAdmissionQueue; full announces are processed off the ingest thread
+        self.announce_queue = announce_queue
 
     def parse_topic(self, topic: str):
         """
@@ -26,7 +38,8 @@ class ProtocolHandler:
             return device_id, leaf
         return None, None
 
-    def handle_message(self, topic: str, payload: Dict[str, Any], protocol: str, device_id_hint: str = None):
+    def handle_message(self, topic: str, payload: Dict[str, Any], protocol: str, device_id_hint: str = None,
+                       on_announce: Optional[Callable[[str, str, Dict[str, Any]], None]] = None):
         """
         Main entry point for all incoming messages.
         
@@ -35,6 +48,8 @@ class ProtocolHandler:
             payload: The parsed JSON payload
             protocol: "ipc" or "mqtt"
             device_id_hint: Optional override for deviceID (e.g. from socket connection)
+            on_announce: Optional transport follow-up (action, device_id, payload), called once
+                         the announce is applied - inline, or later on an admission worker.
         """
         # 1. Parse Topic
         dev_id, leaf = self.parse_topic(topic)
@@ -53,11 +68,24 @@ class ProtocolHandler:
         # 3. Route by Leaf (Action)
         
         if leaf == "announce":
-            self.device_store.upsert_announce(dev_id, payload, protocol=protocol)
             # Note: MQTT might do "claiming" here. 
             # Ideally ProtocolHandler returns "actions" for the transport to take? 
             # Or we inject a 'ClaimService'. For now, we'll keep claim logic in MQTT transport or move it here later.
-            return ("announce", dev_id)
+            if self.announce_queue and self.device_store.classify_announce(dev_id, payload) == ANNOUNCE_UPDATED:
+                def on_done(outcome, dev_id=dev_id, payload=payload):
+                    if on_announce:
+                        on_announce(announce_action(outcome), dev_id, payload)
+
+                if self.announce_queue.submit(dev_id, payload, protocol, on_done=on_done):
+                    return ("announce_queued", dev_id)
+                log(f"[PROTOCOL] Announce queue full, dropping announce from {dev_id}")
+                return ("announce_dropped", dev_id)
+
+            # Cheap outcomes (unchanged / schema request) or no admission queue: handle inline
+            action = announce_action(self.device_store.upsert_announce(dev_id, payload, protocol=protocol))
+            if on_announce:
+                on_announce(action, dev_id, payload)
+            return (action, dev_id)
 
         elif leaf == "status":
             self.device_store.update_status(dev_id, payload)
@@ -1,16 +1,44 @@
+import asyncio
 import json
-from typing import List, Union, Any
-from mcp.server.fastmcp import FastMCP
+import time
+import uuid
+from typing import List, Union, Any, Literal, Optional, Annotated
+from functools import partial
+from mcp.server.fastmcp import Context
 from mcp.types import ImageContent, TextContent, Resource
+from pydantic import Field
 
-from .utils import log, convert_response_to_content_list, json_schema_to_pydantic_model
+from .utils import log, convert_response_to_content_list, prefetch_assets, json_schema_to_pydantic_model, param_model_cache_stats, canonical_hash
+from .tool_reconciler import DesiredTool, ToolReconciler, ToolListNotifier, SessionTrackingFastMCP
 from .device_store import DeviceStore
 from .tool_projection import ToolProjectionStore
+from .device_selector import compile_selector
 from .tool_registry import DynamicToolRegistry
-from .command import CommandWaiter, publish_cmd
+from .command import CommandWaiter, publish_cmd, publish_cmds
 from .mqtt import get_mqtt_pub_client, publish_to_inport
 from port_routing import PortStore, RoutingMatrix
 
+
+def _progress_forwarder(ctx: Optional[Context]):
+    """on_chunk callback forwarding streamed partial results as MCP progress notifications
+    (None if the client did not ask for progress). Called from worker threads."""
+    try:
+        meta = ctx.request_context.meta if ctx is not None else None
+    except ValueError:  # not inside a request
+        return None
+    if meta is None or meta.progressToken is None:
+        return None
+    loop = asyncio.get_running_loop()
+    count = 0
+
+    def on_chunk(chunk: dict):
+        nonlocal count
+        count += 1
+        text = (chunk.get("result") or {}).get("text") or None
+        asyncio.run_coroutine_threadsafe(ctx.report_progress(count, None, text), loop)
+    return on_chunk
+
+
 class BridgeServer:
     def __init__(self, 
                  device_store: DeviceStore, 
@@ -23,8 +51,13 @@ class BridgeServer:
                  command_service=None,
                  ipc_agent=None,
                  virtual_tool_store=None,
-                 virtual_tool_executor=None):
-        self.mcp = FastMCP("bridge-mcp")
+                 virtual_tool_executor=None,
+                 asset_fetcher=None,
+                 image_processor=None,
+                 asset_channel=None):
+        self.tool_notifier = ToolListNotifier()
+        self.mcp = SessionTrackingFastMCP("bridge-mcp", self.tool_notifier)
+        self.reconciler = ToolReconciler(self.mcp, self.tool_notifier)
         self.device_store = device_store
         self.projection_store = projection_store
         self.tool_registry = tool_registry
@@ -36,7 +69,13 @@ class BridgeServer:
         self.ipc_agent = ipc_agent
         self.virtual_tool_store = virtual_tool_store
         self.virtual_tool_executor = virtual_tool_executor
-        self._registered_virtual_tools = set()  # Track registered virtual tool names
+        self.asset_fetcher = asset_fetcher
+        self.image_processor = image_processor
+        self.asset_channel = asset_channel
+        # Grouped projection mode: groups each device currently belongs to, and
+        # the projected name of every exposed group (kept after the group empties)
+        self._device_groups: dict = {}
+        self._group_names: dict = {}
         
         self.setup_resources()
         self.setup_tools()
@@ -107,6 +146,27 @@ class BridgeServer:
                 text=json.dumps(projection_summary, indent=2)
             )
 
+        @self.mcp.resource("bridge://tool-groups")
+        def res_tool_groups() -> Resource:
+            """Grouped projection mode: tool name -> member devices"""
+            return Resource(
+                uri="bridge://tool-groups",
+                name="tool-groups",
+                description="Grouped tools and the devices each one can target",
+                mimeType="application/json",
+                text=json.dumps(self._tool_groups_view(), indent=2)
+            )
+
+        @self.mcp.resource("bridge://tool-groups/{tool_name}")
+        def res_tool_group(tool_name: str) -> Resource:
+            return Resource(
+                uri=f"bridge://tool-groups/{tool_name}",
+                name="tool-group",
+                description=f"Devices accepted by grouped tool {tool_name}",
+                mimeType="application/json",
+                text=json.dumps(self._tool_groups_view().get(tool_name, {"error": "not found"}), indent=2)
+            )
+
         @self.mcp.resource("bridge://ports")
         def res_ports() -> Resource:
             """모든 디바이스의 포트 정보"""
@@ -136,31 +196,39 @@ class BridgeServer:
 
     def setup_tools(self):
         @self.mcp.tool()
-        def invoke(device_id: str, tool: str, args: dict | None = None) -> List[Union[ImageContent, TextContent]]:
+        async def invoke(device_id: str, tool: str, args: dict | None = None,
+                         ctx: Context = None) -> List[Union[ImageContent, TextContent]]:
             """Generic tool invoker (fallback for any device tool) - uses original tool names"""
-            args = args or {}
-            
-            d = self.device_store.get(device_id)
-            if d and not d.get("online", False):
-                return [TextContent(type="text", text=f"Error: Device {device_id} is offline")]
-
-            if self.command_service:
-                ok, resp = self.command_service.execute(device_id, tool, args)
-            else:
-                ok, resp = publish_cmd(
-                    self.device_store,
-                    self.cmd_waiter,
-                    get_mqtt_pub_client(),
-                    device_id,
-                    tool,
-                    args,
-                    ipc_agent=self.ipc_agent,
-                )
-            if not ok:
-                error_msg = resp.get("error", {}).get("message", "Unknown error")
-                return [TextContent(type="text", text=f"Error: {error_msg}")]
-            
-            return convert_response_to_content_list(resp)
+            return await asyncio.to_thread(self._invoke, device_id, tool, args or {}, _progress_forwarder(ctx))
+
+        @self.mcp.tool()
+        async def invoke_many(calls: List[dict],
+                              deadline_ms: int | None = None) -> List[Union[ImageContent, TextContent]]:
+            """Invoke several device tools concurrently (original tool names).
+            calls: [{"device_id": ..., "tool": ..., "args": {...}, "timeout_ms": optional}].
+            deadline_ms bounds the whole batch. Results are listed in completion order."""
+            return await asyncio.to_thread(self._invoke_many, calls, deadline_ms)
+
+        @self.mcp.tool()
+        async def invoke_group(selector: dict, tool: str, args: dict | None = None,
+                               deadline_ms: int | None = None) -> List[TextContent]:
+            """Invoke one tool (original name) on every online device matching selector.
+            selector keys (all must match): device_ids, tag, tags, name (glob), firmware (glob), alias (glob), protocol."""
+            try:
+                result = await asyncio.to_thread(self.execute_group, selector, tool, args or {}, deadline_ms)
+            except ValueError as e:
+                return [TextContent(type="text", text=f"Error: {e}")]
+            
+            lines = [
+                f"Group {result['group_request_id']}: {result['success']}/{result['targeted']} succeeded, "
+                f"{result['failed']} failed, {len(result['skipped'])} skipped ({result['elapsed_ms']}ms)"
+            ]
+            for r in result["results"]:
+                if not r["ok"]:
+                    lines.append(f"  ✗ {r['device_id']}: {r['error']}")
+            for s in result["skipped"]:
+                lines.append(f"  - {s['device_id']}: {s['reason']}")
+            return [TextContent(type="text", text="\n".join(lines))]
 
         @self.mcp.tool()
         def list_devices(show_offline: bool = False) -> List[TextContent]:
@@ -183,8 +251,7 @@ class BridgeServer:
                 device_alias = self.projection_store.get_device_alias(device_id, device.get('name'))
                 is_enabled = self.projection_store.is_device_enabled(device_id)
                 
-                projected_tools = [t for t in self.tool_registry.list_all_tools() if t['device_id'] == device_id]
-                projected_count = len(projected_tools)
+                projected_count = len(self.tool_registry.get_device_tools(device_id))
                 
                 device_summary.append(
                     f"• {device_id} → '{device_alias}' ({status}, {projected_count}/{tools_count} tools projected, {'enabled' if is_enabled else 'disabled'})"
@@ -222,6 +289,22 @@ class BridgeServer:
             summary_text = f"Device {device_id} → '{device_alias}' tools ({len(tools)} total):\n" + "\n".join(tool_summary)
             return [TextContent(type="text", text=summary_text)]
 
+        @self.mcp.tool()
+        def find_tools(query: str, limit: int = 10) -> List[TextContent]:
+            """Search projected device tools by name, description, parameter names or device alias (ranked)."""
+            results = self.search_tools(query, limit)
+            if not results:
+                return [TextContent(type="text", text=f"No tools match '{query}'")]
+            
+            lines = [f"Top {len(results)} tools for '{query}':"]
+            for r in results:
+                status = "online" if r["online"] else "offline"
+                lines.append(
+                    f"• {r['tool']} on {r['device_id']} ('{r['device_alias']}', {status}, score {r['score']}): {r['description']}"
+                )
+                lines.append(f"    invoke(device_id='{r['device_id']}', tool='{r['original_name']}')")
+            return [TextContent(type="text", text="\n".join(lines))]
+
         @self.mcp.tool()
         def list_ports() -> List[TextContent]:
             """List all device ports (outports and inports) with routing info."""
@@ -386,96 +469,460 @@ class BridgeServer:
             log(f"[MCP] Skipping tool registration for offline device: {device_id}")
             return
         
-        # log(f"[MCP] Registering dynamic projected tools for device {device_id}")
+        self._reconcile_device(device)
+
+    def _reconcile_device(self, device: dict) -> dict:
+        """Reconcile one device's tools in the active projection mode"""
+        device_id = device["device_id"]
+        if not self.tool_registry.has_device(device_id) and device.get("tools"):
+            # Loaded from devices.json, not announced since startup
+            self.tool_registry.register_device_tools(device_id, device["tools"], device.get("name"))
+        if not self.projection_store.is_tool_grouping_enabled():
+            return self.reconciler.reconcile(f"device:{device_id}", self._desired_device_tools(device))
+        
+        counts = self.reconciler.reconcile(f"device:{device_id}", {})
+        groups = self.tool_registry.get_device_groups(device_id)
+        touched = groups | self._device_groups.get(device_id, set())
+        if groups:
+            self._device_groups[device_id] = groups
+        else:
+            self._device_groups.pop(device_id, None)
+        for k, v in self._reconcile_groups(touched).items():
+            counts[k] += v
+        return counts
+
+    def _reconcile_groups(self, group_ids) -> dict:
+        """
+        Reconcile grouped tools. Groups sharing a projected name are reconciled
+        together, since a second group changes the first one's tool name.
+        """
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        names = set()
+        for gid in group_ids:
+            sample = self.tool_registry.get_group_sample(gid)
+            name = sample["projected_name"] if sample else self._group_names.get(gid)
+            if name:
+                names.add(name)
+        
+        targets = set(group_ids)
+        for name in names:
+            targets |= self.tool_registry.get_group_ids_for_name(name)
+        
+        for gid in targets:
+            desired = {}
+            sample = self.tool_registry.get_group_sample(gid)
+            entry = self._desired_group_tool(gid)
+            if entry is not None:
+                desired[gid] = entry
+                self._group_names[gid] = sample["projected_name"]
+            else:
+                self._group_names.pop(gid, None)
+            for k, v in self.reconciler.reconcile(f"group:{gid}", desired).items():
+                counts[k] += v
+        return counts
+
+    def _group_tool_name(self, group_id: str, projected_name: str) -> str:
+        """Plain projected name unless several schemas share it"""
+        if len(self.tool_registry.get_group_ids_for_name(projected_name)) > 1:
+            return f"{projected_name}_{group_id[:6]}"
+        return projected_name
+
+    def _desired_group_tool(self, group_id: str) -> Optional[DesiredTool]:
+        sample = self.tool_registry.get_group_sample(group_id)
+        if not sample:
+            return None
+        schema = sample.get("parameters", {})
+        if not schema or schema.get("type") != "object":
+            return None
+        
+        # Offline members are left out, as in per-device mode; with none online the tool is not exposed
+        members = [m["device_id"] for m in self.tool_registry.get_group_members(group_id)]
+        online = self.device_store.get_online(members)
+        members = [device_id for device_id in members if online.get(device_id)]
+        if not members:
+            return None
+        
+        name = self._group_tool_name(group_id, sample["projected_name"])
+        member_ids = None
+        if len(members) <= self.projection_store.get_group_enum_max():
+            member_ids = sorted(members)
+        
+        fingerprint = canonical_hash([name, sample["description"], schema, member_ids])
+        return DesiredTool(
+            name,
+            fingerprint,
+            partial(self._build_group_tool_func, group_id, name, sample, schema, member_ids),
+        )
+
+    def _build_group_tool_func(self, group_id: str, name: str, sample: dict, schema: dict, member_ids: Optional[list]):
+        ParamModel = json_schema_to_pydantic_model(f"{sample['projected_name']}_params", schema)
+        if member_ids:
+            DeviceParam = Annotated[Literal[tuple(member_ids)], Field(description="Target device id")]
+        else:
+            DeviceParam = Annotated[str, Field(
+                description=f"Target device id or alias (members: bridge://tool-groups/{name})"
+            )]
+        
+        async def group_tool_func(device_id: DeviceParam, params: ParamModel,
+                                  ctx: Context = None) -> List[Union[ImageContent, TextContent]]:
+            member = self.tool_registry.get_group_member(group_id, device_id)
+            if member is None:
+                # Selector given as alias: rare path, linear in group size
+                member = next(
+                    (m for m in self.tool_registry.get_group_members(group_id) if m.get("device_alias") == device_id),
+                    None,
+                )
+            if member is None:
+                return [TextContent(type="text", text=f"Error: Device {device_id} does not provide {name}")]
+            return await asyncio.to_thread(
+                self._call_device_tool, member["device_id"], member["original_name"], params.dict(), name,
+                _progress_forwarder(ctx),
+            )
+        
+        group_tool_func.__name__ = name
+        group_tool_func.__doc__ = sample["description"]
+        return group_tool_func
+
+    def search_tools(self, query: str, limit: int = 10) -> list:
+        """Ranked tool search; "tool" is the MCP tool name to call in the active projection mode"""
+        limit = max(1, min(int(limit), 100))
+        grouped = self.projection_store.is_tool_grouping_enabled()
+        results = []
+        for entry in self.tool_registry.search_tools(query, limit):
+            d = self.device_store.get(entry["device_id"]) or {}
+            if grouped:
+                tool = self._group_tool_name(entry["group_id"], entry["projected_name"])
+            else:
+                tool = entry["projected_name"]
+            results.append({
+                "tool": tool,
+                "device_id": entry["device_id"],
+                "device_alias": entry["device_alias"],
+                "original_name": entry["original_name"],
+                "description": entry["description"],
+                "online": d.get("online", False),
+                "score": entry["score"],
+            })
+        return results
+
+    def _tool_groups_view(self) -> dict:
+        view = {}
+        for gid in list(self._group_names):
+            sample = self.tool_registry.get_group_sample(gid)
+            if not sample:
+                continue
+            name = self._group_tool_name(gid, sample["projected_name"])
+            view[name] = {
+                "group_id": gid,
+                "projected_name": sample["projected_name"],
+                "members": [
+                    {"device_id": m["device_id"], "device_alias": m["device_alias"]}
+                    for m in self.tool_registry.get_group_members(gid)
+                ]
+            }
+        return view
+
+    def _desired_device_tools(self, device: dict) -> dict:
+        """Projected tools a device should expose: {tool_key: DesiredTool}"""
+        device_id = device["device_id"]
+        desired = {}
+        if not device.get("online", False):
+            return desired
         
-        for tool_info in device["tools"]:
+        for tool_info in device.get("tools", []):
             tool_name = tool_info.get("name", "")
             if not tool_name:
                 continue
             
             if not self.projection_store.is_tool_enabled(device_id, tool_name):
-                log(f"[MCP] Skipping disabled tool: {tool_name} for device {device_id}")
                 continue
             
             projected_tool = self.projection_store.get_tool_projection(device_id, tool_name, tool_info)
             projected_name = projected_tool["name"]
-            
             tool_key = f"{projected_name}_{device_id}"
             
-            if self.tool_registry.get_registered_function(tool_key):
+            schema = tool_info.get("parameters", {})
+            if not schema or schema.get("type") != "object":
+                log(f"[MCP] Skipping tool {tool_key}: invalid or missing schema")
                 continue
             
-            try:
-                schema = tool_info.get("parameters", {})
-                if not schema or schema.get("type") != "object":
-                    log(f"[MCP] Skipping tool {tool_key}: invalid or missing schema")
-                    continue
-                
-                ParamModel = json_schema_to_pydantic_model(f"{tool_key}_params", schema)
-                
-                # Capture variables in closure
-                def create_tool_func(device_id_copy, original_tool_name_copy, projected_tool_copy, param_model):
-                    def tool_func(params: param_model) -> List[Union[ImageContent, TextContent]]:
-                        """Dynamically generated projected device tool function with proper schema"""
-                        args = params.dict()
-                        
-                        # Check online status before invoking
-                        d = self.device_store.get(device_id_copy)
-                        if d and not d.get("online", False):
-                             return [TextContent(type="text", text=f"Error: Device {device_id_copy} is offline")]
-
-                        # Sanitize args
-                        for k, v in args.items():
-                            if isinstance(v, str) and v.strip().startswith('{'):
-                                try:
-                                    loaded = json.loads(v)
-                                    if isinstance(loaded, dict) and k in loaded:
-                                        args[k] = loaded[k]
-                                        log(f"[MCP] Auto-unwrapped nested JSON for arg '{k}'")
-                                except:
-                                    pass
-
-
-                        log(f"[PROJECTED_TOOL] {projected_tool_copy['name']} ({original_tool_name_copy}) called with args: {json.dumps(args, indent=2)}")
-                        
-                        if self.command_service:
-                            ok, resp = self.command_service.execute(device_id_copy, original_tool_name_copy, args)
-                        else:
-                            ok, resp = publish_cmd(
-                                self.device_store,
-                                self.cmd_waiter,
-                                get_mqtt_pub_client(),
-                                device_id_copy,
-                                original_tool_name_copy,
-                                args,
-                                ipc_agent=self.ipc_agent,
-                            )
-                        
-                        if not ok:
-                            error_msg = resp.get("error", {}).get("message", "Unknown error")
-                            return [TextContent(type="text", text=f"Error: {error_msg}")]
-                        
-                        return convert_response_to_content_list(resp)
-                    
-                    tool_func.__name__ = projected_tool_copy["name"]
-                    tool_func.__doc__ = projected_tool_copy["description"]
-                    
-                    return tool_func
-                
-                dynamic_func = create_tool_func(device_id, tool_name, projected_tool, ParamModel)
-                decorated_func = self.mcp.tool()(dynamic_func)
-                self.tool_registry.set_registered_function(tool_key, decorated_func)
-                
-                # log(f"[MCP] Successfully registered projected tool: {tool_key}")
-                
-            except Exception as e:
-                log(f"[MCP] Failed to register projected tool {tool_key}: {e}")
+            fingerprint = canonical_hash([tool_name, projected_name, projected_tool["description"], schema])
+            desired[tool_key] = DesiredTool(
+                projected_name,
+                fingerprint,
+                partial(self._build_device_tool_func, device_id, tool_name, projected_tool, schema),
+            )
+        return desired
+
+    def _build_device_tool_func(self, device_id: str, tool_name: str, projected_tool: dict, schema: dict):
+        projected_name = projected_tool["name"]
+        # Device-independent name so identical schemas share one cached model
+        ParamModel = json_schema_to_pydantic_model(f"{projected_name}_params", schema)
+        
+        # Capture variables in closure
+        def create_tool_func(device_id_copy, original_tool_name_copy, projected_tool_copy, param_model):
+            async def tool_func(params: param_model, ctx: Context = None) -> List[Union[ImageContent, TextContent]]:
+                """Dynamically generated projected device tool function with proper schema"""
+                return await asyncio.to_thread(
+                    self._call_device_tool, device_id_copy, original_tool_name_copy, params.dict(),
+                    projected_tool_copy["name"], _progress_forwarder(ctx),
+                )
+            
+            tool_func.__name__ = projected_tool_copy["name"]
+            tool_func.__doc__ = projected_tool_copy["description"]
+            
+            return tool_func
+        
+        return create_tool_func(device_id, tool_name, projected_tool, ParamModel)
+
+    def execute_many(self, calls: List[dict], deadline_ms=None, on_result=None) -> list:
+        """Dispatch all calls at once; offline devices fail fast without a send"""
+        results: list = [None] * len(calls)
+        batch, positions = [], []
+        for i, call in enumerate(calls):
+            device_id = call.get("device_id", "") if isinstance(call, dict) else ""
+            d = self.device_store.get(device_id)
+            if d and not d.get("online", False):
+                results[i] = (False, {"ok": False, "error": {"code": "offline", "message": f"Device {device_id} is offline"}})
+                if on_result:
+                    on_result(i, *results[i])
+                continue
+            batch.append(call if isinstance(call, dict) else {})
+            positions.append(i)
+        
+        def forward(index, ok, resp):
+            if on_result:
+                on_result(positions[index], ok, resp)
+        
+        if self.command_service:
+            batch_results = self.command_service.execute_many(batch, deadline_ms=deadline_ms, on_result=forward)
+        else:
+            batch_results = publish_cmds(
+                self.device_store,
+                self.cmd_waiter,
+                get_mqtt_pub_client(),
+                batch,
+                deadline_ms=deadline_ms,
+                ipc_agent=self.ipc_agent,
+                on_result=forward,
+            )
+        for index, result in zip(positions, batch_results):
+            results[index] = result
+        return results
+
+    def execute_group(self, selector: dict, tool: str, args: dict, deadline_ms=None) -> dict:
+        """
+        Run `tool` on every device matching selector, correlated under one group request id.
+        Group-capable MQTT devices get one shared publish; others are sent individually.
+        Raises ValueError on an invalid selector.
+        """
+        started = time.perf_counter()
+        matched = self.device_store.select(compile_selector(selector, self.projection_store))
+        group_request_id = uuid.uuid4().hex
+        
+        commands, skipped = [], []
+        for d in matched:
+            if not d["online"]:
+                skipped.append({"device_id": d["device_id"], "reason": "offline"})
+            elif tool not in d["tools"]:
+                skipped.append({"device_id": d["device_id"], "reason": f"no tool '{tool}'"})
+            else:
+                commands.append({
+                    "device_id": d["device_id"],
+                    "tool": tool,
+                    "args": args,
+                    "request_id": f"{group_request_id}:{d['device_id']}",
+                    "group_request_id": group_request_id,
+                })
+        
+        log(f"[GROUP] {group_request_id}: {len(commands)} targets for {tool} (selector={json.dumps(selector)})")
+        outcomes = self.execute_many(commands, deadline_ms=deadline_ms) if commands else []
+        
+        results = []
+        for command, (ok, resp) in zip(commands, outcomes):
+            entry = {"device_id": command["device_id"], "ok": ok, "response": resp}
+            if not ok:
+                entry["error"] = resp.get("error", {}).get("message", "Unknown error")
+            results.append(entry)
+        success = sum(1 for r in results if r["ok"])
+        return {
+            "group_request_id": group_request_id,
+            "tool": tool,
+            "matched": len(matched),
+            "targeted": len(commands),
+            "success": success,
+            "failed": len(commands) - success,
+            "skipped": skipped,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000),
+            "results": results,
+        }
+
+    def _invoke_many(self, calls: List[dict], deadline_ms=None) -> List[Union[ImageContent, TextContent]]:
+        if not calls:
+            return [TextContent(type="text", text="Error: calls is empty")]
+        
+        started = time.perf_counter()
+        completed = []  # (index, ok, resp, elapsed_ms) in completion order
+        
+        def on_result(i, ok, resp):
+            completed.append((i, ok, resp, (time.perf_counter() - started) * 1000))
+            if ok and self.asset_fetcher:
+                # Images download while the remaining calls are still running
+                prefetch_assets(resp, self.asset_fetcher)
+        
+        self.execute_many(calls, deadline_ms=deadline_ms, on_result=on_result)
+        
+        succeeded = sum(1 for _, ok, _, _ in completed if ok)
+        contents: List[Union[ImageContent, TextContent]] = [TextContent(
+            type="text",
+            text=f"invoke_many: {succeeded}/{len(calls)} succeeded in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )]
+        for i, ok, resp, elapsed_ms in completed:
+            call = calls[i] if isinstance(calls[i], dict) else {}
+            header = f"[{i}] {call.get('device_id', '?')}/{call.get('tool', '?')} ({elapsed_ms:.0f}ms)"
+            if not ok:
+                error_msg = resp.get("error", {}).get("message", "Unknown error")
+                contents.append(TextContent(type="text", text=f"{header} Error: {error_msg}"))
+                continue
+            contents.append(TextContent(type="text", text=header))
+            contents.extend(self._to_content(resp, call.get('device_id', ''), call.get('tool', '')))
+        return contents
+
+    def _invoke(self, device_id: str, tool: str, args: dict, on_chunk=None):
+        """Blocking body of the generic invoke tool"""
+        d = self.device_store.get(device_id)
+        if d and not d.get("online", False) and not self.cmd_waiter.outbox.enabled:
+            return [TextContent(type="text", text=f"Error: Device {device_id} is offline")]
+
+        if self.command_service:
+            ok, resp = self.command_service.execute(device_id, tool, args, on_chunk=on_chunk)
+        else:
+            ok, resp = publish_cmd(
+                self.device_store,
+                self.cmd_waiter,
+                get_mqtt_pub_client(),
+                device_id,
+                tool,
+                args,
+                ipc_agent=self.ipc_agent,
+                on_chunk=on_chunk,
+            )
+        if not ok:
+            error_msg = resp.get("error", {}).get("message", "Unknown error")
+            return [TextContent(type="text", text=f"Error: {error_msg}")]
+        
+        return self._to_content(resp, device_id, tool)
+
+    def _call_device_tool(self, device_id: str, original_tool_name: str, args: dict, projected_name: str,
+                          on_chunk=None):
+        """Shared body of projected and grouped device tools (blocking; tools run it in a worker thread)"""
+        # Check online status before invoking
+        d = self.device_store.get(device_id)
+        if d and not d.get("online", False) and not self.cmd_waiter.outbox.enabled:
+             return [TextContent(type="text", text=f"Error: Device {device_id} is offline")]
+
+        # Sanitize args
+        for k, v in args.items():
+            if isinstance(v, str) and v.strip().startswith('{'):
+                try:
+                    loaded = json.loads(v)
+                    if isinstance(loaded, dict) and k in loaded:
+                        args[k] = loaded[k]
+                        log(f"[MCP] Auto-unwrapped nested JSON for arg '{k}'")
+                except:
+                    pass
+
+
+        log(f"[PROJECTED_TOOL] {projected_name} ({original_tool_name}) called with args: {json.dumps(args, indent=2)}")
+        
+        if self.command_service:
+            ok, resp = self.command_service.execute(device_id, original_tool_name, args, on_chunk=on_chunk)
+        else:
+            ok, resp = publish_cmd(
+                self.device_store,
+                self.cmd_waiter,
+                get_mqtt_pub_client(),
+                device_id,
+                original_tool_name,
+                args,
+                ipc_agent=self.ipc_agent,
+                on_chunk=on_chunk,
+            )
+        
+        if not ok:
+            error_msg = resp.get("error", {}).get("message", "Unknown error")
+            return [TextContent(type="text", text=f"Error: {error_msg}")]
+        
+        return self._to_content(resp, device_id, original_tool_name)
+
+    def _to_content(self, resp: dict, device_id: str, tool: str) -> List[Union[ImageContent, TextContent]]:
+        """MCP content of a successful device response, images processed per the tool's projection settings"""
+        return convert_response_to_content_list(
+            resp, self.projection_store.get_tool_image_settings(device_id, tool), device_id,
+            fetcher=self.asset_fetcher, processor=self.image_processor, channel=self.asset_channel,
+        )
+
+    def reproject_devices(self, device_ids=None):
+        """Re-apply projection config to the given devices (all if None) without touching others"""
+        changes = self.tool_registry.reproject_devices(device_ids)
+        log(f"[MCP] Re-projected {len(changes)} devices")
+        return self.reconcile_tools(
+            device_ids=None if device_ids is None else set(device_ids),
+            include_virtual=False,
+        )
+
+    def reconcile_tools(self, device_ids=None, include_virtual: bool = True):
+        """
+        Diff desired tools against registered ones and apply only the changes.
+        device_ids limits the pass to those devices (all known devices if None).
+        """
+        started = time.perf_counter()
+        totals = {"added": 0, "updated": 0, "removed": 0}
+        
+        devices = self.device_store.list()
+        seen = set()
+        for device in devices:
+            device_id = device.get("device_id")
+            if not device_id or (device_ids is not None and device_id not in device_ids):
+                continue
+            seen.add(device_id)
+            for k, v in self._reconcile_device(device).items():
+                totals[k] += v
+        
+        if not self.projection_store.is_tool_grouping_enabled():
+            # Grouping switched off: drop every grouped tool
+            for scope in self.reconciler.scopes():
+                if scope.startswith("group:"):
+                    for k, v in self.reconciler.reconcile(scope, {}).items():
+                        totals[k] += v
+            self._device_groups.clear()
+            self._group_names.clear()
+        
+        # Devices that vanished from the store
+        for scope in self.reconciler.scopes():
+            if not scope.startswith("device:"):
+                continue
+            device_id = scope[len("device:"):]
+            if device_id in seen or (device_ids is not None and device_id not in device_ids):
+                continue
+            for k, v in self.reconciler.reconcile(scope, {}).items():
+                totals[k] += v
+        
+        if include_virtual:
+            for k, v in self.register_virtual_tools().items():
+                totals[k] += v
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        log(f"[MCP] Reconciled tools in {elapsed_ms:.1f}ms: {totals}")
+        return totals
 
     def reset_tools(self):
         """Clear all registered tools from both internal registry and FastMCP"""
         # 1. Clear our internal registries
         self.tool_registry.clear_tools()
-        self._registered_virtual_tools.clear()  # Clear virtual tools tracking
+        self.reconciler.forget_all()
+        self._device_groups.clear()
+        self._group_names.clear()
         
         # 2. Clear FastMCP internal registry
         # FastMCP implementation details: it likely stores tools in _tool_manager or has a list.
@@ -504,40 +951,42 @@ class BridgeServer:
         """Register tools for all devices that were announced before FastMCP initialization"""
         devices = self.device_store.list()
         # log(f"[MCP] Registering tools for {len(devices)} announced devices")
+        started = time.perf_counter()
         for device in devices:
             device_id = device.get("device_id")
             if device_id:
                 self.register_dynamic_tools_for_device(device_id)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        log(f"[MCP] Registered tools for {len(devices)} devices in {elapsed_ms:.1f}ms "
+            f"(param models: {param_model_cache_stats()})")
 
     def register_virtual_tools(self):
-        """Register all virtual tools from the virtual tool store"""
+        """Reconcile virtual tools with the virtual tool store (adds, updates and removes)"""
         if not self.virtual_tool_store or not self.virtual_tool_executor:
             log("[MCP] Virtual tool store/executor not configured, skipping virtual tool registration")
-            return
+            return {}
         
         virtual_tools = self.virtual_tool_store.get_all_virtual_tools()
-        log(f"[MCP] Registering {len(virtual_tools)} virtual tools")
-        
+        desired = {}
         for vt_name, vt_def in virtual_tools.items():
-            # Skip if already registered
-            if vt_name in self._registered_virtual_tools:
-                continue
-            
             try:
-                self._register_single_virtual_tool(vt_name, vt_def)
-                self._registered_virtual_tools.add(vt_name)
-                # log(f"[MCP] Registered virtual tool: {vt_name}")
+                schema = self._virtual_tool_schema(vt_name)
             except Exception as e:
-                log(f"[MCP] Failed to register virtual tool {vt_name}: {e}")
-    
-    def _register_single_virtual_tool(self, name: str, vt_def: dict):
-        """Register a single virtual tool with FastMCP"""
-        # log(f"[MCP] _register_single_virtual_tool called for: {name}")
-        description = vt_def.get("description", f"Virtual tool: {name}")
-        bindings = vt_def.get("bindings", [])
-        # log(f"[MCP] Virtual tool {name} has {len(bindings)} bindings")
+                log(f"[MCP] Failed to build schema for virtual tool {vt_name}: {e}")
+                continue
+            desired[f"vt:{vt_name}"] = DesiredTool(
+                vt_name,
+                canonical_hash([vt_def, schema]),
+                partial(self._build_virtual_tool_func, vt_name, vt_def, schema),
+            )
         
-        # Build parameter schema from bindings
+        counts = self.reconciler.reconcile("virtual", desired)
+        log(f"[MCP] Reconciled {len(virtual_tools)} virtual tools: {counts} "
+            f"(plans: {self.virtual_tool_store.get_plan_stats()})")
+        return counts
+
+    def _virtual_tool_schema(self, name: str) -> dict:
+        """Build parameter schema from bindings"""
         schema = self.virtual_tool_store.build_virtual_tool_schema(name, self.device_store)
         # log(f"[MCP] Built schema for {name}: {schema}")
         if not schema:
@@ -558,6 +1007,11 @@ class BridgeServer:
                 },
                 "required": []
             }
+        return schema
+    
+    def _build_virtual_tool_func(self, name: str, vt_def: dict, schema: dict):
+        """Build the FastMCP function for a single virtual tool"""
+        description = vt_def.get("description", f"Virtual tool: {name}")
         
         try:
             ParamModel = json_schema_to_pydantic_model(f"vt_{name}_params", schema)
@@ -572,7 +1026,7 @@ class BridgeServer:
         
         # Create the tool function
         def create_vt_func(vt_name_copy, vt_desc_copy, executor_ref, param_model):
-            def virtual_tool_func(params: param_model) -> List[Union[ImageContent, TextContent]]:
+            async def virtual_tool_func(params: param_model) -> List[Union[ImageContent, TextContent]]:
                 """Virtual tool that executes multiple tools in parallel"""
                 args = params.dict() if hasattr(params, 'dict') else {}
                 
@@ -582,17 +1036,21 @@ class BridgeServer:
                 
                 log(f"[VIRTUAL_TOOL] Executing {vt_name_copy} with args: {json.dumps(args, indent=2)}")
                 
-                # Execute synchronously (wrapper handles async internally)
-                result = executor_ref.execute_sync(vt_name_copy, args)
+                # Waits up to VIRTUAL_TOOL_DEADLINE_MS: keep it off the event loop
+                result = await asyncio.to_thread(executor_ref.execute_sync, vt_name_copy, args)
                 
                 # Format result
                 if result.get("ok"):
                     summary = f"✓ Virtual tool '{vt_name_copy}' completed: {result['success']}/{result['total']} succeeded"
                 else:
                     summary = f"✗ Virtual tool '{vt_name_copy}' had failures: {result['success']}/{result['total']} succeeded"
+                if result.get("partial"):
+                    summary += f" (partial: {result['timed_out']} timed out, {result.get('cancelled', 0)} cancelled)"
                 
                 detail_lines = [summary, ""]
                 for r in result.get("results", []):
+                    if r.get("response", {}).get("error", {}).get("code") == "cancelled":
+                        continue
                     status = "✓" if r.get("ok") else "✗"
                     detail_lines.append(f"  {status} {r['device_id']}/{r['tool']}")
                     if not r.get("ok") and r.get("error"):
@@ -604,13 +1062,4 @@ class BridgeServer:
             virtual_tool_func.__doc__ = vt_desc_copy
             return virtual_tool_func
         
-        dynamic_func = create_vt_func(name, description, self.virtual_tool_executor, ParamModel)
-        # log(f"[MCP] Created dynamic function for {name}: {dynamic_func.__name__}")
-        
-        # Register with FastMCP
-        try:
-            self.mcp.tool()(dynamic_func)
-            # log(f"[MCP] Successfully registered virtual tool with FastMCP: {name}")
-        except Exception as e:
-            log(f"[MCP] FAILED to register virtual tool {name} with FastMCP: {e}")
-            raise
+        return create_vt_func(name, description, self.virtual_tool_executor, ParamModel)
@@ -1,7 +1,7 @@
 import json
 import threading
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Set
 from .utils import log
 
 class ToolProjectionStore:
@@ -23,7 +23,8 @@ class ToolProjectionStore:
                     "devices": {},
                     "global": {
                         "auto_enable_new_devices": True,
-                        "auto_enable_new_tools": True
+                        "auto_enable_new_tools": True,
+                        "group_identical_tools": False
                     }
                 }
                 self.save_config()
@@ -40,9 +41,23 @@ class ToolProjectionStore:
         except Exception as e:
             log(f"[PROJECTION] Error saving config: {e}")
 
-    def reload_config(self):
-        """Reload configuration from disk"""
+    def reload_config(self) -> Optional[Set[str]]:
+        """
+        Reload configuration from disk.
+
+        Returns the device ids whose projection changed, or None if a global
+        setting changed (every device is affected).
+        """
+        old_config = self.config
         self.load_config()
+        if old_config.get("global") != self.config.get("global"):
+            return None
+        old_devices = old_config.get("devices", {})
+        new_devices = self.config.get("devices", {})
+        return {
+            device_id for device_id in set(old_devices) | set(new_devices)
+            if old_devices.get(device_id) != new_devices.get(device_id)
+        }
     
     def get_device_projection(self, device_id: str) -> Dict[str, Any]:
         with self._lock:
@@ -65,6 +80,36 @@ class ToolProjectionStore:
             return self.config.get("global", {}).get("auto_enable_new_tools", True)
         return False
     
+    def get_tool_cache_ttl_ms(self, device_id: str, tool_name: str) -> Optional[int]:
+        """Configured result cache TTL for a tool; None when the projection doesn't set one"""
+        tool_config = self.get_device_projection(device_id).get("tools", {}).get(tool_name, {})
+        ttl = tool_config.get("cache_ttl_ms")
+        return int(ttl) if ttl is not None else None
+    
+    def get_tool_idempotent(self, device_id: str, tool_name: str) -> Optional[bool]:
+        """Configured idempotency of a tool; None when the projection doesn't set it"""
+        tool_config = self.get_device_projection(device_id).get("tools", {}).get(tool_name, {})
+        idempotent = tool_config.get("idempotent")
+        return bool(idempotent) if idempotent is not None else None
+    
+    def get_tool_image_settings(self, device_id: str, tool_name: str) -> Optional[Dict[str, Any]]:
+        """"images" settings for a tool's image assets: global, overridden by device, overridden by tool"""
+        projection = self.get_device_projection(device_id)
+        settings = {
+            **(self.config.get("global", {}).get("images") or {}),
+            **(projection.get("images") or {}),
+            **(projection.get("tools", {}).get(tool_name, {}).get("images") or {}),
+        }
+        return settings or None
+    
+    def is_tool_grouping_enabled(self) -> bool:
+        """Grouped mode: devices sharing a tool schema are exposed as one tool with a device_id parameter"""
+        return bool(self.config.get("global", {}).get("group_identical_tools", False))
+
+    def get_group_enum_max(self) -> int:
+        """Groups up to this size list member device ids as an enum; larger ones point to a resource"""
+        return int(self.config.get("global", {}).get("group_enum_max", 32))
+    
     def get_device_alias(self, device_id: str, device_name: Optional[str] = None) -> str:
         projection = self.get_device_projection(device_id)
         alias = projection.get("device_alias")
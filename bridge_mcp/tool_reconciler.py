@@ -0,0 +1,243 @@
+"""
+Incremental FastMCP tool registration.
+
+ToolReconciler diffs a desired tool set against what is registered and only
+adds / replaces / removes the entries that changed, instead of wiping the
+FastMCP tool table and re-registering everything (which made clients see
+transient empty tool lists and made reload cost O(all tools)).
+
+ToolListNotifier coalesces the resulting notifications/tools/list_changed
+messages into one per burst of changes.
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+from mcp.server.fastmcp import FastMCP
+from .utils import log
+
+
+class DesiredTool(NamedTuple):
+    name: str                      # FastMCP tool name
+    fingerprint: str               # changes whenever the generated function would differ
+    build: Callable[[], Callable]  # creates the tool function (only called when needed)
+
+
+class ToolListNotifier:
+    """Debounced tools/list_changed sender for every session that has listed tools."""
+
+    def __init__(self, delay_s: float = 0.25):
+        self._delay_s = delay_s
+        self._sessions: "weakref.WeakKeyDictionary[Any, asyncio.AbstractEventLoop]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._stats = {"scheduled": 0, "flushed": 0, "sent": 0}
+
+    def track(self, session: Any, loop: asyncio.AbstractEventLoop):
+        with self._lock:
+            self._sessions[session] = loop
+
+    def schedule(self):
+        """Request a notification; calls within the debounce window share one flush."""
+        with self._lock:
+            self._stats["scheduled"] += 1
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self._delay_s, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            self._stats["flushed"] += 1
+            targets = list(self._sessions.items())
+
+        for session, loop in targets:
+            if loop.is_closed():
+                self._forget(session)
+                continue
+            try:
+                fut = asyncio.run_coroutine_threadsafe(session.send_tool_list_changed(), loop)
+                fut.add_done_callback(lambda f, s=session: self._on_sent(f, s))
+            except Exception:
+                self._forget(session)
+
+    def _on_sent(self, fut, session):
+        if fut.cancelled() or fut.exception() is not None:
+            # Session closed / transport gone
+            self._forget(session)
+            return
+        with self._lock:
+            self._stats["sent"] += 1
+
+    def _forget(self, session):
+        with self._lock:
+            self._sessions.pop(session, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "sessions": len(self._sessions)}
+
+
+class SessionTrackingFastMCP(FastMCP):
+    """FastMCP that remembers which sessions listed tools, so list_changed can reach them."""
+
+    def __init__(self, name: str, notifier: ToolListNotifier, **settings: Any):
+        self.notifier = notifier
+        super().__init__(name, **settings)
+
+    async def list_tools(self):
+        try:
+            self.notifier.track(self.get_context().session, asyncio.get_running_loop())
+        except Exception:
+            # Outside a request context (e.g. internal call) - nothing to track
+            pass
+        return await super().list_tools()
+
+
+class ToolReconciler:
+    """
+    Keeps FastMCP's tool table in line with desired tools, grouped by scope.
+
+    A scope is an independently reconciled group (e.g. "device:<id>", "virtual");
+    reconciling one scope never touches tools of another. Within a scope, entries
+    are keyed by an owner key and carry a FastMCP name and a fingerprint.
+
+    Several owners may claim the same FastMCP name (same projected name on two
+    devices). The first claimant is installed; the next one takes over when it goes.
+    Names already taken by tools registered outside the reconciler (static tools)
+    are never overwritten.
+    """
+
+    def __init__(self, mcp: FastMCP, notifier: Optional[ToolListNotifier] = None):
+        self._mcp = mcp
+        self._notifier = notifier
+        self._lock = threading.RLock()
+        self._scopes: Dict[str, Dict[str, DesiredTool]] = {}
+        self._entries: Dict[str, DesiredTool] = {}
+        self._claims: Dict[str, List[str]] = {}
+        self._installed: Set[str] = set()
+
+    def reconcile(self, scope: str, desired: Dict[str, DesiredTool]) -> Dict[str, int]:
+        """Make `scope` match `desired`. Cost is O(entries in scope) plus O(changes) registrations."""
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        with self._lock:
+            current = self._scopes.get(scope, {})
+
+            for key in [k for k in current if k not in desired]:
+                self._drop(key)
+                counts["removed"] += 1
+
+            for key, entry in desired.items():
+                old = current.get(key)
+                if old is None:
+                    self._claim(key, entry)
+                    counts["added"] += 1
+                elif old.name != entry.name:
+                    self._drop(key)
+                    self._claim(key, entry)
+                    counts["updated"] += 1
+                elif old.fingerprint != entry.fingerprint:
+                    self._entries[key] = entry
+                    if self._owner(entry.name) == key and entry.name in self._installed:
+                        self._install(entry, replace=True)
+                    counts["updated"] += 1
+
+            if desired:
+                self._scopes[scope] = dict(desired)
+            else:
+                self._scopes.pop(scope, None)
+
+        if self._notifier and any(counts.values()):
+            self._notifier.schedule()
+        return counts
+
+    def scopes(self) -> List[str]:
+        with self._lock:
+            return list(self._scopes)
+
+    def forget_all(self):
+        """Drop bookkeeping only (caller wiped FastMCP's table itself)."""
+        with self._lock:
+            self._scopes.clear()
+            self._entries.clear()
+            self._claims.clear()
+            self._installed.clear()
+
+    # ---- claim bookkeeping (caller holds self._lock) ----
+
+    def _owner(self, name: str) -> Optional[str]:
+        claims = self._claims.get(name)
+        return claims[0] if claims else None
+
+    def _claim(self, key: str, entry: DesiredTool):
+        self._entries[key] = entry
+        claims = self._claims.setdefault(entry.name, [])
+        claims.append(key)
+        if len(claims) == 1:
+            self._install(entry, replace=False)
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        claims = self._claims.get(entry.name, [])
+        was_owner = bool(claims) and claims[0] == key
+        if key in claims:
+            claims.remove(key)
+        if not claims:
+            self._claims.pop(entry.name, None)
+        if not was_owner:
+            return
+        if claims:
+            # Hand the name over to the next claimant without a gap
+            self._install(self._entries[claims[0]], replace=entry.name in self._installed)
+        elif entry.name in self._installed:
+            self._uninstall(entry.name)
+
+    # ---- FastMCP table access ----
+
+    def _tool_table(self) -> Optional[Dict[str, Any]]:
+        tm = getattr(self._mcp, "_tool_manager", None)
+        table = getattr(tm, "_tools", None)
+        return table if isinstance(table, dict) else None
+
+    def _install(self, entry: DesiredTool, replace: bool):
+        table = self._tool_table()
+        if not replace and table is not None and entry.name in table:
+            log(f"[MCP] Tool name '{entry.name}' already registered outside reconciler, skipping")
+            return
+        try:
+            fn = entry.build()
+        except Exception as e:
+            log(f"[MCP] Failed to build tool {entry.name}: {e}")
+            return
+
+        if replace and table is not None:
+            try:
+                from mcp.server.fastmcp.tools import Tool
+                # Single dict assignment: listings never observe the name missing
+                table[entry.name] = Tool.from_function(fn, name=entry.name)
+                self._installed.add(entry.name)
+                return
+            except Exception:
+                self._uninstall(entry.name)
+        elif replace:
+            self._uninstall(entry.name)
+
+        try:
+            self._mcp.tool(name=entry.name)(fn)
+            self._installed.add(entry.name)
+        except Exception as e:
+            log(f"[MCP] Failed to register tool {entry.name}: {e}")
+
+    def _uninstall(self, name: str):
+        self._installed.discard(name)
+        try:
+            self._mcp.remove_tool(name)
+        except Exception:
+            table = self._tool_table()
+            if table is not None:
+                table.pop(name, None)
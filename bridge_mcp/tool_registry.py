@@ -1,52 +1,177 @@
 import threading
-from typing import Dict, Any, List, Optional
-from .utils import log
+from typing import Dict, Any, List, Optional, Set, Tuple, Iterable
+from .utils import log, canonical_hash
 from .tool_projection import ToolProjectionStore
+from .tool_search import ToolSearchIndex
 
 class DynamicToolRegistry:
     def __init__(self, projection_store: ToolProjectionStore):
         self._tools: Dict[str, Dict[str, Any]] = {}
         self._lock = threading.Lock()
         self._registered_funcs: Dict[str, Any] = {}
+        # Indexes so per-device work costs O(tools of that device), not O(all tools)
+        self._keys_by_device: Dict[str, Set[str]] = {}
+        self._keys_by_name: Dict[str, Set[str]] = {}
+        # group_id -> tool keys; a group is every device exposing the same projected tool schema
+        self._keys_by_group: Dict[str, Set[str]] = {}
+        self._groups_by_name: Dict[str, Set[str]] = {}
+        # Last announced (tools, device_name) per device, kept for re-projection
+        self._announced: Dict[str, Tuple[List[Dict[str, Any]], Optional[str]]] = {}
+        # Full-text index over projected tools, kept in step with _tools
+        self.search_index = ToolSearchIndex()
         self.projection_store = projection_store
     
     def register_device_tools(self, device_id: str, tools: List[Dict[str, Any]], device_name: Optional[str] = None):
         with self._lock:
-            old_keys = [k for k in self._tools.keys() if k.endswith(f"_{device_id}")]
-            for k in old_keys:
-                self._tools.pop(k, None)
-                self._registered_funcs.pop(k, None)
-            
             self.projection_store.auto_add_device(device_id, device_name, tools)
-            device_alias = self.projection_store.get_device_alias(device_id, device_name)
+            self._announced[device_id] = (tools, device_name)
+            self._project_device(device_id)
+
+    def _project_device(self, device_id: str) -> List[Dict[str, Any]]:
+        """(Re)build projected tools for one device. Caller holds self._lock. Returns removed entries."""
+        removed = self._unindex_device(device_id)
+        tools, device_name = self._announced[device_id]
+        device_alias = self.projection_store.get_device_alias(device_id, device_name)
+        
+        keys = self._keys_by_device.setdefault(device_id, set())
+        registered_count = 0
+        for tool in tools:
+            original_tool_name = tool.get("name", "")
+            if not original_tool_name:
+                continue
             
-            registered_count = 0
-            for tool in tools:
-                original_tool_name = tool.get("name", "")
-                if not original_tool_name:
-                    continue
-                
-                if not self.projection_store.is_tool_enabled(device_id, original_tool_name):
-                    # log(f"[TOOLS] Skipping disabled tool: {original_tool_name} for device {device_id}")
-                    continue
-                
-                projected_tool = self.projection_store.get_tool_projection(device_id, original_tool_name, tool)
-                projected_name = projected_tool["name"]
-                tool_key = f"{projected_name}_{device_id}"
-                
-                self._tools[tool_key] = {
-                    "device_id": device_id,
-                    "device_alias": device_alias,
-                    "original_name": original_tool_name,
-                    "projected_name": projected_name,
-                    "description": projected_tool["description"],
-                    "parameters": projected_tool["parameters"],
-                    "tool_key": tool_key
-                }
-                registered_count += 1
+            if not self.projection_store.is_tool_enabled(device_id, original_tool_name):
+                # log(f"[TOOLS] Skipping disabled tool: {original_tool_name} for device {device_id}")
+                continue
             
-            # log(f"[TOOLS] registered {registered_count}/{len(tools)} projected tools for device {device_id}")
+            projected_tool = self.projection_store.get_tool_projection(device_id, original_tool_name, tool)
+            projected_name = projected_tool["name"]
+            tool_key = f"{projected_name}_{device_id}"
+            
+            group_id = canonical_hash([projected_name, projected_tool["description"], projected_tool["parameters"]])[:16]
+            self._tools[tool_key] = {
+                "device_id": device_id,
+                "device_alias": device_alias,
+                "original_name": original_tool_name,
+                "projected_name": projected_name,
+                "description": projected_tool["description"],
+                "parameters": projected_tool["parameters"],
+                "tool_key": tool_key,
+                "group_id": group_id
+            }
+            keys.add(tool_key)
+            self._keys_by_name.setdefault(projected_name, set()).add(tool_key)
+            self._keys_by_group.setdefault(group_id, set()).add(tool_key)
+            self._groups_by_name.setdefault(projected_name, set()).add(group_id)
+            self.search_index.add(tool_key, [
+                (projected_name, 3),
+                (original_tool_name, 2),
+                (device_alias, 2),
+                (device_id, 1),
+                (projected_tool["description"], 1),
+                (" ".join((projected_tool["parameters"] or {}).get("properties", {})), 1),
+            ])
+            registered_count += 1
+        
+        # log(f"[TOOLS] registered {registered_count}/{len(tools)} projected tools for device {device_id}")
+        return removed
+
+    def _unindex_device(self, device_id: str) -> List[Dict[str, Any]]:
+        """Drop a device's projected tools from all indexes. Caller holds self._lock."""
+        removed = []
+        for k in self._keys_by_device.pop(device_id, set()):
+            info = self._tools.pop(k, None)
+            self._registered_funcs.pop(k, None)
+            self.search_index.remove(k)
+            if info is None:
+                continue
+            removed.append(info)
+            for index, index_key in ((self._keys_by_name, info["projected_name"]),
+                                     (self._keys_by_group, info["group_id"])):
+                index_keys = index.get(index_key)
+                if index_keys is not None:
+                    index_keys.discard(k)
+                    if not index_keys:
+                        del index[index_key]
+            if info["group_id"] not in self._keys_by_group:
+                name_groups = self._groups_by_name.get(info["projected_name"], set())
+                name_groups.discard(info["group_id"])
+                if not name_groups:
+                    self._groups_by_name.pop(info["projected_name"], None)
+        return removed
+
+    def unregister_device(self, device_id: str) -> List[Dict[str, Any]]:
+        """Forget a device entirely. Returns its removed tool entries."""
+        with self._lock:
+            self._announced.pop(device_id, None)
+            return self._unindex_device(device_id)
+
+    def reproject_devices(self, device_ids: Optional[Iterable[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Re-apply the projection config to already announced devices.
+
+        Only the given devices are walked (all announced devices if None).
+        Returns {device_id: removed tool entries} for every device re-projected.
+        """
+        with self._lock:
+            targets = list(self._announced) if device_ids is None else [d for d in device_ids if d in self._announced]
+            return {device_id: self._project_device(device_id) for device_id in targets}
     
+    def has_device(self, device_id: str) -> bool:
+        with self._lock:
+            return device_id in self._announced
+
+    def get_device_tools(self, device_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [self._tools[k] for k in self._keys_by_device.get(device_id, ())]
+
+    def find_tools_by_name(self, projected_name: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [self._tools[k] for k in self._keys_by_name.get(projected_name, ())]
+
+    def get_device_groups(self, device_id: str) -> Set[str]:
+        with self._lock:
+            return {self._tools[k]["group_id"] for k in self._keys_by_device.get(device_id, ())}
+
+    def get_group_members(self, group_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [self._tools[k] for k in self._keys_by_group.get(group_id, ())]
+
+    def get_group_size(self, group_id: str) -> int:
+        with self._lock:
+            return len(self._keys_by_group.get(group_id, ()))
+
+    def get_group_sample(self, group_id: str) -> Optional[Dict[str, Any]]:
+        """Any one member; every member shares name, description and schema"""
+        with self._lock:
+            keys = self._keys_by_group.get(group_id)
+            return self._tools[next(iter(keys))] if keys else None
+
+    def get_group_member(self, group_id: str, device_id: str) -> Optional[Dict[str, Any]]:
+        """O(1) dispatch lookup for a grouped tool call"""
+        with self._lock:
+            keys = self._keys_by_group.get(group_id)
+            if not keys:
+                return None
+            sample = self._tools[next(iter(keys))]
+            tool_key = f"{sample['projected_name']}_{device_id}"
+            return self._tools[tool_key] if tool_key in keys else None
+
+    def get_group_ids_for_name(self, projected_name: str) -> Set[str]:
+        with self._lock:
+            return set(self._groups_by_name.get(projected_name, ()))
+
+    def list_groups(self) -> Dict[str, List[str]]:
+        """{group_id: [tool keys]} for every tool group"""
+        with self._lock:
+            return {gid: sorted(keys) for gid, keys in self._keys_by_group.items()}
+
+    def search_tools(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """BM25-ranked projected tools matching query, each with its "score" added"""
+        hits = self.search_index.search(query, limit)
+        with self._lock:
+            return [{**self._tools[k], "score": round(score, 4)} for k, score in hits if k in self._tools]
+
     def get_tool_info(self, tool_key: str) -> Optional[Dict[str, Any]]:
         with self._lock:
             return self._tools.get(tool_key)
@@ -68,4 +193,10 @@ class DynamicToolRegistry:
         with self._lock:
             self._tools.clear()
             self._registered_funcs.clear()
+            self._keys_by_device.clear()
+            self._keys_by_name.clear()
+            self._keys_by_group.clear()
+            self._groups_by_name.clear()
+            self.search_index.clear()
+            self._announced.clear()
             log("[TOOLS] Registry cleared")
@@ -0,0 +1,99 @@
+import heapq
+import math
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+_TOKEN_RE = re.compile(r"[A-Za-z]+|\d+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; snake_case and camelCase identifiers are split into their parts."""
+    tokens = []
+    for word in _TOKEN_RE.findall(text or ""):
+        parts = _CAMEL_RE.findall(word)
+        tokens.extend(p.lower() for p in parts)
+        if len(parts) > 1:
+            tokens.append(word.lower())
+    return tokens
+
+
+class ToolSearchIndex:
+    """
+    Incremental inverted index with BM25 ranking over projected tools.
+
+    Documents are added/removed one at a time by DynamicToolRegistry, so the
+    index never needs a rebuild. A query costs O(postings of its terms), not
+    O(all tools).
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+        self._lock = threading.Lock()
+
+    def add(self, doc_id: str, fields: Iterable[Tuple[str, int]]):
+        """Index a document given (text, weight) fields; weight repeats the field's terms."""
+        tf: Dict[str, int] = {}
+        for text, weight in fields:
+            for token in tokenize(text):
+                tf[token] = tf.get(token, 0) + weight
+        with self._lock:
+            self._remove(doc_id)
+            self._doc_terms[doc_id] = tf
+            length = sum(tf.values())
+            self._doc_len[doc_id] = length
+            self._total_len += length
+            for term, count in tf.items():
+                self._postings.setdefault(term, {})[doc_id] = count
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        tf = self._doc_terms.pop(doc_id, None)
+        if tf is None:
+            return
+        self._total_len -= self._doc_len.pop(doc_id, 0)
+        for term in tf:
+            docs = self._postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self._postings[term]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._total_len = 0
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Top `limit` (doc_id, score) pairs, best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if not terms or not n_docs:
+                return []
+            avg_len = self._total_len / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                docs = self._postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = self.k1 * (1.0 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+        return heapq.nlargest(max(1, limit), scores.items(), key=lambda kv: kv[1])
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"documents": len(self._doc_len), "terms": len(self._postings)}
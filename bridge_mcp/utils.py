@@ -1,13 +1,16 @@
 import time
 import json
 import base64
-import requests
+import hashlib
 import logging
 import sys
+import threading
+from collections import OrderedDict
 from datetime import datetime, timezone
 from typing import Any, Dict, Optional, List, Union
 from mcp.types import ImageContent, TextContent
 from pydantic import create_model
+from .config import PARAM_MODEL_CACHE_SIZE, ASSET_CHANNEL_WAIT_MS
 
 # ---- STDERR-only logging (STDIO-safe)
 # ---- STDERR-only logging (STDIO-safe)
@@ -21,45 +24,108 @@ def log(*a, **k): print(*a, file=sys.stderr, flush=True, **k)
 def now_iso() -> str:
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def fetch_and_convert_to_base64(url: str, timeout: int = 10) -> Optional[str]:
-    try:
-        cache_bust_url = f"{url}{'&' if '?' in url else '?'}t={int(time.time() * 1000)}"
-        response = requests.get(cache_bust_url, timeout=timeout)
-        response.raise_for_status()
-        b64_data = base64.b64encode(response.content).decode('utf-8')
-        log(f"[BASE64] Converted image to base64 ({len(b64_data)} chars)")
-        return b64_data
-    except Exception as e:
-        log(f"[BASE64] Failed to fetch/convert {url}: {e}")
-        return None
+def canonical_hash(obj: Any) -> str:
+    """Stable sha256 of a JSON-compatible value (key order independent)."""
+    canonical = json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
-def convert_response_to_content_list(resp: Dict[str, Any]) -> List[Union[ImageContent, TextContent]]:
-    result = resp.get("result", {})
-    text = result.get("text", "")
-    assets = result.get("assets", [])
-    
-    content = []
-    
-    for asset in assets:
+def fetch_and_convert_to_base64(url: str, fetcher) -> Optional[str]:
+    body = fetcher.fetch(url)
+    return base64.b64encode(body).decode('utf-8') if body is not None else None
+
+def _image_assets(resp: Dict[str, Any]) -> List[tuple]:
+    """(url, asset_id, mime) of the image assets in a device response; assets pushed by the device have no url"""
+    images = []
+    for asset in resp.get("result", {}).get("assets", []):
         kind = str(asset.get("kind", ""))
         mime = str(asset.get("mime", "application/octet-stream")).lower()
         url = asset.get("url")
-        
-        if kind == "image" and mime.startswith("image/") and url:
-            b64_data = fetch_and_convert_to_base64(url)
-            if b64_data:
-                content.append(ImageContent(
-                    type="image",
-                    mimeType=mime,
-                    data=b64_data
-                ))
+        asset_id = asset.get("asset_id")
+        if kind == "image" and mime.startswith("image/") and (url or asset_id):
+            images.append((url, asset_id, mime))
+    return images
+
+def prefetch_assets(resp: Dict[str, Any], fetcher):
+    """Start fetching a response's images in the background (e.g. while other devices are still answering)"""
+    urls = [url for url, _, _ in _image_assets(resp) if url]
+    if urls:
+        fetcher.prefetch(urls)
+
+def convert_response_to_content_list(resp: Dict[str, Any], image_settings: Optional[Dict[str, Any]] = None,
+                                     device_id: Optional[str] = None,
+                                     fetcher=None, processor=None,
+                                     channel=None) -> List[Union[ImageContent, TextContent]]:
+    """
+    image_settings: the tool's "images" projection settings (downscale / re-encode)
+    device_id: the responding device, whose pushed assets (asset channel) the result may reference
+    fetcher: AssetFetcher for images given by url (skipped without one)
+    processor: ImageProcessor applying image_settings (images pass through unchanged without one)
+    channel: AssetChannel holding the assets pushed by devices (skipped without one)
+    """
+    text = resp.get("result", {}).get("text", "")
+    images = _image_assets(resp)
+    
+    content = []
+    
+    if images:
+        urls = [url for url, _, _ in images if url]
+        downloaded = iter(fetcher.fetch_many(urls) if fetcher else [None] * len(urls))
+        deadline = time.monotonic() + ASSET_CHANNEL_WAIT_MS / 1000.0
+        fetched = []
+        for url, asset_id, mime in images:
+            if url:
+                body = next(downloaded)
+            elif device_id and channel:
+                body = channel.get(device_id, str(resp.get("request_id")), str(asset_id),
+                                   max(0.0, deadline - time.monotonic()))
+            else:
+                body = None
+            if body is not None:
+                fetched.append((body, mime))
+        if processor:
+            fetched = processor.process_many(fetched, image_settings)
+        for body, mime in fetched:
+            content.append(ImageContent(
+                type="image",
+                mimeType=mime,
+                data=base64.b64encode(body).decode('utf-8')
+            ))
     
     if text:
         content.append(TextContent(type="text", text=text))
     
     return content
 
+# LRU of generated parameter models keyed by (schema hash, model name).
+# Re-registration after reload and devices sharing a schema reuse the same class.
+_param_model_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+_param_model_lock = threading.Lock()
+_param_model_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def param_model_cache_stats() -> Dict[str, int]:
+    with _param_model_lock:
+        return {**_param_model_stats, "size": len(_param_model_cache)}
+
 def json_schema_to_pydantic_model(name: str, schema: dict):
+    key = (canonical_hash(schema), name)
+    with _param_model_lock:
+        model = _param_model_cache.get(key)
+        if model is not None:
+            _param_model_cache.move_to_end(key)
+            _param_model_stats["hits"] += 1
+            return model
+        _param_model_stats["misses"] += 1
+
+    model = _build_pydantic_model(name, schema)
+
+    with _param_model_lock:
+        _param_model_cache[key] = model
+        while len(_param_model_cache) > PARAM_MODEL_CACHE_SIZE:
+            _param_model_cache.popitem(last=False)
+            _param_model_stats["evictions"] += 1
+    return model
+
+def _build_pydantic_model(name: str, schema: dict):
     from pydantic import Field
     
     fields = {}
@@ -8,15 +8,140 @@ Virtual Tool Module for SABA Bridge
 - 기본적으로 가상 툴의 파라미터는 각 바인딩된 툴에 자동으로 전달됩니다.
 - 동일한 이름의 파라미터가 여러 툴에 있을 경우, 툴 이름을 접미사로 붙입니다.
   예: emotion -> emotion, emotion(ExpressEmotion), emotion(PlaySound)
+
+완료 정책 (completion):
+- {"mode": "all"}                  모든 바인딩 응답 대기 (기본값)
+- {"mode": "any"}                  첫 번째 성공 시 반환
+- {"mode": "first_k", "k": 3}      k개 성공 시 반환
+- {"mode": "quorum", "percent": 50} 전체 바인딩의 percent% 성공 시 반환
+- {"mode": "best_effort"}          deadline_ms까지 받은 결과를 반환, 1개 이상 성공이면 ok
+정책이 충족되면 남은 요청은 CommandWaiter에서 취소됩니다.
 """
 
 import json
+import math
 import asyncio
 import threading
 from pathlib import Path
-from typing import Dict, Any, Optional, List, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple, NamedTuple, FrozenSet
 from .utils import log
+from .config import VIRTUAL_TOOL_DEADLINE_MS, VIRTUAL_TOOL_MAX_INFLIGHT_PER_DEVICE
+
+
+COMPLETION_MODES = ("all", "any", "first_k", "quorum", "best_effort")
+
+
+def validate_completion(completion: Optional[Dict[str, Any]]):
+    """Raise ValueError if a virtual tool's completion policy is malformed"""
+    if completion is None:
+        return
+    if not isinstance(completion, dict):
+        raise ValueError("completion must be an object")
+    mode = completion.get("mode", "all")
+    if mode not in COMPLETION_MODES:
+        raise ValueError(f"completion.mode must be one of {', '.join(COMPLETION_MODES)}")
+    if mode == "first_k" and (not isinstance(completion.get("k"), int) or completion["k"] < 1):
+        raise ValueError("completion.k must be a positive integer")
+    if mode == "quorum":
+        percent = completion.get("percent")
+        if not isinstance(percent, (int, float)) or not 0 < percent <= 100:
+            raise ValueError("completion.percent must be in (0, 100]")
+
+
+def is_ref(source: Any) -> bool:
+    """args_map source that pipes an upstream binding's response ("$<binding id>.<path>")"""
+    return isinstance(source, str) and source.startswith("$")
+
+
+def binding_ids(bindings: List[Dict[str, Any]]) -> List[str]:
+    """Binding ids; bindings without an "id" are named by position (b0, b1, ...)"""
+    return [str(b.get("id") or f"b{i}") for i, b in enumerate(bindings)]
+
+
+def binding_dependencies(binding: Dict[str, Any]) -> set:
+    """Upstream binding ids: explicit "depends_on" plus every $ref in args_map"""
+    deps = set(binding.get("depends_on") or [])
+    for source in (binding.get("args_map") or {}).values():
+        if is_ref(source):
+            deps.add(source[1:].split(".", 1)[0])
+    return deps
+
+
+def resolve_ref(source: str, outputs: Dict[str, Any]) -> Tuple[bool, Any]:
+    """Walk "$id.a.0.b" into outputs[id]; numeric parts index lists. Returns (found, value)."""
+    node_id, _, path = source[1:].partition(".")
+    if node_id not in outputs:
+        return False, None
+    value = outputs[node_id]
+    for part in path.split(".") if path else []:
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return False, None
+    return True, value
+
+
+def validate_bindings(bindings: List[Dict[str, Any]], completion: Optional[Dict[str, Any]] = None):
+    """Raise ValueError on duplicate ids, unknown dependencies or cycles"""
+    ids = binding_ids(bindings)
+    if len(set(ids)) != len(ids):
+        raise ValueError("binding ids must be unique")
+    deps = {node_id: binding_dependencies(b) for node_id, b in zip(ids, bindings)}
+    for node_id, node_deps in deps.items():
+        unknown = node_deps - set(ids)
+        if unknown:
+            raise ValueError(f"binding '{node_id}' depends on unknown binding(s): {', '.join(sorted(unknown))}")
+    
+    # Kahn: every binding must become ready
+    remaining = {node_id: len(node_deps) for node_id, node_deps in deps.items()}
+    ready = [node_id for node_id, n in remaining.items() if n == 0]
+    visited = 0
+    while ready:
+        node_id = ready.pop()
+        visited += 1
+        for other, node_deps in deps.items():
+            if node_id in node_deps:
+                remaining[other] -= 1
+                if remaining[other] == 0:
+                    ready.append(other)
+    if visited != len(ids):
+        raise ValueError("binding dependencies contain a cycle")
+    
+    if any(deps.values()) and (completion or {}).get("mode", "all") not in ("all", "best_effort"):
+        raise ValueError("pipelined bindings support only 'all' and 'best_effort' completion")
+
+
+def completion_target(completion: Optional[Dict[str, Any]], total: int) -> Optional[int]:
+    """Successes needed before outstanding bindings are cancelled (None: wait for all)"""
+    mode = (completion or {}).get("mode", "all")
+    if mode == "any":
+        return 1
+    if mode == "first_k":
+        return min(int(completion.get("k", 1)), total)
+    if mode == "quorum":
+        return max(1, math.ceil(total * float(completion.get("percent", 100)) / 100.0))
+    return None
+
+
+class CompiledBinding(NamedTuple):
+    node_id: str
+    device_id: str
+    tool: str
+    params: Optional[FrozenSet[str]]              # accepted params; None = no schema, pass all args
+    args_map: Optional[Tuple[Tuple[str, str, bool], ...]]  # (target, source, source is $ref)
+    timeout_ms: Optional[int]
+    deps: FrozenSet[str]
+
+
+class VirtualToolPlan(NamedTuple):
+    """A virtual tool resolved against the current device schemas; invocation only reads it"""
+    bindings: Tuple[CompiledBinding, ...]
+    dependents: Dict[str, Tuple[str, ...]]
+    schema: Dict[str, Any]
+    completion: Dict[str, Any]
+    deadline_ms: int
 
 
 class VirtualToolStore:
@@ -26,10 +151,15 @@ class VirtualToolStore:
         self.config_path = config_path
         self.config: Dict[str, Any] = {}
         self._lock = threading.Lock()
+        # Compiled plans: name -> ((config version, device schema version), plan)
+        self._version = 0
+        self._plans: Dict[str, Tuple[Tuple[int, int], VirtualToolPlan]] = {}
+        self._plan_stats = {"hits": 0, "compiles": 0}
         self.load_config()
     
     def load_config(self):
         """Load virtual tool configuration from JSON file"""
+        self._version += 1
         try:
             if Path(self.config_path).exists():
                 with open(self.config_path, 'r', encoding='utf-8') as f:
@@ -58,9 +188,11 @@ class VirtualToolStore:
             log(f"[VIRTUAL_TOOL] Error saving config: {e}")
             return False
     
-    def reload_config(self):
-        """Reload configuration from disk"""
+    def reload_config(self) -> bool:
+        """Reload configuration from disk. Returns True if virtual tool definitions changed."""
+        old_tools = self.config.get("virtual_tools", {})
         self.load_config()
+        return old_tools != self.config.get("virtual_tools", {})
     
     def get_all_virtual_tools(self) -> Dict[str, Any]:
         """Get all virtual tool definitions"""
@@ -73,22 +205,28 @@ class VirtualToolStore:
             return self.config.get("virtual_tools", {}).get(name)
     
     def create_virtual_tool(self, name: str, tool_def: Dict[str, Any]) -> bool:
-        """Create a new virtual tool"""
+        """Create a new virtual tool (ValueError on an invalid completion policy or binding graph)"""
+        validate_completion(tool_def.get("completion"))
+        validate_bindings(tool_def.get("bindings", []), tool_def.get("completion"))
         with self._lock:
             if "virtual_tools" not in self.config:
                 self.config["virtual_tools"] = {}
             self.config["virtual_tools"][name] = tool_def
+            self._version += 1
             result = self.save_config()
             if result:
                 log(f"[VIRTUAL_TOOL] Created virtual tool: {name}")
             return result
     
     def update_virtual_tool(self, name: str, tool_def: Dict[str, Any]) -> bool:
-        """Update an existing virtual tool"""
+        """Update an existing virtual tool (ValueError on an invalid completion policy or binding graph)"""
+        validate_completion(tool_def.get("completion"))
+        validate_bindings(tool_def.get("bindings", []), tool_def.get("completion"))
         with self._lock:
             if name not in self.config.get("virtual_tools", {}):
                 return False
             self.config["virtual_tools"][name] = tool_def
+            self._version += 1
             result = self.save_config()
             if result:
                 log(f"[VIRTUAL_TOOL] Updated virtual tool: {name}")
@@ -99,6 +237,8 @@ class VirtualToolStore:
         with self._lock:
             if name in self.config.get("virtual_tools", {}):
                 del self.config["virtual_tools"][name]
+                self._version += 1
+                self._plans.pop(name, None)
                 result = self.save_config()
                 if result:
                     log(f"[VIRTUAL_TOOL] Deleted virtual tool: {name}")
@@ -110,41 +250,76 @@ class VirtualToolStore:
         가상 툴의 JSON Schema를 동적으로 생성합니다.
         
         각 바인딩된 툴의 파라미터를 수집하고, 이름이 충돌하면 툴 이름을 접미사로 추가합니다.
+        (컴파일된 plan에서 가져옴)
         """
-        vt = self.get_virtual_tool(name)
+        plan = self.compile(name, device_store)
+        return json.loads(json.dumps(plan.schema)) if plan else None
+    
+    def compile(self, name: str, device_store) -> Optional[VirtualToolPlan]:
+        """
+        Resolve a virtual tool into an execution plan (arg filters, args_map
+        projections, dependency graph, schema). Cached until the virtual tool
+        config or any device's announced tools change.
+        """
+        device_version = getattr(device_store, "schema_version", 0) if device_store else 0
+        with self._lock:
+            key = (self._version, device_version)
+            cached = self._plans.get(name)
+            if cached and cached[0] == key:
+                self._plan_stats["hits"] += 1
+                return cached[1]
+            vt = self.config.get("virtual_tools", {}).get(name)
         if not vt:
             return None
         
+        plan = self._compile(vt, device_store)
+        with self._lock:
+            self._plans[name] = (key, plan)
+            self._plan_stats["compiles"] += 1
+        return plan
+    
+    def get_plan_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._plan_stats, "cached": len(self._plans)}
+    
+    def _compile(self, vt: Dict[str, Any], device_store) -> VirtualToolPlan:
         bindings = vt.get("bindings", [])
-        if not bindings:
-            return {
-                "type": "object",
-                "properties": {},
-                "required": []
-            }
+        tool_schemas = device_store.get_tool_schemas(b.get("device_id") for b in bindings) if device_store else {}
+        ids = binding_ids(bindings)
         
+        compiled = []
+        dependents: Dict[str, List[str]] = {node_id: [] for node_id in ids}
         # 파라미터 수집: {param_name: [(device_id, tool_name, param_schema), ...]}
         param_sources: Dict[str, List[Tuple[str, str, Dict]]] = {}
         
-        for binding in bindings:
+        for node_id, binding in zip(ids, bindings):
             device_id = binding.get("device_id")
             tool_name = binding.get("tool")
+            deps = frozenset(binding_dependencies(binding))
+            for dep in deps:
+                dependents[dep].append(node_id)
             
-            device = device_store.get(device_id) if device_store else None
-            if not device:
-                continue
-            
-            # 디바이스의 툴 찾기
-            device_tools = device.get("tools", [])
-            tool_info = next((t for t in device_tools if t.get("name") == tool_name), None)
-            if not tool_info:
-                continue
+            args_map = binding.get("args_map")
+            mapping = tuple((t, src, is_ref(src)) for t, src in args_map.items()) if args_map else None
             
-            # 툴의 파라미터 스키마 추출
-            params_schema = tool_info.get("parameters", {})
-            properties = params_schema.get("properties", {})
+            # 디바이스의 툴 찾기 (스키마가 없으면 None: 모든 인자 전달)
+            params_schema = tool_schemas.get(device_id, {}).get(tool_name)
+            properties = (params_schema or {}).get("properties", {})
+            compiled.append(CompiledBinding(
+                node_id,
+                device_id,
+                tool_name,
+                frozenset(properties) if params_schema is not None else None,
+                mapping,
+                binding.get("timeout_ms"),
+                deps,
+            ))
             
+            # 선행 바인딩 결과로 채워지는 파라미터는 노출하지 않음
+            piped = {t for t, _, ref in mapping or () if ref}
             for param_name, param_schema in properties.items():
+                if param_name in piped:
+                    continue
                 if param_name not in param_sources:
                     param_sources[param_name] = []
                 param_sources[param_name].append((device_id, tool_name, param_schema))
@@ -168,11 +343,18 @@ class VirtualToolStore:
                     f" (applies to all: {', '.join(s[1] for s in sources)})"
                 )
         
-        return {
-            "type": "object",
-            "properties": final_properties,
-            "required": final_required
-        }
+        completion = vt.get("completion") or {}
+        return VirtualToolPlan(
+            tuple(compiled),
+            {node_id: tuple(deps) for node_id, deps in dependents.items()},
+            {
+                "type": "object",
+                "properties": final_properties,
+                "required": final_required
+            },
+            completion,
+            int(completion.get("deadline_ms") or vt.get("deadline_ms") or VIRTUAL_TOOL_DEADLINE_MS),
+        )
 
 
 class VirtualToolExecutor:
@@ -186,7 +368,6 @@ class VirtualToolExecutor:
         self.mqtt_client_getter = mqtt_client_getter
         self.ipc_agent = ipc_agent
         self.command_service = command_service
-        self._executor = ThreadPoolExecutor(max_workers=10)
     
     def set_ipc_agent(self, ipc_agent):
         """IPC agent setter for late initialization"""
@@ -195,19 +376,21 @@ class VirtualToolExecutor:
     def execute_sync(self, virtual_tool_name: str, args: Dict[str, Any]) -> Dict[str, Any]:
         """
         가상 툴을 동기적으로 실행합니다.
-        ThreadPoolExecutor를 사용하여 모든 바인딩된 툴을 병렬로 실행합니다.
+        모든 바인딩 명령을 한 번에 발행하고 하나의 대기 루프에서 응답을 모읍니다.
+        - 디바이스별 동시 실행 수 제한 (VIRTUAL_TOOL_MAX_INFLIGHT_PER_DEVICE)
+        - 바인딩별 timeout_ms, 전체 deadline_ms (기본 VIRTUAL_TOOL_DEADLINE_MS)
+        - 전체 deadline 도달 시 그때까지의 결과를 반환 (partial)
         """
-        from .command import publish_cmd
-        from concurrent.futures import as_completed
+        from .command import publish_cmds, _is_success
         
-        vt = self.store.get_virtual_tool(virtual_tool_name)
-        if not vt:
+        plan = self.store.compile(virtual_tool_name, self.device_store)
+        if not plan:
             return {
                 "ok": False,
                 "error": f"Virtual tool '{virtual_tool_name}' not found"
             }
         
-        bindings = vt.get("bindings", [])
+        bindings = plan.bindings
         if not bindings:
             return {
                 "ok": True,
@@ -217,103 +400,180 @@ class VirtualToolExecutor:
         
         log(f"[VIRTUAL_TOOL] Executing '{virtual_tool_name}' with {len(bindings)} bindings")
         
-        # 각 바인딩에 대한 future 생성
-        futures = {}
-        skipped = []  # Offline devices
+        online = self.device_store.get_online(b.device_id for b in bindings)
+        by_id = {b.node_id: b for b in bindings}
+        dependents = plan.dependents
+        waiting_on = {b.node_id: len(b.deps) for b in bindings}
         
-        for binding in bindings:
-            device_id = binding.get("device_id")
-            tool_name = binding.get("tool")
+        records: Dict[str, Dict[str, Any]] = {}  # bindings that never ran (offline / upstream failed)
+        outputs: Dict[str, Any] = {}  # upstream responses for result piping
+        dispatched: List[str] = []  # node id per batch index
+        
+        def skip(node_id: str, error: str):
+            binding = by_id[node_id]
+            records[node_id] = {
+                "device_id": binding.device_id,
+                "tool": binding.tool,
+                "ok": False,
+                "error": error,
+                "skipped": True
+            }
+            for dep in dependents[node_id]:
+                if dep not in records:
+                    skip(dep, f"Upstream binding '{node_id}' failed")
+        
+        def build(node_id: str) -> Optional[Dict[str, Any]]:
+            binding = by_id[node_id]
+            device_id = binding.device_id
             
             # Skip offline devices
-            device = self.device_store.get(device_id)
-            if not device or not device.get("online", False):
+            if not online.get(device_id):
                 log(f"[VIRTUAL_TOOL] Skipping offline device: {device_id}")
-                skipped.append({
-                    "device_id": device_id,
-                    "tool": tool_name,
-                    "ok": False,
-                    "error": "Device is offline",
-                    "skipped": True
-                })
-                continue
-            
-            # Get the tool's expected parameters from device's tool schema
-            tool_params = None  # None means no schema found
-            device_tools = device.get("tools", [])
-            tool_info = next((t for t in device_tools if t.get("name") == tool_name), None)
-            if tool_info:
-                schema = tool_info.get("parameters", {})
-                # Set even if empty - an empty set means tool takes no params
-                tool_params = set(schema.get("properties", {}).keys())
+                skip(node_id, "Device is offline")
+                return None
             
             # args_map이 있으면 적용, 없으면 자동 전달 (filtered)
-            args_map = binding.get("args_map")
-            if args_map:
+            # "$<binding id>.<path>" 값은 선행 바인딩의 응답에서 가져옴
+            if binding.args_map:
                 mapped_args = {}
-                for target_param, source_param in args_map.items():
-                    if source_param in args:
+                for target_param, source_param, ref in binding.args_map:
+                    if ref:
+                        found, value = resolve_ref(source_param, outputs)
+                        if not found:
+                            skip(node_id, f"Unresolved reference {source_param}")
+                            return None
+                        mapped_args[target_param] = value
+                    elif source_param in args:
                         mapped_args[target_param] = args[source_param]
-            elif tool_params is not None:
+            elif binding.params is not None:
                 # Filter args to only include parameters the tool accepts
-                # If tool_params is empty set, this results in empty dict (correct for no-param tools)
-                mapped_args = {k: v for k, v in args.items() if k in tool_params}
-                log(f"[VIRTUAL_TOOL] Filtered args for {device_id}/{tool_name}: {list(mapped_args.keys())}")
+                # If params is empty, this results in empty dict (correct for no-param tools)
+                mapped_args = {k: v for k, v in args.items() if k in binding.params}
             else:
                 # No schema info at all, pass all args (fallback)
                 mapped_args = args.copy()
-                log(f"[VIRTUAL_TOOL] No schema found for {device_id}/{tool_name}, passing all args")
+                log(f"[VIRTUAL_TOOL] No schema found for {device_id}/{binding.tool}, passing all args")
             
-            # Submit to thread pool
-            def execute_tool(dev_id, t_name, t_args):
-                if self.command_service:
-                    return self.command_service.execute(dev_id, t_name, t_args)
-                return publish_cmd(
-                    self.device_store, 
-                    self.cmd_waiter, 
-                    self.mqtt_client_getter(), 
-                    dev_id, 
-                    t_name, 
-                    t_args,
-                    ipc_agent=self.ipc_agent
-                )
-            
-            future = self._executor.submit(execute_tool, device_id, tool_name, mapped_args)
-            futures[future] = (device_id, tool_name)
+            command = {"device_id": device_id, "tool": binding.tool, "args": mapped_args}
+            if binding.timeout_ms:
+                command["timeout_ms"] = binding.timeout_ms
+            dispatched.append(node_id)
+            return command
+        
+        def ready(node_ids) -> List[Dict[str, Any]]:
+            commands = []
+            for node_id in node_ids:
+                command = build(node_id)
+                if command is not None:
+                    commands.append(command)
+            return commands
+        
+        def on_result(index: int, ok: bool, resp: Dict[str, Any]) -> List[Dict[str, Any]]:
+            """Pipe a finished binding's response downstream and release stages whose inputs are all ready"""
+            node_id = dispatched[index]
+            if not _is_success(ok, resp):
+                for dep in dependents[node_id]:
+                    if dep not in records:
+                        skip(dep, f"Upstream binding '{node_id}' failed")
+                return []
+            outputs[node_id] = resp
+            released = []
+            for dep in dependents[node_id]:
+                waiting_on[dep] -= 1
+                if waiting_on[dep] == 0 and dep not in records:
+                    released.append(dep)
+            return ready(released)
+        
+        commands = ready(b.node_id for b in bindings if not b.deps)
         
-        # 결과 수집
+        completion = plan.completion
+        mode = completion.get("mode", "all")
+        # Offline bindings count as failures against the policy
+        required = completion_target(completion, len(bindings))
+        deadline_ms = plan.deadline_ms
+        if self.command_service:
+            outcomes = self.command_service.execute_many(
+                commands,
+                deadline_ms=deadline_ms,
+                max_in_flight_per_device=VIRTUAL_TOOL_MAX_INFLIGHT_PER_DEVICE,
+                complete_after=required,
+                on_result=on_result,
+            )
+        else:
+            outcomes = publish_cmds(
+                self.device_store,
+                self.cmd_waiter,
+                self.mqtt_client_getter(),
+                commands,
+                deadline_ms=deadline_ms,
+                ipc_agent=self.ipc_agent,
+                max_in_flight_per_device=VIRTUAL_TOOL_MAX_INFLIGHT_PER_DEVICE,
+                complete_after=required,
+                on_result=on_result,
+            )
+        
+        # 결과 수집 (바인딩 순서)
+        batch_index = {node_id: i for i, node_id in enumerate(dispatched)}
         results = []
-        for future in as_completed(futures):
-            device_id, tool_name = futures[future]
-            try:
-                ok, resp = future.result(timeout=30)
-                results.append({
-                    "device_id": device_id,
-                    "tool": tool_name,
-                    "ok": ok,
-                    "response": resp
-                })
-            except Exception as e:
-                results.append({
-                    "device_id": device_id,
-                    "tool": tool_name,
+        skipped = []
+        timed_out = 0
+        cancelled = 0
+        for binding in bindings:
+            node_id = binding.node_id
+            if node_id in records or node_id not in batch_index:
+                record = records.get(node_id) or {
+                    "device_id": binding.device_id,
+                    "tool": binding.tool,
                     "ok": False,
-                    "error": str(e)
-                })
-        
-        # Add skipped offline devices to results
-        results.extend(skipped)
+                    "error": "Not executed",
+                    "skipped": True
+                }
+                record["id"] = node_id
+                skipped.append(record)
+                results.append(record)
+                continue
+            ok, resp = outcomes[batch_index[node_id]]
+            # Same test as the completion policy: a device reply of {"ok": false} is a failure too
+            success = _is_success(ok, resp)
+            result = {
+                "id": node_id,
+                "device_id": binding.device_id,
+                "tool": binding.tool,
+                "ok": success,
+                "response": resp
+            }
+            if not success:
+                error = resp.get("error") or {}
+                if not isinstance(error, dict):
+                    error = {"message": str(error)}
+                result["error"] = error.get("message", str(error))
+                if error.get("code") == "timeout":
+                    timed_out += 1
+                elif error.get("code") == "cancelled":
+                    cancelled += 1
+            results.append(result)
         
         # 결과 요약
         success_count = sum(1 for r in results if r.get("ok"))
         skipped_count = len(skipped)
         
+        if required is not None:
+            ok = success_count >= required
+        elif mode == "best_effort":
+            ok = success_count > 0
+        else:
+            ok = success_count == len(results) - skipped_count
+        
         return {
-            "ok": success_count == len(results) - skipped_count,
+            "ok": ok,
             "virtual_tool": virtual_tool_name,
+            "completion": mode,
             "total": len(results),
             "success": success_count,
-            "failed": len(results) - success_count - skipped_count,
+            "failed": len(results) - success_count - skipped_count - cancelled,
             "skipped": skipped_count,
+            "cancelled": cancelled,
+            "timed_out": timed_out,
+            "partial": timed_out > 0 or cancelled > 0,
             "results": results
         }
@@ -1,5 +1,5 @@
-from typing import Any, Dict, Tuple
-from bridge_mcp.command import publish_cmd
+from typing import Any, Callable, Dict, List, Tuple
+from bridge_mcp.command import publish_cmd, publish_cmds
 
 
 class LegacyCommandBus:
@@ -19,12 +19,18 @@ class LegacyCommandBus:
         tool: str,
         args: Any,
         timeout_ms: int | None = None,
+        priority: str | None = None,
+        on_chunk: Callable[[Dict[str, Any]], Any] | None = None,
     ) -> Tuple[bool, Dict[str, Any]]:
         kwargs: Dict[str, Any] = {
             "ipc_agent": self._ipc_agent,
         }
         if timeout_ms is not None:
             kwargs["timeout_ms"] = timeout_ms
+        if priority is not None:
+            kwargs["priority"] = priority
+        if on_chunk is not None:
+            kwargs["on_chunk"] = on_chunk
 
         return publish_cmd(
             self._device_store,
@@ -35,3 +41,28 @@ class LegacyCommandBus:
             args,
             **kwargs,
         )
+
+    def execute_many(
+        self,
+        commands: List[Dict[str, Any]],
+        deadline_ms: int | None = None,
+        on_result: Callable[[int, bool, Dict[str, Any]], Any] | None = None,
+        max_in_flight_per_device: int | None = None,
+        complete_after: int | None = None,
+        priority: str | None = None,
+    ) -> List[Tuple[bool, Dict[str, Any]]]:
+        kwargs: Dict[str, Any] = {}
+        if priority is not None:
+            kwargs["priority"] = priority
+        return publish_cmds(
+            self._device_store,
+            self._cmd_waiter,
+            self._mqtt_client_getter(),
+            commands,
+            deadline_ms=deadline_ms,
+            ipc_agent=self._ipc_agent,
+            on_result=on_result,
+            max_in_flight_per_device=max_in_flight_per_device,
+            complete_after=complete_after,
+            **kwargs,
+        )
@@ -17,6 +17,10 @@ class RuntimeContext:
     virtual_tool_executor: Any
     bridge_server: Any
     port_router: Any
+    announce_queue: Any
+    asset_fetcher: Any
+    image_processor: Any
+    asset_channel: Any
 
     # V2 services
     device_sessions: DeviceSessionManager
@@ -1,22 +1,27 @@
 import os
 from bridge_mcp.config import (
     PROJECTION_CONFIG_PATH,
+    RESULT_CACHE_SIZE,
     ROUTING_CONFIG_PATH,
     VIRTUAL_TOOLS_CONFIG_PATH,
 )
+from bridge_mcp.asset_channel import AssetChannel
+from bridge_mcp.asset_fetcher import AssetFetcher
+from bridge_mcp.image_processor import ImageProcessor
 from bridge_mcp.tool_projection import ToolProjectionStore
 from bridge_mcp.tool_registry import DynamicToolRegistry
 from bridge_mcp.device_store import DeviceStore
-from bridge_mcp.command import CommandWaiter
+from bridge_mcp.command import CommandWaiter, flush_outbox
 from bridge_mcp.mqtt import start_mqtt_listener, publish_to_inport, get_mqtt_pub_client
 from bridge_mcp.ipc import IPCAgent
+from bridge_mcp.announce_queue import AnnounceAdmissionQueue
 from bridge_mcp.server import BridgeServer
 from bridge_mcp.virtual_tool import VirtualToolStore, VirtualToolExecutor
 from port_routing import PortStore, RoutingMatrix, PortRouter, AsyncPortRouter
 
 from .app_context import RuntimeContext
 from .adapters import LegacyCommandBus, LegacyRoutingBackend
-from .services import DeviceSessionManager, CommandService, RoutingService
+from .services import DeviceSessionManager, CommandService, RoutingService, ToolResultCache
 
 
 def build_runtime_context() -> RuntimeContext:
@@ -27,8 +32,21 @@ def build_runtime_context() -> RuntimeContext:
     port_store = PortStore()
     routing_matrix = RoutingMatrix(ROUTING_CONFIG_PATH)
     virtual_tool_store = VirtualToolStore(VIRTUAL_TOOLS_CONFIG_PATH)
+    asset_fetcher = AssetFetcher()
+    image_processor = ImageProcessor()
+    asset_channel = AssetChannel()
 
-    ipc_agent = IPCAgent(device_store, cmd_waiter, port_store, None)
+    announce_queue = AnnounceAdmissionQueue(
+        device_store.upsert_announce,
+        workers=int(os.getenv("ANNOUNCE_WORKERS", "2")),
+        rate_per_sec=float(os.getenv("ANNOUNCE_RATE", "20")),
+        burst=int(os.getenv("ANNOUNCE_BURST", "20")),
+        queue_size=int(os.getenv("ANNOUNCE_QUEUE_SIZE", "10000")),
+        priority_fn=cmd_waiter.has_pending,
+    )
+
+    ipc_agent = IPCAgent(device_store, cmd_waiter, port_store, None, announce_queue=announce_queue,
+                         asset_channel=asset_channel)
 
     def hybrid_publish(device_id: str, port: str, value: float) -> bool:
         d = device_store.get(device_id)
@@ -45,10 +63,30 @@ def build_runtime_context() -> RuntimeContext:
     ipc_agent.protocol.port_router = port_router
     ipc_agent.start()
 
-    start_mqtt_listener(device_store, cmd_waiter, port_store, port_router)
+    start_mqtt_listener(device_store, cmd_waiter, port_store, port_router, announce_queue=announce_queue,
+                        asset_channel=asset_channel)
 
     command_bus = LegacyCommandBus(device_store, cmd_waiter, get_mqtt_pub_client, ipc_agent)
-    command_service = CommandService(command_bus)
+    command_service = CommandService(
+        command_bus,
+        result_cache=ToolResultCache(RESULT_CACHE_SIZE),
+        cache_ttl_ms=device_store.get_cache_ttl_ms,
+    )
+    device_store.register_on_any_announce_callback(command_service.invalidate_device)
+    device_store.register_on_any_announce_callback(cmd_waiter.health.reset)
+    device_store.register_on_token_callback(cmd_waiter.signer.invalidate)
+
+    def apply_device_limit(device_id: str):
+        info = device_store.get_dispatch_info([device_id]).get(device_id) or {}
+        cmd_waiter.scheduler.set_limit(device_id, info.get("max_in_flight"))
+
+    device_store.register_on_any_announce_callback(apply_device_limit)
+
+    def deliver_outbox(device_id: str):
+        flush_outbox(device_store, cmd_waiter, get_mqtt_pub_client(), device_id, ipc_agent=ipc_agent)
+
+    device_store.register_on_any_announce_callback(deliver_outbox)
+    ipc_agent.register_on_connect_callback(deliver_outbox)
     routing_backend = LegacyRoutingBackend(routing_matrix, port_store, port_router)
     routing_service = RoutingService(routing_backend)
     virtual_tool_executor = VirtualToolExecutor(
@@ -72,6 +110,9 @@ def build_runtime_context() -> RuntimeContext:
         ipc_agent=ipc_agent,
         virtual_tool_store=virtual_tool_store,
         virtual_tool_executor=virtual_tool_executor,
+        asset_fetcher=asset_fetcher,
+        image_processor=image_processor,
+        asset_channel=asset_channel,
     )
     bridge_server.register_all_announced_devices()
     bridge_server.register_virtual_tools()
@@ -88,6 +129,10 @@ def build_runtime_context() -> RuntimeContext:
         virtual_tool_executor=virtual_tool_executor,
         bridge_server=bridge_server,
         port_router=port_router,
+        announce_queue=announce_queue,
+        asset_fetcher=asset_fetcher,
+        image_processor=image_processor,
+        asset_channel=asset_channel,
         device_sessions=DeviceSessionManager(device_store),
         command_service=command_service,
         routing_service=routing_service,
@@ -1,4 +1,4 @@
-from typing import Any, Dict, Protocol, Tuple
+from typing import Any, Callable, Dict, List, Protocol, Tuple
 
 
 class CommandBus(Protocol):
@@ -8,9 +8,22 @@ class CommandBus(Protocol):
         tool: str,
         args: Any,
         timeout_ms: int | None = None,
+        priority: str | None = None,
+        on_chunk: Callable[[Dict[str, Any]], Any] | None = None,
     ) -> Tuple[bool, Dict[str, Any]]:
         ...
 
+    def execute_many(
+        self,
+        commands: List[Dict[str, Any]],
+        deadline_ms: int | None = None,
+        on_result: Callable[[int, bool, Dict[str, Any]], Any] | None = None,
+        max_in_flight_per_device: int | None = None,
+        complete_after: int | None = None,
+        priority: str | None = None,
+    ) -> List[Tuple[bool, Dict[str, Any]]]:
+        ...
+
 
 class RoutingBackend(Protocol):
     def connect(
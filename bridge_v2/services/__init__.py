@@ -1,5 +1,6 @@
 from .device_session_manager import DeviceSessionManager
 from .command_service import CommandService
 from .routing_service import RoutingService
+from .result_cache import ToolResultCache
 
-__all__ = ["DeviceSessionManager", "CommandService", "RoutingService"]
+__all__ = ["DeviceSessionManager", "CommandService", "RoutingService", "ToolResultCache"]
@@ -1,14 +1,26 @@
-from typing import Any, Dict, Tuple
+from typing import Any, Callable, Dict, List, Tuple
 from ..contracts import CommandBus
+from .result_cache import ToolResultCache
 
 
 class CommandService:
     """
     V2 command use-case service.
+
+    With a result cache, single commands to tools that resolve a cache TTL
+    (cache_ttl_ms(device_id, tool) -> ms or None) are served from the cache and
+    identical concurrent calls share one device command. Batches are not cached.
     """
 
-    def __init__(self, bus: CommandBus):
+    def __init__(
+        self,
+        bus: CommandBus,
+        result_cache: ToolResultCache | None = None,
+        cache_ttl_ms: Callable[[str, str], int | None] | None = None,
+    ):
         self._bus = bus
+        self._result_cache = result_cache
+        self._cache_ttl_ms = cache_ttl_ms
 
     def execute(
         self,
@@ -16,5 +28,54 @@ class CommandService:
         tool: str,
         args: Any,
         timeout_ms: int | None = None,
+        priority: str | None = None,
+        on_chunk: Callable[[Dict[str, Any]], Any] | None = None,
     ) -> Tuple[bool, Dict[str, Any]]:
-        return self._bus.execute(device_id, tool, args, timeout_ms=timeout_ms)
+        """on_chunk receives partial results of a streaming tool; such calls bypass the result cache"""
+        if on_chunk is not None:
+            return self._bus.execute(device_id, tool, args, timeout_ms=timeout_ms, priority=priority, on_chunk=on_chunk)
+        ttl_ms = None
+        if self._result_cache is not None and self._cache_ttl_ms is not None:
+            ttl_ms = self._cache_ttl_ms(device_id, tool)
+        if ttl_ms:
+            return self._result_cache.get_or_execute(
+                device_id, tool, args, ttl_ms,
+                lambda: self._bus.execute(device_id, tool, args, timeout_ms=timeout_ms, priority=priority),
+            )
+        return self._bus.execute(device_id, tool, args, timeout_ms=timeout_ms, priority=priority)
+
+    def execute_many(
+        self,
+        commands: List[Dict[str, Any]],
+        deadline_ms: int | None = None,
+        on_result: Callable[[int, bool, Dict[str, Any]], Any] | None = None,
+        max_in_flight_per_device: int | None = None,
+        complete_after: int | None = None,
+        priority: str | None = None,
+    ) -> List[Tuple[bool, Dict[str, Any]]]:
+        """
+        Dispatch all commands at once; results come back in input order.
+        commands: [{"device_id", "tool", "args", "timeout_ms"(optional)}]
+        max_in_flight_per_device caps concurrent commands per device; the rest wait for a slot.
+        complete_after returns once that many commands succeeded, cancelling the rest.
+        on_result may return follow-up commands, which join the batch immediately.
+        priority is the device scheduler class (default "fanout"; single executes default to "interactive").
+        """
+        return self._bus.execute_many(
+            commands,
+            deadline_ms=deadline_ms,
+            on_result=on_result,
+            max_in_flight_per_device=max_in_flight_per_device,
+            complete_after=complete_after,
+            priority=priority,
+        )
+
+    def invalidate_device(self, device_id: str):
+        """Drop cached results of one device (e.g. after it re-announced)"""
+        if self._result_cache is not None:
+            self._result_cache.invalidate_device(device_id)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        if self._result_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self._result_cache.get_stats()}
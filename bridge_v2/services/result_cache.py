@@ -0,0 +1,127 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+from bridge_mcp.utils import canonical_hash
+
+Result = Tuple[bool, Dict[str, Any]]
+CacheKey = Tuple[str, str, str]
+
+
+class _Flight:
+    """One in-progress device command shared by every caller asking for the same key."""
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[Result] = None
+        self.error: Optional[BaseException] = None
+
+
+class ToolResultCache:
+    """
+    TTL + LRU cache of successful tool results, keyed by device, tool and canonical args.
+
+    Concurrent calls for the same key are single-flighted: the first caller runs
+    the device command and the others wait for its result. Failures are handed
+    to the waiting callers but never stored. invalidate_device() drops a device's
+    entries and keeps results of commands already in flight from being stored.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self._max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Result]]" = OrderedDict()
+        self._keys_by_device: Dict[str, Set[CacheKey]] = {}
+        self._flights: Dict[CacheKey, _Flight] = {}
+        # Bumped on invalidation; a flight only stores its result if its device's epoch is unchanged
+        self._epochs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "stored": 0, "evicted": 0, "invalidated": 0}
+
+    @staticmethod
+    def make_key(device_id: str, tool: str, args: Any) -> CacheKey:
+        return (device_id, tool, canonical_hash(args if args is not None else {}))
+
+    def get_or_execute(self, device_id: str, tool: str, args: Any, ttl_ms: int,
+                       execute: Callable[[], Result]) -> Result:
+        """Serve a fresh cached result, join an identical in-flight command, or run `execute`."""
+        key = self.make_key(device_id, tool, args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return copy.deepcopy(result)
+                self._remove(key)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                epoch = self._epochs.get(device_id, 0)
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            result = execute()
+            flight.result = result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                ok, resp = flight.result or (False, {})
+                if ok and resp.get("ok") is not False and self._epochs.get(device_id, 0) == epoch:
+                    self._store(key, time.monotonic() + ttl_ms / 1000.0, copy.deepcopy(flight.result))
+            flight.event.set()
+        return result
+
+    def invalidate_device(self, device_id: str):
+        with self._lock:
+            self._epochs[device_id] = self._epochs.get(device_id, 0) + 1
+            keys = self._keys_by_device.pop(device_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self._stats["invalidated"] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            for device_id in self._keys_by_device:
+                self._epochs[device_id] = self._epochs.get(device_id, 0) + 1
+            self._entries.clear()
+            self._keys_by_device.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "in_flight": len(self._flights)}
+
+    # ---- caller holds self._lock ----
+
+    def _store(self, key: CacheKey, expires_at: float, result: Result):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        self._keys_by_device.setdefault(key[0], set()).add(key)
+        self._stats["stored"] += 1
+        while len(self._entries) > self._max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evicted"] += 1
+
+    def _remove(self, key: CacheKey):
+        self._entries.pop(key, None)
+        keys = self._keys_by_device.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_device[key[0]]
@@ -4,9 +4,16 @@ import time
 import threading
 import inspect
 import queue
+import hashlib
+from collections import OrderedDict
 from typing import Dict, Any, Callable, Optional, List, Union
 
 class SabaIPCClient:
+    # Request ids remembered so a re-sent command (bridge retry / hedge) never runs twice
+    RECENT_REQUESTS = 256
+    # Bytes per binary asset chunk
+    ASSET_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, device_id: str, device_name: str = None, host: str = "127.0.0.1", port: int = 8085, 
                  outports: List[Dict[str, str]] = None, inports: List[Dict[str, str]] = None):
         self.device_id = device_id
@@ -19,9 +26,14 @@ class SabaIPCClient:
         self.outports: List[Dict[str, Any]] = outports or []
         self.inports: List[Dict[str, Any]] = inports or []
         self.on_port_data_callback: Optional[Callable[[str, float], None]] = None
+        self._recent: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()  # request_id -> reply (None while running)
+        self._recent_lock = threading.Lock()
         
         self.running = False
         self.sock: Optional[socket.socket] = None
+        # Set once the bridge has accepted a full announce; later reconnects
+        # only announce the schema hash (bridge replies with device.announce_request if unknown)
+        self._announced_hash: Optional[str] = None
         
         # Concurrency
         self.msg_queue = queue.Queue(maxsize=1000) # Rx Queue
@@ -33,8 +45,8 @@ class SabaIPCClient:
         self.tx_thread: Optional[threading.Thread] = None
         self.process_thread: Optional[threading.Thread] = None
 
-    def tool(self, name: str = None, description: str = None):
-        """Decorator to register a function as an MCP tool"""
+    def tool(self, name: str = None, description: str = None, idempotent: bool = False):
+        """Decorator to register a function as an MCP tool (idempotent: safe for the bridge to re-send)"""
         def decorator(func):
             tool_name = name or func.__name__
             tool_desc = description or func.__doc__ or "No description"
@@ -66,6 +78,9 @@ class SabaIPCClient:
                 }
             }
             
+            if idempotent:
+                tool_def["idempotent"] = True
+            
             self.tools[tool_name] = tool_def
             self.tool_callbacks[tool_name] = func
             return func
@@ -155,16 +170,9 @@ class SabaIPCClient:
                 print(f"[IPC] Connected!")
 
                 # 1. Announce Device (Tools)
-                announce_msg = {
-                    "topic": f"mcp/dev/{self.device_id}/announce",
-                    "payload": {
-                        "name": self.device_name,
-                        "version": "1.0.0",
-                        "tools": list(self.tools.values())
-                    }
-                }
-                
-                self._send_system_msg(announce_msg)
+                schema_hash = self._schema_hash()
+                self._send_system_msg(self._announce_msg(full=self._announced_hash != schema_hash))
+                self._announced_hash = schema_hash
                 
                 # 2. Announce Ports
                 if self.outports or self.inports:
@@ -184,6 +192,24 @@ class SabaIPCClient:
                 time.sleep(3)
         return False
 
+    def _schema_hash(self) -> str:
+        canonical = json.dumps(list(self.tools.values()), sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _announce_msg(self, full: bool = True) -> Dict[str, Any]:
+        payload = {
+            "name": self.device_name,
+            "version": "1.0.0",
+            "schema_hash": self._schema_hash(),
+            "batch_cmd": True
+        }
+        if full:
+            payload["tools"] = list(self.tools.values())
+        return {
+            "topic": f"mcp/dev/{self.device_id}/announce",
+            "payload": payload
+        }
+
     def _rx_loop(self):
         """Continuously read from socket and push to queue"""
         buffer = ""
@@ -257,6 +283,12 @@ class SabaIPCClient:
                 
             if self.sock:
                 try:
+                    if isinstance(msg, tuple):
+                        # Asset chunk: header line, then the raw bytes
+                        header, chunk = msg
+                        self.sock.sendall((json.dumps(header) + "\n").encode("utf-8"))
+                        self.sock.sendall(chunk)
+                        continue
                     data_str = json.dumps(msg) + "\n"
                     # blocking sendall on the socket
                     self.sock.sendall(data_str.encode("utf-8"))
@@ -301,7 +333,17 @@ class SabaIPCClient:
         if msg_type == "device.command":
             t = threading.Thread(target=self._execute_tool, args=(cmd,), daemon=True)
             t.start()
+
+        # Several commands in one frame -> each runs and replies on its own
+        elif msg_type == "device.command_batch":
+            for sub in cmd.get("commands") or []:
+                t = threading.Thread(target=self._execute_tool, args=(sub,), daemon=True)
+                t.start()
             
+        # Bridge lost our schema (e.g. restarted) -> resend full announce
+        elif msg_type == "device.announce_request":
+            self._send_system_msg(self._announce_msg(full=True))
+
         # InPort Data -> FAST CALLBACK
         elif msg_type == "ports.set":
             port = cmd.get("port")
@@ -321,21 +363,49 @@ class SabaIPCClient:
         tool_name = cmd.get("tool")
         args = cmd.get("args") or {}
         
+        if rid:
+            with self._recent_lock:
+                if rid in self._recent:
+                    # Duplicate: re-send the reply if done, otherwise the running call will answer
+                    reply = self._recent[rid]
+                    if reply is not None:
+                        self._send_system_msg(reply)
+                    return
+                self._recent[rid] = None
+                if len(self._recent) > self.RECENT_REQUESTS:
+                    self._recent.popitem(last=False)
+        
         print(f"[IPC] Invoke tool: {tool_name} args={args}")
         
         result_text = ""
+        result_assets = None
+        seq = None
         if tool_name in self.tool_callbacks:
             try:
                 # Execute user function
                 res = self.tool_callbacks[tool_name](**args)
-                result_text = str(res)
+                if inspect.isgenerator(res):
+                    # Streaming tool: every yielded value goes out as a partial result
+                    seq = 0
+                    for item in res:
+                        self._send_system_msg({
+                            "topic": f"mcp/dev/{self.device_id}/events",
+                            "payload": {"request_id": rid, "partial": True, "seq": seq, "result": {"text": str(item)}}
+                        })
+                        seq += 1
+                elif isinstance(res, dict):
+                    # {"text": ..., "assets": [{"kind", "mime", "data": bytes} or {"kind", "mime", "url"}]}
+                    result_text = str(res.get("text", ""))
+                    result_assets = [self._send_asset(rid, i, a) for i, a in enumerate(res.get("assets") or [])]
+                else:
+                    result_text = str(res)
             except Exception as e:
                 result_text = f"Error executing tool: {e}"
                 print(f"[IPC] Tool Error: {e}")
         else:
             result_text = f"Tool {tool_name} not found"
 
-        # Reply
+        # Reply (for a streaming tool: the final message, seq = number of partial results sent)
         resp = {
             "topic": f"mcp/dev/{self.device_id}/events",
             "payload": {
@@ -345,4 +415,37 @@ class SabaIPCClient:
                 }
             }
         }
+        if seq is not None:
+            resp["payload"]["seq"] = seq
+        if result_assets:
+            resp["payload"]["result"]["assets"] = result_assets
+        if rid:
+            with self._recent_lock:
+                if rid in self._recent:
+                    self._recent[rid] = resp
         self._send_system_msg(resp)
+
+    def _send_asset(self, rid: str, index: int, asset: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Push an asset's bytes ("data") to the bridge in chunks over the socket and
+        return the reference for the result; assets without data are returned as is.
+        """
+        data = asset.get("data")
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            return asset
+        view = memoryview(data).cast("B")
+        asset_id = str(asset.get("asset_id") or f"a{index}")
+        size = len(view)
+        for offset in range(0, max(size, 1), self.ASSET_CHUNK_SIZE):
+            chunk = view[offset:offset + self.ASSET_CHUNK_SIZE]
+            header = {
+                "topic": f"mcp/dev/{self.device_id}/assets",
+                "payload": {"request_id": rid, "asset_id": asset_id, "offset": offset, "size": size,
+                            "length": len(chunk)}
+            }
+            # Blocking put: a large asset waits for the Tx thread instead of being dropped
+            self.tx_queue.put((header, chunk))
+        ref = {k: v for k, v in asset.items() if k != "data"}
+        ref.update(asset_id=asset_id, size=size)
+        return ref
+
@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+
+from bridge_mcp import mqtt
+from bridge_mcp.command import CommandWaiter
+from bridge_mcp.device_store import ANNOUNCE_SCHEMA_UNKNOWN, ANNOUNCE_UNCHANGED, ANNOUNCE_UPDATED, DeviceStore
+from bridge_mcp.protocol import ProtocolHandler
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+from bridge_mcp.utils import canonical_hash
+from port_routing import PortStore
+
+TOOLS = [{"name": "snap", "parameters": {"type": "object", "properties": {}}}]
+FULL = {"name": "cam", "tools": TOOLS}
+HASH_ONLY = {"name": "cam", "schema_hash": canonical_hash(TOOLS)}
+
+
+class _Client:
+    """MQTT publish client stand-in: records (topic, payload)"""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, json.loads(payload)))
+
+
+class AnnounceDeltaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.store = DeviceStore(DynamicToolRegistry(projection))
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class ClassifyAnnounceTest(AnnounceDeltaTestCase):
+    def test_first_full_announce_updates(self):
+        self.assertEqual(self.store.classify_announce("cam", FULL), ANNOUNCE_UPDATED)
+        self.assertIsNone(self.store.get("cam"))  # classify does not touch the store
+
+    def test_same_schema_is_unchanged(self):
+        self.store.upsert_announce("cam", FULL)
+        version = self.store.schema_version
+        for msg in (FULL, HASH_ONLY, {**HASH_ONLY, "version": "1.1"}):
+            with self.subTest(msg=msg):
+                self.assertEqual(self.store.upsert_announce("cam", msg), ANNOUNCE_UNCHANGED)
+        self.assertEqual(self.store.schema_version, version)
+        self.assertEqual(self.store.get("cam")["version"], "1.1")  # metadata still refreshed
+
+    def test_unknown_hash_asks_for_the_full_announce(self):
+        self.assertEqual(self.store.classify_announce("cam", HASH_ONLY), ANNOUNCE_SCHEMA_UNKNOWN)
+        self.store.upsert_announce("cam", FULL)
+        self.assertEqual(self.store.classify_announce("cam", {"name": "cam", "schema_hash": "other"}),
+                         ANNOUNCE_SCHEMA_UNKNOWN)
+
+    def test_name_change_re_registers(self):
+        self.store.upsert_announce("cam", FULL)
+        self.assertEqual(self.store.classify_announce("cam", {**HASH_ONLY, "name": "cam2"}), ANNOUNCE_SCHEMA_UNKNOWN)
+        self.assertEqual(self.store.upsert_announce("cam", {**FULL, "name": "cam2"}), ANNOUNCE_UPDATED)
+        self.assertEqual(self.store.get("cam")["name"], "cam2")
+
+    def test_changed_tools_re_register(self):
+        self.store.upsert_announce("cam", FULL)
+        tools = TOOLS + [{"name": "zoom"}]
+        self.assertEqual(self.store.upsert_announce("cam", {"name": "cam", "tools": tools}), ANNOUNCE_UPDATED)
+        self.assertEqual(self.store.get("cam")["schema_hash"], canonical_hash(tools))
+
+
+class AfterAnnounceTest(AnnounceDeltaTestCase):
+    """The MQTT follow-up of an announce: claim token push or full-announce request"""
+
+    def setUp(self):
+        super().setUp()
+        self.client = _Client()
+        patcher = mock.patch.object(mqtt, "get_mqtt_pub_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.protocol = ProtocolHandler(self.store, CommandWaiter(), PortStore(), None)
+
+    def announce(self, payload):
+        self.client.published.clear()
+        action, _ = self.protocol.handle_message("mcp/dev/cam/announce", payload, protocol="mqtt",
+                                                 on_announce=partial(mqtt.after_announce, self.store))
+        return action, self.client.published
+
+    def test_full_announce_gets_a_claim_token(self):
+        action, published = self.announce(FULL)
+        self.assertEqual(action, "announce")
+        self.assertEqual(published, [("mcp/dev/cam/claim", {"token": self.store.get_token("cam")})])
+
+    def test_unchanged_announce_is_claimed_only_without_a_token(self):
+        self.announce(FULL)
+        token = self.store.get_token("cam")
+        self.assertEqual(self.announce({**HASH_ONLY, "claimed": True}), ("announce_unchanged", []))
+        action, published = self.announce(HASH_ONLY)
+        self.assertEqual(action, "announce_unchanged")
+        self.assertEqual(published, [("mcp/dev/cam/claim", {"token": token})])
+
+    def test_unknown_schema_requests_the_full_announce(self):
+        action, published = self.announce(HASH_ONLY)
+        self.assertEqual(action, "announce_request")
+        self.assertEqual(published, [("mcp/dev/cam/announce/request", {"type": "device.announce_request"})])
+        self.assertIsNone(self.store.get_token("cam"))
+
+
+if __name__ == "__main__":
+    unittest.main()
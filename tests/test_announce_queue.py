@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from bridge_mcp.announce_queue import AnnounceAdmissionQueue
+
+
+class _Handler:
+    """Announce handler that records (device_id, payload) and blocks while gate is clear"""
+
+    def __init__(self):
+        self.seen = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def __call__(self, device_id, payload, protocol):
+        self.started.set()
+        self.gate.wait(timeout=5)
+        self.seen.append((device_id, payload, time.monotonic()))
+        return "announce"
+
+
+class AnnounceQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = _Handler()
+        self.queues = []
+
+    def tearDown(self):
+        self.handler.gate.set()
+        for queue in self.queues:
+            queue.stop()
+
+    def make(self, **kwargs):
+        kwargs.setdefault("workers", 1)
+        kwargs.setdefault("rate_per_sec", 0)
+        queue = AnnounceAdmissionQueue(self.handler, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def block_worker(self, queue):
+        """Park the single worker inside the handler so later submits stay queued"""
+        self.handler.gate.clear()
+        queue.submit("blocker", {}, "mqtt")
+        self.assertTrue(self.handler.started.wait(timeout=2))
+
+    def drain(self, queue, n):
+        self.handler.gate.set()
+        for _ in range(200):
+            if len(self.handler.seen) >= n:
+                return
+            time.sleep(0.01)
+        self.fail(f"{n} announces were not processed")
+
+    def test_requeued_device_is_processed_once_with_its_latest_payload(self):
+        queue = self.make()
+        self.block_worker(queue)
+        for version in range(3):
+            self.assertTrue(queue.submit("cam", {"v": version}, "mqtt"))
+        stats = queue.get_stats()
+        self.assertEqual((stats["coalesced"], stats["queue_size"]), (2, 1))
+        self.drain(queue, 2)
+        time.sleep(0.05)
+        self.assertEqual([(d, p) for d, p, _ in self.handler.seen], [("blocker", {}), ("cam", {"v": 2})])
+        self.assertEqual(queue.get_stats()["queue_size"], 0)
+
+    def test_devices_with_pending_commands_go_first(self):
+        queue = self.make(priority_fn=lambda device_id: device_id.startswith("busy"))
+        self.block_worker(queue)
+        for device_id in ("idle1", "busy1", "idle2", "busy2"):
+            queue.submit(device_id, {}, "mqtt")
+        self.drain(queue, 5)
+        self.assertEqual([d for d, _, _ in self.handler.seen[1:]], ["busy1", "busy2", "idle1", "idle2"])
+        self.assertEqual(queue.get_stats()["prioritized"], 2)
+
+    def test_full_queue_drops(self):
+        queue = self.make(queue_size=1)
+        self.block_worker(queue)
+        self.assertTrue(queue.submit("a", {}, "mqtt"))
+        self.assertFalse(queue.submit("b", {}, "mqtt"))
+        self.assertTrue(queue.submit("a", {"v": 1}, "mqtt"))  # coalescing needs no room
+        self.assertEqual(queue.get_stats()["dropped"], 1)
+
+    def test_idle_workers_do_not_bank_tokens(self):
+        queue = self.make(workers=3, rate_per_sec=10, burst=1)
+        time.sleep(0.3)  # idle: the bucket holds one token, not one per worker
+        started = time.monotonic()
+        for i in range(4):
+            queue.submit(f"d{i}", {}, "mqtt")
+        self.drain(queue, 4)
+        # One burst token, then 10/s for the other three
+        self.assertGreaterEqual(max(t for _, _, t in self.handler.seen) - started, 0.25)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from bridge_mcp.asset_channel import AssetChannel
+
+DATA = bytes(range(100))
+
+
+class AssetChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.channel = AssetChannel(max_bytes=1000, ttl_ms=60000)
+
+    def put(self, offset, length, asset_id="snap"):
+        return self.channel.put("cam", "r1", asset_id, offset, len(DATA), DATA[offset:offset + length])
+
+    def get(self, timeout_s=0.05):
+        body = self.channel.get("cam", "r1", "snap", timeout_s)
+        return bytes(body) if body is not None else None
+
+    def test_chunks_in_any_order(self):
+        for offset in (60, 0, 30):
+            self.assertTrue(self.put(offset, 30 if offset < 60 else 40))
+        self.assertEqual(self.get(), DATA)
+        self.assertEqual(self.channel.get_stats()["completed"], 1)
+
+    def test_overlapping_chunks_do_not_complete_a_gap(self):
+        # 0-60 and 40-80 overlap: 100 bytes were sent, but 80-100 is still missing
+        self.put(0, 60)
+        self.put(40, 40)
+        self.assertIsNone(self.get())
+        self.put(70, 30)
+        self.assertEqual(self.get(), DATA)
+        self.assertEqual(self.channel.get_stats()["bytes"], 100)
+
+    def test_retransmitted_chunk_is_counted_once(self):
+        self.put(0, 50)
+        self.put(0, 50)
+        self.assertIsNone(self.get())
+        self.put(50, 50)
+        self.assertEqual(self.get(), DATA)
+
+    def test_chunks_that_do_not_fit_are_rejected(self):
+        self.assertFalse(self.channel.put("cam", "r1", "snap", 90, len(DATA), bytes(20)))
+        self.assertFalse(self.channel.put("cam", "r1", "big", 0, 2000, b"x"))
+        self.assertEqual(self.channel.get_stats()["rejected"], 2)
+
+    def test_empty_asset(self):
+        self.assertTrue(self.channel.put("cam", "r1", "snap", 0, 0, b""))
+        self.assertEqual(self.get(), b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from bridge_mcp.asset_fetcher import AssetFetcher
+
+
+class _Response:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class _Session:
+    """requests.Session stand-in: serves snapshot.jpg with an ETag, 304 when it matches"""
+
+    def __init__(self, body):
+        self.body = body
+        self.on_get = None
+
+    def get(self, url, headers=None, timeout=None):
+        if self.on_get:
+            self.on_get()
+        if (headers or {}).get("If-None-Match") == '"v1"':
+            return _Response(304)
+        return _Response(200, self.body, {"ETag": '"v1"'})
+
+
+class RevalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.fetcher = AssetFetcher(workers=1, max_bytes=8)
+        self.session = _Session(b"snapshot")
+        self.fetcher._session = lambda url: self.session
+
+    def test_not_modified_after_eviction_keeps_the_body(self):
+        url = "http://cam/snapshot.jpg"
+        self.assertEqual(self.fetcher.fetch(url), b"snapshot")
+
+        # Another asset takes the whole cache while the revalidation is in flight
+        def evict():
+            self.session.on_get = None
+            self.fetcher.fetch("http://cam/other.jpg")
+        self.session.body = b"otherimg"
+        self.session.on_get = evict
+
+        self.assertEqual(self.fetcher.fetch(url), b"snapshot")
+        stats = self.fetcher.get_stats()
+        self.assertEqual(stats["revalidated"], 1)
+        self.assertEqual(stats["failed"], 0)
+        self.assertLessEqual(stats["bytes"], 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
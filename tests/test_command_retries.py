@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from bridge_mcp.command import CommandWaiter, publish_cmd
+from bridge_mcp.config import BREAKER_FAILURE_THRESHOLD, CMD_RETRY_MAX
+from bridge_mcp.device_health import BREAKER_CLOSED
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+
+
+class _Client:
+    """MQTT stand-in: records sends and hands each request id to on_send"""
+
+    def __init__(self, on_send=None):
+        self.sent = []
+        self.on_send = on_send
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        frame = json.loads(payload)
+        rid = json.loads(frame["data"])["request_id"] if "data" in frame else frame["request_id"]
+        self.sent.append(rid)
+        if self.on_send:
+            self.on_send(rid, len(self.sent))
+
+
+class IdempotentRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.store = DeviceStore(DynamicToolRegistry(projection))
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        self.store.upsert_announce("cam", {"name": "cam", "tools": [{"name": "scan", "idempotent": True}]})
+        self.store.update_status("cam", {"online": True})
+        self.waiter = CommandWaiter()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_unanswered_call_records_one_timeout(self):
+        self.assertGreaterEqual(CMD_RETRY_MAX + 1, BREAKER_FAILURE_THRESHOLD)
+        client = _Client()
+        ok, resp = publish_cmd(self.store, self.waiter, client, "cam", "scan", {}, timeout_ms=50)
+        self.assertFalse(ok)
+        self.assertEqual(resp["error"]["code"], "timeout")
+        self.assertEqual(len(client.sent), CMD_RETRY_MAX + 1)
+        health = self.waiter.health.get_device("cam")
+        self.assertEqual(health["timeouts"], 1)
+        self.assertEqual(health["retries"], CMD_RETRY_MAX)
+        self.assertEqual(health["state"], BREAKER_CLOSED)
+
+    def test_streaming_call_is_not_resent(self):
+        # One chunk every 60ms for longer than all attempts together would last
+        def stream(rid, sends):
+            if sends > 1:
+                return
+
+            def run():
+                for seq in range(12):
+                    time.sleep(0.06)
+                    self.waiter.resolve(rid, {"request_id": rid, "partial": True, "seq": seq,
+                                              "result": {"text": str(seq)}}, device_id="cam")
+                self.waiter.resolve(rid, {"request_id": rid, "seq": 12, "result": {}}, device_id="cam")
+            threading.Thread(target=run, daemon=True).start()
+
+        client = _Client(stream)
+        ok, resp = publish_cmd(self.store, self.waiter, client, "cam", "scan", {}, timeout_ms=100)
+        self.assertTrue(ok, resp)
+        self.assertEqual(resp["result"]["text"], "".join(str(i) for i in range(12)))
+        self.assertEqual(len(client.sent), 1)
+        self.assertEqual(self.waiter.health.get_device("cam")["timeouts"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import hashlib
+import hmac
+import json
+import threading
+import unittest
+
+from bridge_mcp.command_signer import CommandSigner
+
+PAYLOAD = json.dumps({"type": "device.command", "tool": "snap", "args": {}, "request_id": "r1"})
+
+
+def expected(token, data):
+    return hmac.new(token.encode(), data.encode(), hashlib.sha256).hexdigest()
+
+
+class CommandSignerTest(unittest.TestCase):
+    def setUp(self):
+        self.signer = CommandSigner()
+
+    def test_envelope_matches_a_fresh_hmac(self):
+        frame = json.loads(self.signer.envelope("cam", "secret", PAYLOAD))
+        self.assertEqual(frame, {"data": PAYLOAD, "signature": expected("secret", PAYLOAD)})
+
+    def test_key_is_derived_once_per_device(self):
+        for i in range(3):
+            self.assertEqual(self.signer.sign("cam", "secret", f"m{i}".encode()), expected("secret", f"m{i}"))
+        self.signer.sign("probe", "other", b"m")
+        self.assertEqual(self.signer.get_stats(), {"signed": 4, "keyed": 2, "invalidated": 0, "devices": 2})
+
+    def test_token_change_rekeys(self):
+        self.signer.sign("cam", "old", b"m")
+        self.assertEqual(self.signer.sign("cam", "new", b"m"), expected("new", "m"))
+        self.signer.invalidate("cam")
+        self.signer.invalidate("unknown")
+        self.assertEqual(self.signer.sign("cam", "new", b"m"), expected("new", "m"))
+        self.assertEqual(self.signer.get_stats()["keyed"], 3)
+        self.assertEqual(self.signer.get_stats()["invalidated"], 1)
+
+    def test_group_envelope_signs_each_member(self):
+        frame = json.loads(self.signer.group_envelope(PAYLOAD, [("a", "ta"), ("b", None), ("c", "tc")]))
+        self.assertEqual(frame["signatures"], {"a": expected("ta", PAYLOAD), "c": expected("tc", PAYLOAD)})
+
+    def test_concurrent_signing_is_consistent(self):
+        mismatches = []
+
+        def sign(i):
+            for n in range(200):
+                message = f"{i}:{n}"
+                if self.signer.sign("cam", "secret", message.encode()) != expected("secret", message):
+                    mismatches.append(message)
+
+        threads = [threading.Thread(target=sign, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(mismatches, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import time
+import unittest
+
+from bridge_mcp.command import _TIMED_OUT, CommandWaiter
+
+
+class CommandWaiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.waiter = CommandWaiter()
+
+    def register(self, rid, timeout_s=None, device_id="cam", **kwargs):
+        q = self.waiter.register(rid, device_id=device_id, tool="snap", **kwargs)
+        if timeout_s is not None:
+            self.waiter.arm_timeout(rid, time.monotonic() + timeout_s)
+        return q
+
+
+class TimerHeapTest(CommandWaiterTestCase):
+    def test_requests_expire_in_deadline_order(self):
+        queues = {rid: self.register(rid, t) for rid, t in (("slow", 0.15), ("fast", 0.05))}
+        self.assertIs(queues["fast"].get(timeout=0.12), _TIMED_OUT)
+        self.assertTrue(queues["slow"].empty())
+        self.assertIs(queues["slow"].get(timeout=0.2), _TIMED_OUT)
+        stats = self.waiter.get_stats()
+        self.assertEqual((stats["pending"], stats["timers"], stats["expired"]), (0, 0, 2))
+        self.assertEqual(self.waiter.health.get_device("cam")["timeouts"], 2)
+
+    def test_earlier_deadline_wakes_the_timer(self):
+        self.register("long", 5.0)
+        q = self.register("short", 0.05)
+        started = time.monotonic()
+        self.assertIs(q.get(timeout=1.0), _TIMED_OUT)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_answered_request_never_expires(self):
+        q = self.register("r1", 0.05)
+        self.waiter.resolve("r1", {"ok": True}, device_id="cam")
+        self.assertEqual(q.get_nowait(), {"ok": True})
+        time.sleep(0.1)
+        self.assertEqual(self.waiter.get_stats()["expired"], 0)
+        self.assertEqual(self.waiter.health.get_device("cam")["timeouts"], 0)
+
+    def test_late_response_is_counted_and_sampled(self):
+        q = self.register("r1", 0.02)
+        self.assertIs(q.get(timeout=1.0), _TIMED_OUT)
+        self.waiter.resolve("r1", {"ok": True}, device_id="other")  # wrong device: ignored
+        self.waiter.resolve("r1", {"ok": True}, device_id="cam")
+        stats = self.waiter.get_stats()
+        self.assertEqual((stats["late"], stats["unmatched"]), (1, 0))
+        self.assertEqual(sum(stats["late_ms_histogram"].values()), 1)
+        self.assertEqual(stats["late_ms_histogram"]["<=100ms"], 1)
+        self.assertEqual(self.waiter.health.get_device("cam")["responses"], 1)
+        self.assertTrue(q.empty())  # the caller already got its timeout
+
+    def test_cancelled_response_is_unmatched(self):
+        self.register("r1", 1.0)
+        self.assertEqual(self.waiter.cancel(["r1", "unknown"]), 1)
+        self.waiter.resolve("r1", {"ok": True}, device_id="cam")
+        stats = self.waiter.get_stats()
+        self.assertEqual((stats["timers"], stats["late"], stats["unmatched"]), (0, 0, 1))
+
+    def test_answered_timers_are_compacted(self):
+        for i in range(200):
+            self.register(f"r{i}", 60.0)
+            self.waiter.resolve(f"r{i}", {"ok": True}, device_id="cam")
+        self.assertLess(len(self.waiter._timers), 100)
+
+
+def chunk(seq, text=None, assets=None):
+    result = {"text": text} if text else {}
+    if assets:
+        result["assets"] = assets
+    return {"partial": True, "seq": seq, "result": result}
+
+
+class ResultStreamTest(CommandWaiterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chunks = []
+        self.q = self.register("r1", on_chunk=self.chunks.append)
+
+    def test_out_of_order_chunks_are_released_in_order(self):
+        self.waiter.resolve("r1", chunk(1, "b"), device_id="cam")
+        self.assertEqual(self.chunks, [])  # held until seq 0 arrives
+        self.waiter.resolve("r1", chunk(0, "a"), device_id="cam")
+        self.waiter.resolve("r1", chunk(0, "dup"), device_id="cam")
+        self.assertEqual([c["seq"] for c in self.chunks], [0, 1])
+        self.assertTrue(self.q.empty())
+
+    def test_final_waits_for_missing_chunks_and_merges(self):
+        self.waiter.resolve("r1", chunk(0, "a", [{"id": "x"}]), device_id="cam")
+        self.waiter.resolve("r1", {"ok": True, "seq": 3, "result": {"text": "d", "assets": [{"id": "z"}]}},
+                            device_id="cam")
+        self.waiter.resolve("r1", chunk(2, "c"), device_id="cam")
+        self.assertTrue(self.q.empty())
+        self.waiter.resolve("r1", chunk(1, "b", [{"id": "y"}]), device_id="cam")
+        resp = self.q.get_nowait()
+        self.assertEqual(resp["result"], {"text": "abcd", "assets": [{"id": "x"}, {"id": "y"}, {"id": "z"}]})
+        self.assertEqual(resp["chunks"], 3)
+        stats = self.waiter.get_stats()
+        self.assertEqual((stats["chunks"], stats["streamed"], stats["pending"]), (3, 1, 0))
+
+    def test_unsequenced_chunks_keep_arrival_order(self):
+        for text in ("a", "b"):
+            self.waiter.resolve("r1", {"partial": True, "result": {"text": text}}, device_id="cam")
+        self.waiter.resolve("r1", {"ok": True, "result": {}}, device_id="cam")
+        self.assertEqual(self.q.get_nowait()["result"]["text"], "ab")
+
+    def test_chunks_from_another_device_are_ignored(self):
+        self.waiter.resolve("r1", chunk(0, "spoofed"), device_id="other")
+        self.assertEqual(self.chunks, [])
+
+    def test_each_chunk_restarts_the_timeout(self):
+        q = self.register("r2", 0.1, on_chunk=self.chunks.append)
+        for seq in range(4):
+            time.sleep(0.05)
+            self.waiter.resolve("r2", chunk(seq, str(seq)), device_id="cam")
+        self.assertTrue(q.empty())  # 0.2s in, still alive
+        self.assertIsNotNone(self.waiter.streaming_since("r2"))
+        self.waiter.resolve("r2", {"ok": True, "seq": 4, "result": {}}, device_id="cam")
+        self.assertEqual(q.get_nowait()["result"]["text"], "0123")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import time
+import unittest
+
+from bridge_mcp.command import CommandWaiter, publish_cmd
+from bridge_mcp.device_health import BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, DeviceHealth
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+
+
+class AdaptiveTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.health = DeviceHealth(default_timeout_ms=10000, min_timeout_ms=100, min_samples=3)
+
+    def test_default_until_enough_samples(self):
+        for _ in range(2):
+            self.health.record_response("cam", "snap", 200)
+        self.assertEqual(self.health.timeout_ms("cam", "snap"), 10000)
+        self.assertIsNone(self.health.p95_ms("cam", "snap"))
+        self.health.record_response("cam", "snap", 200)
+        self.assertLess(self.health.timeout_ms("cam", "snap"), 10000)
+
+    def test_timeout_follows_latency_within_bounds(self):
+        for _ in range(20):
+            self.health.record_response("cam", "snap", 200)
+            self.health.record_response("cam", "fast", 1)
+            self.health.record_response("cam", "slow", 12000)
+        self.assertAlmostEqual(self.health.timeout_ms("cam", "snap"), 200, delta=50)
+        self.assertEqual(self.health.timeout_ms("cam", "fast"), 100)
+        self.assertEqual(self.health.timeout_ms("cam", "slow"), 10000)
+        self.assertEqual(self.health.timeout_ms("other", "snap"), 10000)
+
+    def test_ambiguous_latency_is_not_sampled(self):
+        self.health.record_response("cam", "snap", None)
+        device = self.health.get_device("cam")
+        self.assertEqual((device["responses"], device["tools"]), (1, {}))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.health = DeviceHealth(default_timeout_ms=50, failure_threshold=3, cooldown_ms=50, max_cooldown_ms=150)
+
+    def trip(self):
+        for _ in range(3):
+            self.health.record_timeout("cam")
+
+    def test_opens_after_consecutive_timeouts(self):
+        for _ in range(2):
+            self.health.record_timeout("cam")
+        self.health.record_response("cam", "snap", 10)  # a response resets the count
+        self.health.record_timeout("cam")
+        self.assertEqual(self.health.state("cam"), BREAKER_CLOSED)
+        self.trip()
+        self.assertEqual(self.health.state("cam"), BREAKER_OPEN)
+        self.assertGreater(self.health.admit("cam"), 0)
+        self.assertIsNone(self.health.admit("other"))
+        self.assertEqual(self.health.get_device("cam")["fast_failed"], 1)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.trip()
+        time.sleep(0.06)
+        self.assertIsNone(self.health.admit("cam"))
+        self.assertEqual(self.health.state("cam"), BREAKER_HALF_OPEN)
+        self.assertIsNotNone(self.health.admit("cam"))  # the probe holds the slot
+        self.health.record_response("cam", "snap", 10)
+        self.assertEqual(self.health.state("cam"), BREAKER_CLOSED)
+        self.assertIsNone(self.health.admit("cam"))
+
+    def test_failed_probe_doubles_the_cooldown_up_to_the_cap(self):
+        self.trip()
+        for cooldown_ms in (100, 150, 150):
+            time.sleep(self.health.get_device("cam")["retry_in_ms"] / 1000.0 + 0.01)
+            self.assertIsNone(self.health.admit("cam"))
+            self.health.record_timeout("cam")
+            self.assertEqual(self.health.state("cam"), BREAKER_OPEN)
+            self.assertGreater(self.health.admit("cam"), cooldown_ms - 20)
+
+    def test_announce_closes_the_breaker(self):
+        self.trip()
+        self.health.reset("cam")
+        self.assertEqual(self.health.state("cam"), BREAKER_CLOSED)
+        self.trip()
+        self.assertEqual(self.health.state("cam"), BREAKER_OPEN)  # cooldown and count start over
+
+
+class _Client:
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published += 1
+
+
+class OpenCircuitCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.store = DeviceStore(DynamicToolRegistry(projection))
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        self.store.upsert_announce("cam", {"name": "cam", "tools": [{"name": "snap"}]})
+        self.store.update_status("cam", {"online": True})
+        self.waiter = CommandWaiter(health=DeviceHealth(failure_threshold=1, cooldown_ms=10000))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_open_circuit_fails_fast_without_publishing(self):
+        client = _Client()
+        ok, resp = publish_cmd(self.store, self.waiter, client, "cam", "snap", {}, timeout_ms=50)
+        self.assertEqual((ok, resp["error"]["code"]), (False, "timeout"))
+        started = time.monotonic()
+        ok, resp = publish_cmd(self.store, self.waiter, client, "cam", "snap", {}, timeout_ms=5000)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual((ok, resp["error"]["code"], client.published), (False, "circuit_open", 1))
+        self.assertEqual(self.waiter.health.get_device("cam")["fast_failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
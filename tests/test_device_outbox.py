@@ -0,0 +1,151 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from bridge_mcp.command import CommandWaiter, flush_outbox, publish_cmd
+from bridge_mcp.config import CMD_RETRY_MAX
+from bridge_mcp.device_outbox import DeviceOutbox
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+
+
+class _Client:
+    """MQTT stand-in: records sent request ids and hands each one to on_send"""
+
+    def __init__(self, on_send=None):
+        self.sent = []
+        self.on_send = on_send
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        frame = json.loads(payload)
+        rid = json.loads(frame["data"])["request_id"] if "data" in frame else frame["request_id"]
+        self.sent.append(rid)
+        if self.on_send:
+            self.on_send(rid, len(self.sent))
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.store = DeviceStore(DynamicToolRegistry(projection))
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        self.store.upsert_announce("cam", {"name": "cam", "tools": [{"name": "snap"},
+                                                                   {"name": "scan", "idempotent": True}]})
+        self.store.update_status("cam", {"online": False})
+        self.outbox_path = os.path.join(self.tmp.name, "outbox.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _waiter(self, ttl_ms=2000, max_per_device=4):
+        return CommandWaiter(outbox=DeviceOutbox(ttl_ms=ttl_ms, max_per_device=max_per_device,
+                                                 file_path=self.outbox_path))
+
+    def _call(self, waiter, client, tool, rid, results, timeout_ms=500):
+        def run():
+            results[rid] = publish_cmd(self.store, waiter, client, "cam", tool, {}, request_id=rid,
+                                       timeout_ms=timeout_ms)
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def _until(self, condition, what):
+        for _ in range(200):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail(what)
+
+    def _wait_queued(self, waiter, n):
+        self._until(lambda: waiter.outbox.get_stats()["devices"].get("cam") == n, f"{n} commands were not queued")
+
+    def test_flush_respects_device_slots_and_order(self):
+        waiter = self._waiter()
+        waiter.scheduler.set_limit("cam", 1)
+        client = _Client()
+        results = {}
+        threads = []
+        for rid in ("r0", "r1", "r2"):
+            threads.append(self._call(waiter, client, "snap", rid, results))
+            self._wait_queued(waiter, len(threads))
+
+        self.store.update_status("cam", {"online": True})
+        self.assertEqual(flush_outbox(self.store, waiter, client, "cam"), 3)
+        # One slot: the next command goes out only once the previous one is answered
+        for i, rid in enumerate(("r0", "r1", "r2")):
+            self._until(lambda: len(client.sent) > i, f"{rid} was not sent")
+            time.sleep(0.05)
+            self.assertEqual(client.sent, ["r0", "r1", "r2"][:i + 1])
+            self.assertEqual(waiter.scheduler.get_device("cam")["in_flight"], 1)
+            waiter.resolve(rid, {"request_id": rid, "ok": True}, device_id="cam")
+            threads[i].join(timeout=2)
+        self.assertTrue(all(ok for ok, _ in results.values()))
+        self.assertEqual(waiter.scheduler.get_device("cam"), {"in_flight": 0, "queued": 0})
+
+    def test_flushed_idempotent_call_is_retried(self):
+        waiter = self._waiter()
+        client = _Client(lambda rid, n: n > 1 and waiter.resolve(rid, {"request_id": rid, "ok": True},
+                                                                  device_id="cam"))
+        results = {}
+        thread = self._call(waiter, client, "scan", "r0", results, timeout_ms=100)
+        self._wait_queued(waiter, 1)
+        self.store.update_status("cam", {"online": True})
+        flush_outbox(self.store, waiter, client, "cam")
+        thread.join(timeout=5)
+        self.assertGreaterEqual(CMD_RETRY_MAX, 1)
+        self.assertEqual(client.sent, ["r0", "r0"])
+        self.assertTrue(results["r0"][0])
+
+    def test_undelivered_command_expires(self):
+        waiter = self._waiter(ttl_ms=100)
+        client = _Client()
+        ok, resp = publish_cmd(self.store, waiter, client, "cam", "snap", {}, timeout_ms=500)
+        self.assertFalse(ok)
+        self.assertEqual(resp["error"]["stage"], "outbox")
+        self.assertEqual(client.sent, [])
+        self.assertEqual(waiter.outbox.get_stats()["withdrawn"], 1)
+
+    def test_full_outbox_fails_at_once(self):
+        waiter = self._waiter(ttl_ms=300, max_per_device=1)
+        results = {}
+        thread = self._call(waiter, _Client(), "snap", "r0", results)
+        self._wait_queued(waiter, 1)
+        ok, resp = publish_cmd(self.store, waiter, _Client(), "cam", "snap", {}, timeout_ms=500)
+        self.assertFalse(ok)
+        self.assertEqual(resp["error"]["code"], "offline")
+        thread.join(timeout=5)
+        self.assertEqual(results["r0"][1]["error"]["stage"], "outbox")
+
+    def test_changes_are_saved_together(self):
+        outbox = DeviceOutbox(ttl_ms=2000, file_path=self.outbox_path, save_delay_s=0.05)
+        for i in range(3):
+            outbox.put("cam", f"r{i}", "snap", {}, 500)
+        outbox.withdraw("cam", "r1")
+        self.assertFalse(os.path.exists(self.outbox_path))
+        self._until(lambda: os.path.exists(self.outbox_path), "the outbox was not saved")
+        with open(self.outbox_path) as f:
+            self.assertEqual([e[0] for e in json.load(f)["cam"]], ["r0", "r2"])
+
+    def test_restored_commands_are_sent_and_free_their_slot(self):
+        outbox = DeviceOutbox(ttl_ms=2000, file_path=self.outbox_path)
+        outbox.put("cam", "r0", "snap", {"a": 1}, 500)
+        outbox.flush()
+        waiter = self._waiter()  # a restarted bridge: nobody waits for r0
+        self.assertEqual(waiter.outbox.get_stats()["devices"], {"cam": 1})
+        client = _Client()
+        self.store.update_status("cam", {"online": True})
+        flush_outbox(self.store, waiter, client, "cam")
+        self._until(lambda: waiter.get_stats()["timers"] == 1, "r0 was not sent")
+        self.assertEqual(client.sent, ["r0"])
+        self.assertEqual(waiter.scheduler.get_device("cam")["in_flight"], 1)
+        waiter.resolve("r0", {"request_id": "r0", "ok": True}, device_id="cam")
+        self.assertEqual(waiter.scheduler.get_device("cam")["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
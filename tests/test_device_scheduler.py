@@ -0,0 +1,75 @@
+import unittest
+
+from bridge_mcp.device_scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_FANOUT,
+    PRIORITY_INTERACTIVE,
+    DeviceScheduler,
+)
+
+
+class DeviceSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = DeviceScheduler(max_in_flight=1)
+        self.granted = []
+        self.assertTrue(self.scheduler.submit("busy", "cam"))
+
+    def queue(self, rid, priority=PRIORITY_INTERACTIVE, caller=None):
+        granted_now = self.scheduler.submit(rid, "cam", priority, caller=caller,
+                                            on_grant=lambda: self.granted.append(rid))
+        self.assertFalse(granted_now)
+
+    def drain(self):
+        """Release whatever holds the slot until the queue is empty"""
+        holder = "busy"
+        while True:
+            before = len(self.granted)
+            self.scheduler.release(holder)
+            if len(self.granted) == before:
+                return self.granted
+            holder = self.granted[-1]
+
+    def test_unlimited_by_default(self):
+        scheduler = DeviceScheduler(max_in_flight=0)
+        self.assertTrue(all(scheduler.submit(f"r{i}", "cam") for i in range(50)))
+        self.assertEqual(scheduler.get_device("cam"), {"in_flight": 50, "queued": 0})
+
+    def test_announced_limit_applies_without_a_default(self):
+        scheduler = DeviceScheduler(max_in_flight=0)
+        scheduler.set_limit("cam", 1)
+        self.assertTrue(scheduler.submit("r0", "cam"))
+        self.assertFalse(scheduler.submit("r1", "cam"))
+        scheduler.set_limit("cam", None)
+        self.assertTrue(scheduler.submit("r1", "cam"))
+
+    def test_priority_classes_in_order(self):
+        self.queue("bg", PRIORITY_BACKGROUND)
+        self.queue("fan", PRIORITY_FANOUT)
+        self.queue("call", PRIORITY_INTERACTIVE)
+        self.assertEqual(self.drain(), ["call", "fan", "bg"])
+
+    def test_callers_take_turns_within_a_class(self):
+        for i in range(3):
+            self.queue(f"a{i}", PRIORITY_FANOUT, caller="batch-a")
+        self.queue("b0", PRIORITY_FANOUT, caller="batch-b")
+        self.queue("c0", PRIORITY_FANOUT, caller="batch-c")
+        self.assertEqual(self.drain(), ["a0", "b0", "c0", "a1", "a2"])
+
+    def test_abandoned_waiter_is_never_granted(self):
+        self.queue("r1")
+        self.queue("r2")
+        self.scheduler.abandon("r1")
+        self.assertEqual(self.drain(), ["r2"])
+        self.assertEqual(self.scheduler.get_stats()["classes"][PRIORITY_INTERACTIVE]["abandoned"], 1)
+        self.assertEqual(self.scheduler.get_device("cam"), {"in_flight": 0, "queued": 0})
+
+    def test_raising_the_limit_grants_waiters(self):
+        self.queue("r1")
+        self.queue("r2")
+        self.scheduler.set_limit("cam", 3)
+        self.assertEqual(self.granted, ["r1", "r2"])
+        self.assertEqual(self.scheduler.get_device("cam"), {"in_flight": 3, "queued": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
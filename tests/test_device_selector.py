@@ -0,0 +1,47 @@
+import unittest
+
+from bridge_mcp.device_selector import compile_selector
+
+CAM = {"device_id": "cam-1", "name": "cam", "version": "1.4.2", "tags": ["lab", "vision"], "protocol": "mqtt"}
+ARM = {"device_id": "arm-1", "name": "arm", "version": "2.0.0", "tags": ["lab"], "protocol": "ipc"}
+
+
+class CompileSelectorTest(unittest.TestCase):
+    def test_all_keys_must_match(self):
+        match = compile_selector({"tag": "lab", "name": "c*", "firmware": "1.*"})
+        self.assertTrue(match(CAM))
+        self.assertFalse(match(ARM))
+
+    def test_tags_and_protocol(self):
+        self.assertTrue(compile_selector({"tags": ["lab", "vision"]})(CAM))
+        self.assertFalse(compile_selector({"tags": ["lab", "vision"]})(ARM))
+        self.assertTrue(compile_selector({"protocol": "ipc"})(ARM))
+        self.assertFalse(compile_selector({"protocol": "ipc"})(CAM))
+
+    def test_device_ids(self):
+        match = compile_selector({"device_ids": ["arm-1"]})
+        self.assertEqual([d["device_id"] for d in (CAM, ARM) if match(d)], ["arm-1"])
+
+    def test_alias_falls_back_to_name(self):
+        self.assertTrue(compile_selector({"alias": "ar?"})(ARM))
+
+    def test_empty_values_are_rejected(self):
+        for selector in ({"tag": ""}, {"tags": []}, {"name": ""}, {"protocol": None}, {"device_ids": []},
+                         {"firmware": None}, {"alias": ""}):
+            with self.subTest(selector=selector), self.assertRaises(ValueError):
+                compile_selector(selector)
+
+    def test_wrong_types_are_rejected(self):
+        for selector in ({"tags": "lab"}, {"device_ids": "cam-1"}, {"name": 3}, {"tags": ["lab", ""]},
+                         {"protocol": "http"}):
+            with self.subTest(selector=selector), self.assertRaises(ValueError):
+                compile_selector(selector)
+
+    def test_empty_or_unknown_selector_is_rejected(self):
+        for selector in ({}, None, {"room": "lab"}):
+            with self.subTest(selector=selector), self.assertRaises(ValueError):
+                compile_selector(selector)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from bridge_mcp.command import CommandWaiter
+from bridge_mcp.config import TOPIC_GROUP_CMD
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.server import BridgeServer
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+from bridge_v2.adapters.legacy_command_bus import LegacyCommandBus
+from bridge_v2.services.command_service import CommandService
+from port_routing import PortStore, RoutingMatrix
+
+TOOLS = [{"name": "dim", "parameters": {"type": "object", "properties": {"level": {"type": "string"}}}}]
+
+
+class _Broker:
+    """MQTT stand-in: every targeted device answers ok; records the commands published"""
+
+    def __init__(self, waiter):
+        self.waiter = waiter
+        self.group_frames = []
+        self.device_commands = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        frame = json.loads(payload)
+        inner = json.loads(frame["data"]) if "data" in frame else frame
+        if topic == TOPIC_GROUP_CMD:
+            self.group_frames.append(inner)
+            answers = [(f"{inner['group_request_id']}:{d}", d) for d in inner["targets"]]
+        else:
+            self.device_commands.append(inner)
+            answers = [(inner["request_id"], topic.split("/")[2])]
+        for rid, device_id in answers:
+            threading.Timer(0.01, self.waiter.resolve, (rid, {"ok": True}), {"device_id": device_id}).start()
+
+
+class GroupCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        registry = DynamicToolRegistry(projection)
+        self.store = DeviceStore(registry)
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        waiter = CommandWaiter()
+        self.broker = _Broker(waiter)
+        commands = CommandService(LegacyCommandBus(self.store, waiter, lambda: self.broker, None))
+        self.server = BridgeServer(self.store, projection, registry, waiter, PortStore(),
+                                   RoutingMatrix(os.path.join(self.tmp.name, "routing.json")), None,
+                                   command_service=commands)
+        for i, group_cmd in enumerate((True, True, False)):
+            self.store.update_status(f"lamp{i}", {"online": True})
+            self.store.upsert_announce(f"lamp{i}", {"name": f"lamp-{i}", "tags": ["lamps"], "group_cmd": group_cmd,
+                                                    "tools": TOOLS})
+        self.store.update_status("lamp3", {"online": False})
+        self.store.upsert_announce("lamp3", {"name": "lamp-3", "tags": ["lamps"], "tools": TOOLS})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_group_capable_devices_share_one_publish(self):
+        result = self.server.execute_group({"tag": "lamps"}, "dim", {"level": "3"})
+        self.assertEqual((result["matched"], result["targeted"], result["success"]), (4, 3, 3))
+        self.assertEqual(result["skipped"], [{"device_id": "lamp3", "reason": "offline"}])
+        self.assertEqual(len(self.broker.group_frames), 1)
+        self.assertEqual(sorted(self.broker.group_frames[0]["targets"]), ["lamp0", "lamp1"])
+        self.assertEqual([c["request_id"] for c in self.broker.device_commands],
+                         [f"{result['group_request_id']}:lamp2"])
+
+    def test_string_args_are_parsed_for_every_member(self):
+        self.server.execute_group({"tag": "lamps"}, "dim", "level=3")
+        self.assertEqual(self.broker.group_frames[0]["args"], {"level": "3"})
+        self.assertEqual(self.broker.device_commands[0]["args"], {"level": "3"})
+
+    def test_invalid_selector_sends_nothing(self):
+        with self.assertRaises(ValueError):
+            self.server.execute_group({"tag": ""}, "dim", {})
+        self.assertEqual((self.broker.group_frames, self.broker.device_commands), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
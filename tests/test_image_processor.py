@@ -0,0 +1,42 @@
+import io
+import unittest
+
+from bridge_mcp.image_processor import Image, ImageProcessor
+
+
+def _jpeg(width, height):
+    buf = io.BytesIO()
+    Image.effect_noise((width, height), 40).convert("RGB").save(buf, "JPEG", quality=95)
+    return buf.getvalue()
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class ImageProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.processor = ImageProcessor(workers=2)
+        self.photo = _jpeg(800, 600)
+
+    def test_downscale_keeps_aspect_ratio(self):
+        [(body, mime)] = self.processor.process_many([(self.photo, "image/jpeg")], {"max_width": 200})
+        self.assertEqual(mime, "image/jpeg")
+        with Image.open(io.BytesIO(body)) as img:
+            self.assertEqual(img.size, (200, 150))
+
+    def test_re_encode_and_cache(self):
+        settings = {"format": "webp", "quality": 60}
+        first = self.processor.process_many([(self.photo, "image/jpeg")], settings)
+        second = self.processor.process_many([(self.photo, "image/jpeg")], settings)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0][1], "image/webp")
+        stats = self.processor.get_stats()
+        self.assertEqual((stats["processed"], stats["hits"]), (1, 1))
+
+    def test_small_images_and_bad_settings_pass_through(self):
+        images = [(self.photo, "image/jpeg"), (b"not an image", "image/png")]
+        self.assertEqual(self.processor.process_many(images, {"max_width": 1000}), images)
+        self.assertEqual(self.processor.process_many(images, {"format": "gif"}), images)
+        self.assertEqual(self.processor.get_stats()["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
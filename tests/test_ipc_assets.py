@@ -0,0 +1,67 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from bridge_mcp.asset_channel import AssetChannel
+from bridge_mcp.command import CommandWaiter
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.ipc import IPCAgent
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+from port_routing import PortStore
+
+
+def _line(topic, payload):
+    return (json.dumps({"topic": topic, "payload": payload}) + "\n").encode("utf-8")
+
+
+class AssetChunkFramingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.store = DeviceStore(DynamicToolRegistry(projection))
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        self.channel = AssetChannel()
+        self.agent = IPCAgent(self.store, CommandWaiter(), PortStore(), None, asset_channel=self.channel)
+        self.device, server = socket.socketpair()
+        self.handler = threading.Thread(target=self.agent._handle_client, args=(server,), daemon=True)
+        self.handler.start()
+
+    def tearDown(self):
+        self.device.close()
+        self.handler.join(timeout=2)
+        self.tmp.cleanup()
+
+    def _announce(self, device_id):
+        self.device.sendall(_line(f"mcp/dev/{device_id}/announce", {"name": device_id, "tools": []}))
+
+    def _closed(self) -> bool:
+        self.handler.join(timeout=2)
+        return not self.handler.is_alive()
+
+    def test_chunk_after_announce_is_stored(self):
+        self._announce("ipc-cam")
+        header = {"request_id": "r1", "asset_id": "snap", "offset": 0, "size": 5, "length": 5}
+        self.device.sendall(_line("mcp/dev/ipc-cam/assets", header) + b"hello")
+        self.assertEqual(bytes(self.channel.get("ipc-cam", "r1", "snap", 2.0)), b"hello")
+
+    def test_invalid_header_drops_the_socket(self):
+        self._announce("ipc-cam2")
+        header = {"request_id": "r1", "asset_id": "snap", "offset": 0, "size": 5, "length": "five"}
+        self.device.sendall(_line("mcp/dev/ipc-cam2/assets", header) + b'{"x":\n')
+        self.assertTrue(self._closed())
+
+    def test_chunk_before_announce_is_discarded(self):
+        header = {"request_id": "r1", "asset_id": "snap", "offset": 0, "size": 2, "length": 2}
+        # The raw bytes look like a message line: they must be skipped, not parsed
+        self.device.sendall(_line("mcp/dev/ipc-cam3/assets", header) + b"{}")
+        self._announce("ipc-cam3")
+        self.assertIsNone(self.channel.get("ipc-cam3", "r1", "snap", 0.2))
+        self.assertIsNotNone(self.store.get("ipc-cam3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from unittest import mock
+
+from bridge_mcp import utils
+from bridge_mcp.utils import json_schema_to_pydantic_model, param_model_cache_stats
+
+SCHEMA = {"type": "object", "required": ["channel"],
+          "properties": {"channel": {"type": "integer", "description": "ADC channel"},
+                         "mode": {"type": "string", "enum": ["fast", "slow"]}}}
+
+
+class ParamModelCacheTest(unittest.TestCase):
+    def setUp(self):
+        with utils._param_model_lock:
+            utils._param_model_cache.clear()
+
+    def test_same_schema_reuses_the_model(self):
+        reordered = {"properties": dict(reversed(list(SCHEMA["properties"].items()))),
+                     "required": ["channel"], "type": "object"}
+        model = json_schema_to_pydantic_model("ReadParams", SCHEMA)
+        self.assertIs(json_schema_to_pydantic_model("ReadParams", reordered), model)
+        self.assertIsNot(json_schema_to_pydantic_model("OtherParams", SCHEMA), model)
+        self.assertEqual(model(channel=2).mode, "fast")
+
+    def test_changed_schema_builds_a_new_model(self):
+        model = json_schema_to_pydantic_model("ReadParams", SCHEMA)
+        changed = {**SCHEMA, "properties": {**SCHEMA["properties"], "gain": {"type": "number"}}}
+        self.assertIsNot(json_schema_to_pydantic_model("ReadParams", changed), model)
+
+    def test_cache_is_bounded(self):
+        before = param_model_cache_stats()["evictions"]
+        with mock.patch.object(utils, "PARAM_MODEL_CACHE_SIZE", 2):
+            for i in range(3):
+                json_schema_to_pydantic_model(f"P{i}", SCHEMA)
+        stats = param_model_cache_stats()
+        self.assertEqual((stats["size"], stats["evictions"] - before), (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from bridge_mcp.command import CommandWaiter, publish_cmds
+from bridge_mcp.device_health import DeviceHealth
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+
+
+class _Devices:
+    """MQTT stand-in: each device answers after delays[device_id] seconds (never if missing)"""
+
+    def __init__(self, waiter):
+        self.waiter = waiter
+        self.delays = {}
+        self.frames = []  # (device_id, frame type, number of commands)
+        self.payloads = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.payloads.append(payload)
+        frame = json.loads(payload)
+        data = json.loads(frame["data"]) if "data" in frame else frame
+        device_id = topic.split("/")[2]
+        commands = data.get("commands") or [data]
+        self.frames.append((device_id, data.get("type"), len(commands)))
+        delay = self.delays.get(device_id)
+        if delay is None:
+            return
+        for command in commands:
+            rid = command["request_id"]
+            resp = {"request_id": rid, "ok": True, "result": {"text": f"{device_id}:{command['tool']}"}}
+            threading.Timer(delay, self.waiter.resolve, (rid, resp), {"device_id": device_id}).start()
+
+
+class PublishCmdsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.store = DeviceStore(DynamicToolRegistry(projection))
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        self.waiter = CommandWaiter()
+        self.devices = _Devices(self.waiter)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, device_id, delay, **announce):
+        self.store.upsert_announce(device_id, {"name": device_id, "tools": [{"name": "t"}], **announce})
+        self.store.update_status(device_id, {"online": True})
+        if delay is not None:
+            self.devices.delays[device_id] = delay
+
+    def run_batch(self, commands, **kwargs):
+        return publish_cmds(self.store, self.waiter, self.devices, commands, **kwargs)
+
+    def test_results_in_input_order_callbacks_in_completion_order(self):
+        self.add("slow", 0.2)
+        self.add("fast", 0.01)
+        order = []
+        started = time.monotonic()
+        results = self.run_batch([{"device_id": "slow", "tool": "t"}, {"device_id": "fast", "tool": "t"}],
+                                 on_result=lambda i, ok, resp: order.append(i))
+        self.assertLess(time.monotonic() - started, 0.4)  # concurrent, not the sum
+        self.assertEqual(order, [1, 0])
+        self.assertEqual([r[1]["result"]["text"] for r in results], ["slow:t", "fast:t"])
+
+    def test_deadline_times_out_silent_devices(self):
+        self.add("ok", 0.01)
+        self.add("silent", None)
+        results = self.run_batch([{"device_id": "ok", "tool": "t"}, {"device_id": "silent", "tool": "t"}],
+                                 deadline_ms=200)
+        self.assertEqual([ok for ok, _ in results], [True, False])
+        self.assertEqual(results[1][1]["error"]["code"], "timeout")
+
+    def test_complete_after_cancels_the_rest(self):
+        for i in range(4):
+            self.add(f"d{i}", 0.01 if i < 2 else 1.0)
+        results = self.run_batch([{"device_id": f"d{i}", "tool": "t"} for i in range(4)], complete_after=2)
+        self.assertEqual([ok for ok, _ in results], [True, True, False, False])
+        self.assertEqual({r[1]["error"]["code"] for r in results[2:]}, {"cancelled"})
+        self.assertEqual(self.waiter.get_stats()["pending"], 0)
+
+    def test_follow_ups_join_the_batch(self):
+        self.add("a", 0.01)
+        self.add("b", 0.01)
+
+        def on_result(index, ok, resp):
+            if index == 0:
+                return [{"device_id": "b", "tool": "t"}]
+
+        results = self.run_batch([{"device_id": "a", "tool": "t"}], on_result=on_result)
+        self.assertEqual([r[1]["result"]["text"] for r in results], ["a:t", "b:t"])
+
+    def test_batch_capable_device_gets_one_frame_per_cap(self):
+        self.add("esp", 0.01, batch_cmd=True)
+        self.add("old", 0.01)
+        commands = [{"device_id": d, "tool": "t"} for d in ("esp",) * 3 + ("old",) * 2]
+        results = self.run_batch(commands)
+        self.assertTrue(all(ok for ok, _ in results))
+        self.assertEqual(sorted(self.devices.frames),
+                         [("esp", "device.command_batch", 3), ("old", "device.command", 1),
+                          ("old", "device.command", 1)])
+
+    def test_per_batch_cap_holds_commands(self):
+        self.add("esp", 0.05, batch_cmd=True)
+        results = self.run_batch([{"device_id": "esp", "tool": "t"}] * 3, max_in_flight_per_device=1)
+        self.assertTrue(all(ok for ok, _ in results))
+        self.assertEqual([n for _, _, n in self.devices.frames], [1, 1, 1])
+
+
+class _IPCAgent:
+    """IPC stand-in: answers every command of each frame after 10ms"""
+
+    def __init__(self, waiter):
+        self.waiter = waiter
+        self.frames = []
+
+    def send_cmd(self, device_id, payload):
+        self.frames.append(payload)
+        for command in payload.get("commands") or [payload]:
+            rid = command["request_id"]
+            threading.Timer(0.01, self.waiter.resolve, (rid, {"request_id": rid, "ok": True}),
+                            {"device_id": device_id}).start()
+        return True
+
+
+class BatchFrameTest(PublishCmdsTest):
+    def test_one_signature_covers_the_frame(self):
+        self.add("esp", 0.01, batch_cmd=True)
+        self.store.set_token("esp", "secret")
+        commands = [{"device_id": "esp", "tool": "t", "args": {"n": i}} for i in range(3)]
+        results = self.run_batch(commands)
+        self.assertTrue(all(ok for ok, _ in results))
+        frame = json.loads(self.devices.payloads[0])
+        expected = hmac.new(b"secret", frame["data"].encode(), hashlib.sha256).hexdigest()
+        self.assertEqual(frame["signature"], expected)
+        self.assertEqual([c["args"] for c in json.loads(frame["data"])["commands"]], [{"n": 0}, {"n": 1}, {"n": 2}])
+        self.assertEqual(self.waiter.signer.get_stats()["signed"], 1)
+
+    def test_ipc_device_gets_one_line(self):
+        self.store.upsert_announce("esp", {"name": "esp", "tools": [{"name": "t"}], "batch_cmd": True}, protocol="ipc")
+        self.store.update_status("esp", {"online": True})
+        agent = _IPCAgent(self.waiter)
+        results = self.run_batch([{"device_id": "esp", "tool": "t", "args": "n=1"}] * 2, ipc_agent=agent)
+        self.assertTrue(all(ok for ok, _ in results))
+        self.assertEqual(len(agent.frames), 1)
+        self.assertEqual([c["args"] for c in agent.frames[0]["commands"]], [{"n": "1"}, {"n": "1"}])
+
+    def test_open_circuit_fails_every_command_of_the_frame(self):
+        self.waiter = CommandWaiter(health=DeviceHealth(failure_threshold=1, cooldown_ms=10000))
+        self.waiter.health.record_timeout("esp")
+        self.add("esp", 0.01, batch_cmd=True)
+        results = self.run_batch([{"device_id": "esp", "tool": "t"}] * 3)
+        self.assertEqual([resp["error"]["code"] for _, resp in results], ["circuit_open"] * 3)
+        self.assertEqual(self.devices.frames, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import threading
+import time
+import unittest
+
+from bridge_v2.services.command_service import CommandService
+from bridge_v2.services.result_cache import ToolResultCache
+
+OK = (True, {"ok": True, "result": {"celsius": 21.5}})
+
+
+class _Bus:
+    """CommandBus stand-in: counts executions and answers with `result` after `delay` seconds"""
+
+    def __init__(self, result=OK, delay=0.0):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def execute(self, device_id, tool, args, timeout_ms=None, priority=None, on_chunk=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.result
+
+
+class ToolResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ToolResultCache(max_entries=2)
+        self.bus = _Bus()
+
+    def get(self, device_id="probe", args=None, ttl_ms=1000):
+        return self.cache.get_or_execute(device_id, "read", args or {"channel": 1}, ttl_ms,
+                                         lambda: self.bus.execute(device_id, "read", args))
+
+    def test_hits_within_ttl_and_expires_after(self):
+        self.assertEqual(self.get(), OK)
+        self.assertEqual(self.get(args={"channel": 1}), OK)
+        self.assertEqual(self.bus.calls, 1)
+        self.get(args={"channel": 2})
+        self.assertEqual(self.bus.calls, 2)
+
+        self.cache.clear()
+        self.get(ttl_ms=20)
+        time.sleep(0.05)
+        self.get(ttl_ms=20)
+        self.assertEqual(self.bus.calls, 4)
+
+    def test_cached_results_are_copies(self):
+        self.get()[1]["result"]["celsius"] = 0
+        self.assertEqual(self.get()[1]["result"]["celsius"], 21.5)
+
+    def test_concurrent_calls_share_one_command(self):
+        self.bus.delay = 0.1
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.get())) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual((self.bus.calls, results), (1, [OK] * 5))
+        self.assertEqual(self.cache.get_stats()["coalesced"], 4)
+
+    def test_failures_are_not_stored(self):
+        for result in ((False, {"error": {"code": "timeout"}}), (True, {"ok": False, "error": "busy"})):
+            with self.subTest(result=result):
+                self.bus.result = result
+                self.assertEqual(self.get(), result)
+        self.assertEqual((self.bus.calls, self.cache.get_stats()["entries"]), (2, 0))
+
+    def test_invalidation_drops_entries_and_in_flight_results(self):
+        self.get()
+        self.cache.invalidate_device("probe")
+        self.get()
+        self.assertEqual(self.bus.calls, 2)
+
+        self.cache.clear()
+        self.bus.delay = 0.1
+        caller = threading.Thread(target=self.get)
+        caller.start()
+        time.sleep(0.03)
+        self.cache.invalidate_device("probe")  # re-announce while the read is in flight
+        caller.join()
+        self.assertEqual(self.cache.get_stats()["entries"], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.get("a")
+        self.get("b")
+        self.get("a")
+        self.get("c")
+        self.get("a")
+        self.assertEqual(self.bus.calls, 3)
+        self.get("b")
+        self.assertEqual((self.bus.calls, self.cache.get_stats()["evicted"]), (4, 2))
+
+
+class CommandServiceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = _Bus()
+        self.ttls = {"read": 1000}
+        self.service = CommandService(self.bus, result_cache=ToolResultCache(),
+                                      cache_ttl_ms=lambda device_id, tool: self.ttls.get(tool))
+
+    def test_only_tools_with_a_ttl_are_cached(self):
+        for tool in ("read", "read", "move", "move"):
+            self.service.execute("probe", tool, {})
+        self.assertEqual(self.bus.calls, 3)
+
+    def test_streaming_calls_bypass_the_cache(self):
+        self.service.execute("probe", "read", {})
+        self.service.execute("probe", "read", {}, on_chunk=lambda chunk: None)
+        self.assertEqual(self.bus.calls, 2)
+
+    def test_invalidate_device(self):
+        self.service.execute("probe", "read", {})
+        self.service.invalidate_device("probe")
+        self.service.execute("probe", "read", {})
+        self.assertEqual(self.bus.calls, 2)
+        self.assertEqual(self.service.get_cache_stats()["invalidated"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import asyncio
+import base64
+import os
+import tempfile
+import unittest
+
+from bridge_mcp.asset_channel import AssetChannel
+from bridge_mcp.command import CommandWaiter
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.server import BridgeServer
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+from port_routing import PortStore, RoutingMatrix
+
+READ = {"name": "read", "description": "Read the sensor",
+        "parameters": {"type": "object", "properties": {"channel": {"type": "integer"}}}}
+
+
+class _CommandService:
+    """CommandService stand-in: records calls and answers ok"""
+
+    def __init__(self):
+        self.calls = []
+        self.result = None
+
+    def execute(self, device_id, tool, args, **kwargs):
+        self.calls.append((device_id, tool, args))
+        return True, {"ok": True, "request_id": "r1", "result": self.result or {"text": f"{device_id}:{tool}"}}
+
+    def execute_many(self, commands, on_result=None, **kwargs):
+        results = []
+        for i, command in enumerate(commands):
+            results.append(self.execute(command["device_id"], command["tool"], command.get("args")))
+            if on_result:
+                on_result(i, *results[-1])
+        return results
+
+
+class _Fetcher:
+    """AssetFetcher stand-in: serves bodies from a dict"""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.prefetched = []
+
+    def fetch_many(self, urls):
+        return [self.bodies.get(url) for url in urls]
+
+    def prefetch(self, urls):
+        self.prefetched.extend(urls)
+
+
+class _Processor:
+    """ImageProcessor stand-in: re-encodes everything as webp and records the settings"""
+
+    def __init__(self):
+        self.settings = []
+
+    def process_many(self, images, settings):
+        self.settings.append(settings)
+        return [(b"webp:" + body, "image/webp") for body, _ in images]
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.registry = DynamicToolRegistry(self.projection)
+        self.store = DeviceStore(self.registry)
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        self.commands = _CommandService()
+        self.server = BridgeServer(self.store, self.projection, self.registry, CommandWaiter(), PortStore(),
+                                   RoutingMatrix(os.path.join(self.tmp.name, "routing.json")), None,
+                                   command_service=self.commands)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def set_global(self, **settings):
+        self.projection.config.setdefault("global", {}).update(settings)
+
+    def announce(self, device_id, tools=(READ,), online=True):
+        self.store.update_status(device_id, {"online": online})
+        self.store.upsert_announce(device_id, {"name": device_id, "tools": list(tools)})
+
+    def tools(self):
+        return {t.name: t for t in asyncio.run(self.server.mcp.list_tools())}
+
+    def call(self, name, arguments):
+        """Texts of an MCP tool call's content"""
+        result = asyncio.run(self.server.mcp.call_tool(name, arguments))
+        content = result[0] if isinstance(result, tuple) else result
+        return [c.text for c in content]
+
+
+class GroupedProjectionTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.set_global(group_identical_tools=True, group_enum_max=4)
+
+    def test_identical_tools_share_one_tool(self):
+        self.announce("s1")
+        self.announce("s2")
+        tools = self.tools()
+        self.assertIn("read", tools)
+        self.assertNotIn("read_s1", tools)
+        self.assertEqual(tools["read"].inputSchema["properties"]["device_id"]["enum"], ["s1", "s2"])
+
+        self.assertEqual(self.call("read", {"device_id": "s2", "params": {"channel": 1}}), ["s2:read"])
+        self.assertEqual(self.commands.calls, [("s2", "read", {"channel": 1})])
+
+    def test_offline_members_are_not_exposed(self):
+        self.announce("s1")
+        self.announce("s2")
+        # Seeded from devices.json at startup: known, but not online
+        self.store.update_status("s3", {"online": False})
+        self.registry.register_device_tools("s3", [READ], "s3")
+        self.server.reconcile_tools()
+        self.assertEqual(self.tools()["read"].inputSchema["properties"]["device_id"]["enum"], ["s1", "s2"])
+
+    def test_group_without_online_members_is_removed(self):
+        self.announce("s1")
+        self.assertIn("read", self.tools())
+        self.store.update_status("s1", {"online": False})
+        self.server.reconcile_tools()
+        self.assertNotIn("read", self.tools())
+
+
+class AssetContentTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.announce("cam", tools=[{"name": "snap", "parameters": {"type": "object", "properties": {}}}])
+        self.commands.result = {"text": "snapped", "assets": [
+            {"kind": "image", "mime": "image/png", "url": "http://cam/a.png"},
+            {"kind": "image", "mime": "image/png", "url": "http://cam/missing.png"},
+        ]}
+
+    def test_images_come_from_the_servers_fetcher(self):
+        self.server.asset_fetcher = _Fetcher({"http://cam/a.png": b"png-bytes"})
+        content = asyncio.run(self.server.mcp.call_tool("snap", {"params": {}}))
+        content = content[0] if isinstance(content, tuple) else content
+        self.assertEqual([c.type for c in content], ["image", "text"])
+        self.assertEqual(base64.b64decode(content[0].data), b"png-bytes")
+
+    def test_invoke_many_prefetches_with_the_servers_fetcher(self):
+        self.server.asset_fetcher = _Fetcher({})
+        self.server._invoke_many([{"device_id": "cam", "tool": "snap"}])
+        self.assertEqual(self.server.asset_fetcher.prefetched, ["http://cam/a.png", "http://cam/missing.png"])
+
+    def test_images_go_through_the_servers_processor(self):
+        self.set_global(images={"format": "webp", "max_width": 640})
+        self.server.asset_fetcher = _Fetcher({"http://cam/a.png": b"png-bytes"})
+        self.server.image_processor = _Processor()
+        content = asyncio.run(self.server.mcp.call_tool("snap", {"params": {}}))
+        content = content[0] if isinstance(content, tuple) else content
+        self.assertEqual((content[0].mimeType, base64.b64decode(content[0].data)), ("image/webp", b"webp:png-bytes"))
+        self.assertEqual(self.server.image_processor.settings, [{"format": "webp", "max_width": 640}])
+
+    def test_pushed_images_come_from_the_servers_channel(self):
+        self.server.asset_channel = AssetChannel()
+        self.server.asset_channel.put("cam", "r1", "snap", 0, 4, b"jpeg")
+        self.commands.result = {"assets": [{"kind": "image", "mime": "image/jpeg", "asset_id": "snap"}]}
+        content = asyncio.run(self.server.mcp.call_tool("snap", {"params": {}}))
+        content = content[0] if isinstance(content, tuple) else content
+        self.assertEqual([base64.b64decode(c.data) for c in content], [b"jpeg"])
+
+    def test_url_images_are_skipped_without_a_fetcher(self):
+        self.assertEqual(self.call("snap", {"params": {}}), ["snapped"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+
+from mcp.server.fastmcp import FastMCP
+
+from bridge_mcp.tool_reconciler import DesiredTool, ToolReconciler
+
+
+class _Notifier:
+    def __init__(self):
+        self.scheduled = 0
+
+    def schedule(self):
+        self.scheduled += 1
+
+
+class ToolReconcilerTest(unittest.TestCase):
+    def setUp(self):
+        self.mcp = FastMCP("test")
+        self.notifier = _Notifier()
+        self.reconciler = ToolReconciler(self.mcp, self.notifier)
+        self.builds = []
+
+    def tool(self, name, owner, fingerprint="v1"):
+        def build():
+            self.builds.append(owner)
+
+            def fn() -> str:
+                return f"{owner}:{fingerprint}"
+            fn.__doc__ = f"{owner} {fingerprint}"
+            return fn
+        return DesiredTool(name, fingerprint, build)
+
+    def listed(self):
+        return {t.name: t.description for t in asyncio.run(self.mcp.list_tools())}
+
+    def test_only_changes_are_applied(self):
+        counts = self.reconciler.reconcile("device:a", {"k1": self.tool("snap", "a"), "k2": self.tool("read", "a")})
+        self.assertEqual(counts, {"added": 2, "updated": 0, "removed": 0})
+        self.builds.clear()
+
+        counts = self.reconciler.reconcile("device:a", {"k1": self.tool("snap", "a"),
+                                                        "k2": self.tool("read", "a", "v2")})
+        self.assertEqual(counts, {"added": 0, "updated": 1, "removed": 0})
+        self.assertEqual(self.builds, ["a"])  # the unchanged tool was not rebuilt
+        self.assertEqual(self.listed(), {"snap": "a v1", "read": "a v2"})
+
+        self.assertEqual(self.reconciler.reconcile("device:a", {"k1": self.tool("snap", "a")})["removed"], 1)
+        self.assertEqual(self.listed(), {"snap": "a v1"})
+        self.assertEqual(self.notifier.scheduled, 3)
+        self.reconciler.reconcile("device:a", {"k1": self.tool("snap", "a")})
+        self.assertEqual(self.notifier.scheduled, 3)  # nothing changed, nothing sent
+
+    def test_scopes_are_independent(self):
+        self.reconciler.reconcile("device:a", {"a": self.tool("snap_a", "a")})
+        self.reconciler.reconcile("device:b", {"b": self.tool("snap_b", "b")})
+        self.reconciler.reconcile("device:a", {})
+        self.assertEqual(set(self.listed()), {"snap_b"})
+        self.assertEqual(self.reconciler.scopes(), ["device:b"])
+
+    def test_shared_name_is_handed_to_the_next_owner(self):
+        self.reconciler.reconcile("device:a", {"a": self.tool("snap", "a")})
+        self.reconciler.reconcile("device:b", {"b": self.tool("snap", "b")})
+        self.assertEqual(self.listed(), {"snap": "a v1"})
+        self.reconciler.reconcile("device:a", {})
+        self.assertEqual(self.listed(), {"snap": "b v1"})
+        self.reconciler.reconcile("device:b", {})
+        self.assertEqual(self.listed(), {})
+
+    def test_update_by_a_waiting_owner_does_not_replace_the_installed_tool(self):
+        self.reconciler.reconcile("device:a", {"a": self.tool("snap", "a")})
+        self.reconciler.reconcile("device:b", {"b": self.tool("snap", "b")})
+        self.reconciler.reconcile("device:b", {"b": self.tool("snap", "b", "v2")})
+        self.assertEqual(self.listed(), {"snap": "a v1"})
+        self.reconciler.reconcile("device:a", {})
+        self.assertEqual(self.listed(), {"snap": "b v2"})
+
+    def test_static_tools_are_never_overwritten(self):
+        @self.mcp.tool(name="invoke")
+        def invoke() -> str:
+            """static"""
+            return "static"
+
+        self.reconciler.reconcile("device:a", {"a": self.tool("invoke", "a")})
+        self.assertEqual(self.listed(), {"invoke": "static"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+from bridge_mcp.tool_search import ToolSearchIndex, tokenize
+
+SNAP = {"name": "snap", "description": "Take a camera snapshot",
+        "parameters": {"type": "object", "properties": {"exposure_ms": {"type": "integer"}}}}
+READ = {"name": "read_temperature", "description": "Read the temperature sensor",
+        "parameters": {"type": "object", "properties": {"channel": {"type": "integer"}}}}
+
+
+class RegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.tmp.name, "projection.json")
+        self.projection = ToolProjectionStore(self.config_path)
+        self.registry = DynamicToolRegistry(self.projection)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def keys(self, device_id):
+        return sorted(t["tool_key"] for t in self.registry.get_device_tools(device_id))
+
+    def edit_config(self, edit):
+        with open(self.config_path) as f:
+            config = json.load(f)
+        edit(config)
+        with open(self.config_path, "w") as f:
+            json.dump(config, f)
+        return self.projection.reload_config()
+
+
+class DeviceIndexTest(RegistryTestCase):
+    def test_devices_with_similar_ids_are_kept_apart(self):
+        self.registry.register_device_tools("1", [SNAP, READ])
+        self.registry.register_device_tools("d1", [SNAP])
+        self.assertEqual(self.keys("1"), ["read_temperature_1", "snap_1"])
+        self.assertEqual(self.keys("d1"), ["snap_d1"])
+        self.assertEqual(len(self.registry.find_tools_by_name("snap")), 2)
+
+    def test_re_announce_drops_stale_tools(self):
+        self.registry.register_device_tools("cam", [SNAP, READ])
+        self.registry.register_device_tools("cam", [SNAP])
+        self.assertEqual(self.keys("cam"), ["snap_cam"])
+        self.assertEqual(self.registry.find_tools_by_name("read_temperature"), [])
+        self.assertEqual(self.registry.search_tools("temperature"), [])
+
+    def test_unregister_clears_every_index(self):
+        self.registry.register_device_tools("cam", [SNAP])
+        removed = self.registry.unregister_device("cam")
+        self.assertEqual([t["tool_key"] for t in removed], ["snap_cam"])
+        self.assertFalse(self.registry.has_device("cam"))
+        self.assertEqual((self.registry.list_groups(), self.registry.get_group_ids_for_name("snap")), ({}, set()))
+
+    def test_reload_reprojects_only_changed_devices(self):
+        self.registry.register_device_tools("a", [SNAP])
+        self.registry.register_device_tools("b", [SNAP])
+        affected = self.edit_config(lambda c: c["devices"]["b"]["tools"]["snap"].update(alias="photo"))
+        self.assertEqual(affected, {"b"})
+        removed = self.registry.reproject_devices(affected)
+        self.assertEqual({d: [t["tool_key"] for t in r] for d, r in removed.items()}, {"b": ["snap_b"]})
+        self.assertEqual((self.keys("a"), self.keys("b")), (["snap_a"], ["photo_b"]))
+
+    def test_identical_schemas_share_a_group(self):
+        self.registry.register_device_tools("a", [SNAP])
+        self.registry.register_device_tools("b", [SNAP])
+        self.registry.register_device_tools("c", [{**SNAP, "description": "Different"}])
+        groups = self.registry.get_group_ids_for_name("snap")
+        self.assertEqual(len(groups), 2)
+        shared = next(g for g in groups if self.registry.get_group_size(g) == 2)
+        self.assertEqual(self.registry.get_group_member(shared, "b")["tool_key"], "snap_b")
+        self.assertIsNone(self.registry.get_group_member(shared, "c"))
+
+
+class ToolSearchTest(RegistryTestCase):
+    def test_identifiers_are_split(self):
+        self.assertEqual(tokenize("readTemperature exposure_ms"),
+                         ["read", "temperature", "readtemperature", "exposure", "ms"])
+
+    def test_ranking_prefers_name_matches(self):
+        self.registry.register_device_tools("cam", [SNAP])
+        self.registry.register_device_tools("probe", [READ, {"name": "calibrate",
+                                                             "description": "Calibrate after a temperature change"}])
+        hits = self.registry.search_tools("temperature")
+        self.assertEqual([h["tool_key"] for h in hits], ["read_temperature_probe", "calibrate_probe"])
+        self.assertGreater(hits[0]["score"], hits[1]["score"])
+        self.assertEqual(self.registry.search_tools("exposure")[0]["tool_key"], "snap_cam")
+
+    def test_limit_and_no_match(self):
+        index = ToolSearchIndex()
+        for i in range(5):
+            index.add(f"t{i}", [("camera snapshot", 1)])
+        self.assertEqual(len(index.search("camera", limit=3)), 3)
+        self.assertEqual(index.search("weather"), [])
+        index.remove("t0")
+        self.assertEqual(index.get_stats()["documents"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
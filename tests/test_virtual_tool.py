@@ -0,0 +1,241 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from bridge_mcp import virtual_tool
+from bridge_mcp.command import CommandWaiter
+from bridge_mcp.device_store import DeviceStore
+from bridge_mcp.tool_projection import ToolProjectionStore
+from bridge_mcp.tool_registry import DynamicToolRegistry
+from bridge_mcp.virtual_tool import VirtualToolExecutor, VirtualToolStore
+
+
+class _Devices:
+    """MQTT stand-in: answers each command with replies[device_id](args) after delays[device_id] seconds"""
+
+    def __init__(self, waiter):
+        self.waiter = waiter
+        self.replies = {}
+        self.delays = {}
+        self.sent = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        frame = json.loads(payload)
+        command = json.loads(frame["data"]) if "data" in frame else frame
+        device_id = topic.split("/")[2]
+        self.sent.append((device_id, command["tool"], command["args"]))
+        reply = self.replies.get(device_id)
+        if reply is None:
+            return
+        resp = {"request_id": command["request_id"], **reply(command["args"])}
+        threading.Timer(self.delays.get(device_id, 0.01), self.waiter.resolve,
+                        (command["request_id"], resp), {"device_id": device_id}).start()
+
+
+class VirtualToolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        projection = ToolProjectionStore(os.path.join(self.tmp.name, "projection.json"))
+        self.store = DeviceStore(DynamicToolRegistry(projection))
+        self.store.file_path = os.path.join(self.tmp.name, "devices.json")
+        self.waiter = CommandWaiter()
+        self.devices = _Devices(self.waiter)
+        self.vt_store = VirtualToolStore(os.path.join(self.tmp.name, "virtual_tools.json"))
+        self.executor = VirtualToolExecutor(self.vt_store, self.store, self.waiter, lambda: self.devices)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add_device(self, device_id, reply=lambda args: {"ok": True, "result": {"text": "done"}}, delay=0.01,
+                   tools=("t",), online=True):
+        tools = [t if isinstance(t, dict) else {"name": t} for t in tools]
+        self.store.upsert_announce(device_id, {"name": device_id, "tools": tools})
+        self.store.update_status(device_id, {"online": online})
+        self.devices.replies[device_id] = reply
+        self.devices.delays[device_id] = delay
+
+
+class FanOutTest(VirtualToolTestCase):
+    def test_bindings_run_concurrently_in_binding_order(self):
+        for i in range(3):
+            self.add_device(f"d{i}", reply=lambda args: {"ok": True, "result": dict(args)}, delay=0.2)
+        bindings = [{"device_id": f"d{i % 3}", "tool": "t"} for i in range(6)]
+        self.vt_store.create_virtual_tool("v", {"bindings": bindings})
+        started = time.monotonic()
+        result = self.executor.execute_sync("v", {"n": 1})
+        self.assertLess(time.monotonic() - started, 0.6)  # one round trip, not six
+        self.assertTrue(result["ok"])
+        self.assertEqual([(r["id"], r["device_id"]) for r in result["results"]],
+                         [(f"b{i}", f"d{i % 3}") for i in range(6)])
+
+    def test_per_device_cap_holds_bindings(self):
+        self.add_device("d0", delay=0.1)
+        self.vt_store.create_virtual_tool("v", {"bindings": [{"device_id": "d0", "tool": "t"}] * 3})
+        started = time.monotonic()
+        with mock.patch.object(virtual_tool, "VIRTUAL_TOOL_MAX_INFLIGHT_PER_DEVICE", 1):
+            result = self.executor.execute_sync("v", {})
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertEqual(result["success"], 3)
+
+    def test_args_are_filtered_by_each_tool_schema(self):
+        self.add_device("cam", tools=[{"name": "snap", "parameters": {"type": "object",
+                                                                      "properties": {"exposure": {"type": "integer"}}}}])
+        self.add_device("lamp", tools=[{"name": "on", "parameters": {"type": "object", "properties": {}}}])
+        self.vt_store.create_virtual_tool("v", {"bindings": [{"device_id": "cam", "tool": "snap"},
+                                                             {"device_id": "lamp", "tool": "on"}]})
+        self.executor.execute_sync("v", {"exposure": 10, "color": "red"})
+        self.assertEqual(sorted(self.devices.sent), [("cam", "snap", {"exposure": 10}), ("lamp", "on", {})])
+
+    def test_offline_devices_are_skipped(self):
+        self.add_device("d0")
+        self.add_device("d1", online=False)
+        self.vt_store.create_virtual_tool("v", {"bindings": [{"device_id": d, "tool": "t"}
+                                                             for d in ("d0", "d1", "ghost")]})
+        result = self.executor.execute_sync("v", {})
+        self.assertEqual([d for d, _, _ in self.devices.sent], ["d0"])
+        self.assertEqual([r.get("error") for r in result["results"]], [None, "Device is offline", "Device is offline"])
+        self.assertEqual(result["success"], 1)
+
+
+class CompletionPolicyTest(VirtualToolTestCase):
+    def run_policy(self, completion, deadline_ms=1000):
+        bindings = [{"device_id": f"d{i}", "tool": "t"} for i in range(4)]
+        self.vt_store.create_virtual_tool("v", {"bindings": bindings, "completion": completion,
+                                                "deadline_ms": deadline_ms})
+        return self.executor.execute_sync("v", {})
+
+    def test_first_k_returns_early_and_cancels_the_rest(self):
+        for i in range(4):
+            self.add_device(f"d{i}", delay=0.02 if i < 2 else 0.5)
+        result = self.run_policy({"mode": "first_k", "k": 2})
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["success"], 2)
+        self.assertEqual(result["cancelled"], 2)
+        self.assertEqual(self.waiter.get_stats()["pending"], 0)
+
+    def test_device_errors_do_not_count_as_success(self):
+        failing = lambda args: {"ok": False, "error": {"code": "busy", "message": "motor busy"}}
+        for i in range(3):
+            self.add_device(f"d{i}", reply=failing, delay=0.05)
+        self.add_device("d3", delay=0.01)
+        result = self.run_policy({"mode": "first_k", "k": 2})
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["success"], 1)
+        self.assertEqual(result["failed"], 3)
+        errors = [r.get("error") for r in result["results"] if not r["ok"]]
+        self.assertEqual(errors, ["motor busy"] * 3)
+
+    def test_best_effort_with_only_device_errors_fails(self):
+        for i in range(4):
+            self.add_device(f"d{i}", reply=lambda args: {"ok": False, "error": "no camera"})
+        result = self.run_policy({"mode": "best_effort"})
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["success"], 0)
+
+    def test_quorum_counts_offline_bindings_against_the_policy(self):
+        for i in range(4):
+            self.add_device(f"d{i}", online=i < 2)
+        self.assertFalse(self.run_policy({"mode": "quorum", "percent": 75})["ok"])
+        self.assertTrue(self.run_policy({"mode": "quorum", "percent": 50})["ok"])
+
+    def test_invalid_policy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.vt_store.create_virtual_tool("bad", {"bindings": [{"device_id": "d0", "tool": "t"}],
+                                                      "completion": {"mode": "quorum", "percent": 0}})
+
+
+class DependencyGraphTest(VirtualToolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_device("sensor", reply=lambda args: {"ok": True, "result": {"value": [21.5, 30]}})
+        self.add_device("fan")
+        self.add_device("lamp")
+
+    def test_results_are_piped_to_dependents(self):
+        self.vt_store.create_virtual_tool("climate", {"bindings": [
+            {"id": "t", "device_id": "sensor", "tool": "t", "args_map": {"unit": "unit"}},
+            {"id": "f", "device_id": "fan", "tool": "t", "args_map": {"speed": "$t.result.value.1", "unit": "unit"}},
+            {"id": "l", "device_id": "lamp", "tool": "t", "depends_on": ["f"]},
+        ]})
+        result = self.executor.execute_sync("climate", {"unit": "C"})
+        self.assertTrue(result["ok"])
+        self.assertEqual(self.devices.sent, [("sensor", "t", {"unit": "C"}), ("fan", "t", {"speed": 30, "unit": "C"}),
+                                             ("lamp", "t", {})])
+
+    def test_failed_upstream_skips_the_whole_chain(self):
+        self.vt_store.create_virtual_tool("broken", {"bindings": [
+            {"id": "t", "device_id": "ghost", "tool": "t"},
+            {"id": "f", "device_id": "fan", "tool": "t", "args_map": {"speed": "$t.result"}},
+            {"id": "l", "device_id": "lamp", "tool": "t", "depends_on": ["f"]},
+            {"id": "x", "device_id": "lamp", "tool": "t"},
+        ]})
+        result = self.executor.execute_sync("broken", {})
+        self.assertEqual([(r["id"], r.get("error")) for r in result["results"]],
+                         [("t", "Device is offline"), ("f", "Upstream binding 't' failed"),
+                          ("l", "Upstream binding 'f' failed"), ("x", None)])
+        self.assertEqual(self.devices.sent, [("lamp", "t", {})])
+
+    def test_device_error_upstream_skips_dependents(self):
+        self.devices.replies["sensor"] = lambda args: {"ok": False, "error": "no probe"}
+        self.vt_store.create_virtual_tool("v", {"bindings": [
+            {"id": "t", "device_id": "sensor", "tool": "t"},
+            {"id": "f", "device_id": "fan", "tool": "t", "depends_on": ["t"]},
+        ]})
+        result = self.executor.execute_sync("v", {})
+        self.assertEqual([r.get("error") for r in result["results"]], ["no probe", "Upstream binding 't' failed"])
+
+    def test_invalid_graphs_are_rejected(self):
+        for bindings in ([{"id": "a", "device_id": "x", "tool": "t", "depends_on": ["b"]},
+                          {"id": "b", "device_id": "x", "tool": "t", "depends_on": ["a"]}],
+                         [{"id": "a", "device_id": "x", "tool": "t", "args_map": {"q": "$zz.r"}}],
+                         [{"id": "a", "device_id": "x", "tool": "t"}, {"id": "a", "device_id": "y", "tool": "t"}]):
+            with self.subTest(bindings=bindings), self.assertRaises(ValueError):
+                self.vt_store.create_virtual_tool("bad", {"bindings": bindings})
+        with self.assertRaises(ValueError):  # completion policies cannot cut a pipeline short
+            self.vt_store.create_virtual_tool("bad", {"completion": {"mode": "any"}, "bindings": [
+                {"id": "a", "device_id": "x", "tool": "t"},
+                {"id": "b", "device_id": "y", "tool": "t", "depends_on": ["a"]}]})
+
+
+class PlanCacheTest(VirtualToolTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_device("d0", tools=[{"name": "t", "parameters": {"type": "object",
+                                                                  "properties": {"a": {"type": "integer"}}}}])
+        self.vt_store.create_virtual_tool("v", {"bindings": [{"device_id": "d0", "tool": "t"}]})
+
+    def test_plan_is_reused_until_something_changes(self):
+        plan = self.vt_store.compile("v", self.store)
+        self.assertIs(self.vt_store.compile("v", self.store), plan)
+        self.assertEqual(self.vt_store.get_plan_stats(), {"hits": 1, "compiles": 1, "cached": 1})
+        self.assertEqual(sorted(plan.schema["properties"]), ["a"])
+
+    def test_re_announce_recompiles(self):
+        plan = self.vt_store.compile("v", self.store)
+        self.store.upsert_announce("d0", {"name": "d0", "tools": [{"name": "t", "parameters": {
+            "type": "object", "properties": {"b": {"type": "integer"}}}}]})
+        recompiled = self.vt_store.compile("v", self.store)
+        self.assertIsNot(recompiled, plan)
+        self.assertEqual(sorted(recompiled.schema["properties"]), ["b"])
+
+    def test_unchanged_announce_keeps_the_plan(self):
+        plan = self.vt_store.compile("v", self.store)
+        self.store.upsert_announce("d0", {"name": "d0", "schema_hash": self.store.get("d0")["schema_hash"]})
+        self.store.update_status("d0", {"online": False})
+        self.assertIs(self.vt_store.compile("v", self.store), plan)
+
+    def test_config_edits_recompile(self):
+        plan = self.vt_store.compile("v", self.store)
+        self.vt_store.update_virtual_tool("v", {"bindings": [{"device_id": "d0", "tool": "t"}] * 2})
+        self.assertEqual(len(self.vt_store.compile("v", self.store).bindings), 2)
+        self.vt_store.delete_virtual_tool("v")
+        self.assertIsNone(self.vt_store.compile("v", self.store))
+        self.assertIsNotNone(plan)
+
+
+if __name__ == "__main__":
+    unittest.main()